@@ -0,0 +1,232 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+
+class RateLimit(NamedTuple):
+    """A token bucket: ``burst`` requests at once, refilled at ``rate`` per second."""
+    rate: float
+    burst: float
+
+
+def parse_rate(spec: str) -> Optional[RateLimit]:
+    """Parse ``"<requests>/<seconds>"`` (e.g. ``"10/60"``); ``""`` or ``"0"`` means unlimited."""
+    spec = spec.strip()
+    if not spec or spec == "0":
+        return None
+    requests, _, seconds = spec.partition("/")
+    try:
+        requests, seconds = float(requests), float(seconds or 1)
+    except ValueError:
+        raise ValueError(f"Rate limits look like '10/60' (requests per seconds), not {spec!r}")
+    if requests <= 0 or seconds <= 0:
+        raise ValueError(f"Rate limit {spec!r} must be positive")
+    return RateLimit(requests / seconds, requests)
+
+
+class BucketStore:
+    """Where token buckets are kept.
+
+    ``take`` removes ``cost`` tokens from the bucket at ``key`` and returns 0,
+    or, when the bucket holds too few, leaves it untouched and returns the
+    seconds until it will have enough. Buckets start full. It is async so a
+    store shared between workers can live in another service.
+    """
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryBucketStore(BucketStore):
+    """Buckets in a dict local to the process, at most ``max_keys`` of them.
+
+    The least recently used bucket is dropped when the store is full; a
+    dropped bucket comes back full, which only ever errs towards admitting.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.evictions = 0
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = limit.burst
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            tokens, updated = bucket
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / limit.rate
+        self._buckets[key] = (tokens, now)
+        return wait
+
+    def stats(self) -> dict:
+        return {"store": "memory", "buckets": len(self._buckets), "evictions": self.evictions}
+
+
+class ConcurrencyLimiter:
+    """Caps how many requests run at once.
+
+    Requests over ``limit`` wait in a queue of at most ``max_queue`` for up to
+    ``queue_timeout`` seconds. ``acquire`` returns False for a request that
+    found the queue full or timed out waiting; it must not run.
+    """
+
+    def __init__(self, limit: int, max_queue: int = 100, queue_timeout: float = 5.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                return False
+            finally:
+                self.waiting -= 1
+                self.wait_seconds += time.monotonic() - started
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "queued": self.queued,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class AdmissionControl:
+    """Per-client rate limits and a concurrency cap, applied by :class:`AdmissionMiddleware`.
+
+    ``classify(method, path)`` names the route class of a request, or None
+    for requests admitted unconditionally (health checks, the static
+    catalog, event streams). A classified request takes a token from the
+    bucket keyed by its class and ``identify(scope, route_class)``, if the
+    class has a limit in ``limits``, and is answered 429 when the bucket is
+    empty. It then runs under ``limiter``, which answers 503 when the server
+    is saturated. Both carry a Retry-After header.
+
+    Classes no route maps to can still be limited by the routes themselves
+    through :meth:`take`, for keys only the request body reveals.
+    """
+
+    def __init__(
+        self,
+        classify: Callable[[str, str], Optional[str]],
+        identify: Callable[[dict, str], str],
+        limits: Dict[str, RateLimit],
+        store: BucketStore,
+        limiter: Optional[ConcurrencyLimiter] = None,
+    ):
+        self.classify = classify
+        self.identify = identify
+        self.limits = limits
+        self.store = store
+        self.limiter = limiter
+        self.rate_limited: Dict[str, int] = {route_class: 0 for route_class in limits}
+
+    async def take(self, route_class: str, identity: str) -> float:
+        """Take a token from ``route_class``'s bucket for ``identity``; 0 admits, else seconds to wait."""
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return 0.0
+        wait = await self.store.take(f"{route_class}:{identity}", limit)
+        if wait > 0:
+            self.rate_limited[route_class] += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "rate_limits": {route_class: list(limit) for route_class, limit in self.limits.items()},
+            "rate_limited": dict(self.rate_limited),
+            "buckets": self.store.stats(),
+            "concurrency": self.limiter.stats() if self.limiter is not None else None,
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware enforcing an :class:`AdmissionControl`.
+
+    Plain ASGI like the metrics middleware, so admitted requests run in the
+    same task and streaming responses pass straight through.
+    """
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        control = self.control
+        route_class = control.classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if route_class in control.limits:
+            wait = await control.take(route_class, control.identify(scope, route_class))
+            if wait > 0:
+                await _reject(scope, receive, send, 429, "Too many requests", wait)
+                return
+
+        if control.limiter is None:
+            await self.app(scope, receive, send)
+            return
+        if not await control.limiter.acquire():
+            await _reject(scope, receive, send, 503, "Server busy", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            control.limiter.release()
+
+
+async def _reject(scope, receive, send, status_code: int, detail: str, retry_after: float):
+    response = JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+    await response(scope, receive, send)
@@ -0,0 +1,134 @@
+"""Compare row-per-paper completion storage with packed per-subject bitsets.
+
+Talks to the PostgreSQL database directly (DATABASE_URL). Seeds throwaway
+users with N completed papers each, builds their bitsets, then reports the
+on-disk size of both tables (best run against an otherwise empty database)
+and the time to load and materialize one user's full completion map from
+each::
+
+    cd backend
+    python benchmarks/bitset_storage.py --users 100 --papers 500 2000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bitsets  # noqa: E402
+import main  # noqa: E402
+import postgres_storage  # noqa: E402
+
+
+def seed_users(cursor, users, papers):
+    payload = main.completion_rows({
+        main.paper_catalog.key(paper_id): {"is_completed": True, "score": paper_id % 101}
+        for paper_id in range(min(papers, len(main.paper_catalog)))
+    })
+    user_ids = []
+    for _ in range(users):
+        username = f"bench_{uuid.uuid4().hex[:10]}"
+        cursor.execute(
+            "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+            (username, f"{username}@bench.local"),
+        )
+        user_id = cursor.fetchone()[0]
+        main.storage._bulk_update_completion(cursor, user_id, payload)
+        bitsets.rebuild(cursor, user_id)
+        user_ids.append(user_id)
+    return user_ids
+
+
+def load_rows(cursor, user_id):
+    _, _, rows = postgres_storage._fetch_completion(cursor, user_id, None, None)
+    return {
+        main.completion_key(subject_id, year, session, paper, timezone): {"is_completed": bool(is_completed), "score": score}
+        for subject_id, year, session, paper, timezone, is_completed, score in rows
+    }
+
+
+def load_bitsets(cursor, user_id):
+    _, _, rows = postgres_storage._fetch_completion_bitsets(cursor, user_id, None)
+    data = {}
+    for subject_id, completed, scores in rows:
+        bitsets.decode(subject_id, completed, scores, into=data)
+    return data
+
+
+def table_size(cursor, table):
+    cursor.execute("SELECT pg_total_relation_size(%s)", (table,))
+    return cursor.fetchone()[0]
+
+
+def time_load(fn, user_id, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with main.storage.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                entries = len(fn(cursor, user_id))
+        timings.append((time.perf_counter() - started) * 1000)
+    return entries, statistics.median(timings), sorted(timings)[int(len(timings) * 0.95) - 1]
+
+
+def cleanup(cursor, user_ids):
+    for table in ("completion_bitsets", "user_progress", "completion_status"):
+        cursor.execute(f"DELETE FROM {table} WHERE user_id = ANY(%s)", (user_ids,))
+    cursor.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+
+
+def vacuum():
+    # Free the deleted rows so the next round's sizes are not inflated
+    conn = psycopg2.connect(main.storage.pool.dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("VACUUM completion_status")
+            cursor.execute("VACUUM completion_bitsets")
+    finally:
+        conn.close()
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--papers", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    if not isinstance(main.storage, postgres_storage.PostgresStorage):
+        sys.exit("bitset_storage.py needs a PostgreSQL DATABASE_URL")
+    main.storage.open()
+    main.storage.migrate(main.TIMEZONE_CONFIG)
+    print(f"{'papers':>7} {'rows KB/user':>13} {'bitset KB/user':>15} {'entries':>8} "
+          f"{'rows p50 ms':>12} {'p95':>7} {'bitset p50 ms':>14} {'p95':>7}")
+    try:
+        for papers in args.papers:
+            with main.storage.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    user_ids = seed_users(cursor, args.users, papers)
+            with main.storage.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    rows_size = table_size(cursor, "completion_status")
+                    bitset_size = table_size(cursor, "completion_bitsets")
+
+            entries, rows_p50, rows_p95 = time_load(load_rows, user_ids[0], args.repeat)
+            _, bits_p50, bits_p95 = time_load(load_bitsets, user_ids[0], args.repeat)
+            print(f"{papers:>7} {rows_size / 1024 / args.users:>13.1f} {bitset_size / 1024 / args.users:>15.1f} "
+                  f"{entries:>8} {rows_p50:>12.2f} {rows_p95:>7.2f} {bits_p50:>14.2f} {bits_p95:>7.2f}")
+
+            with main.storage.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cleanup(cursor, user_ids)
+            vacuum()
+    finally:
+        main.storage.close()
+
+
+if __name__ == "__main__":
+    run_benchmark()
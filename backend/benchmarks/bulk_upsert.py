@@ -0,0 +1,125 @@
+"""Compare the set-based /completion/bulk upsert with the old per-key loop.
+
+Talks to the PostgreSQL database directly (DATABASE_URL) so only the SQL
+path is measured. Each run registers a throwaway user, syncs N entries twice
+(first as inserts, then as updates) and reports wall time and statement
+count::
+
+    cd backend
+    python benchmarks/bulk_upsert.py --entries 1000 10000
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import postgres_storage  # noqa: E402
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+
+def legacy_bulk_update(cursor, user_id, completion_data):
+    """The pre-upsert implementation: one SELECT plus one UPDATE/INSERT per key."""
+    cursor.execute("DELETE FROM completion_status WHERE user_id = %s AND year = 2020 AND session = 'May'", (user_id,))
+    for key, value in completion_data.items():
+        subject_id, year, session, paper, timezone = main.parse_completion_key(key)
+        query = """
+            SELECT id FROM completion_status
+            WHERE user_id = %s AND subject_id = %s AND year = %s AND session = %s AND paper = %s
+        """
+        params = [user_id, subject_id, year, session, paper]
+        if timezone:
+            query += " AND timezone = %s"
+            params.append(timezone)
+        else:
+            query += " AND (timezone IS NULL OR timezone = '')"
+        cursor.execute(query, params)
+        existing = cursor.fetchone()
+        if existing:
+            cursor.execute(
+                "UPDATE completion_status SET is_completed = %s, score = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (value["is_completed"], value.get("score"), existing[0]),
+            )
+        else:
+            cursor.execute(
+                """
+                INSERT INTO completion_status (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (user_id, subject_id, year, session, paper, timezone, value["is_completed"], value.get("score")),
+            )
+
+
+def upsert_bulk_update(cursor, user_id, completion_data):
+    """The current implementation, including parsing the keys as the route does."""
+    main.storage._bulk_update_completion(cursor, user_id, main.completion_rows(completion_data))
+
+
+def synthetic_completion_data(count, score_offset=0):
+    """The first ``count`` papers of the catalog, all completed with a score."""
+    data = {}
+    for paper_id in range(min(count, len(main.paper_catalog))):
+        data[main.paper_catalog.key(paper_id)] = {
+            "is_completed": True, "score": (len(data) + score_offset) % 101,
+        }
+    return data
+
+
+def run(fn, conn, user_id, payload):
+    CountingCursor.statements = 0
+    started = time.perf_counter()
+    with conn.cursor(cursor_factory=CountingCursor) as cursor:
+        fn(cursor, user_id, payload)
+    conn.commit()
+    return time.perf_counter() - started, CountingCursor.statements
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    if not isinstance(main.storage, postgres_storage.PostgresStorage):
+        sys.exit("bulk_upsert.py needs a PostgreSQL DATABASE_URL")
+    main.storage.open()
+    main.storage.migrate(main.TIMEZONE_CONFIG)
+    main.storage.close()
+    conn = psycopg2.connect(main.storage.pool.dsn)
+    print(f"{'entries':>8} {'impl':>8} {'insert s':>9} {'stmts':>7} {'update s':>9} {'stmts':>7}")
+    try:
+        for count in args.entries:
+            for name, fn in (("loop", legacy_bulk_update), ("upsert", upsert_bulk_update)):
+                with conn.cursor() as cursor:
+                    username = f"bench_{uuid.uuid4().hex[:10]}"
+                    cursor.execute(
+                        "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+                        (username, f"{username}@bench.local"),
+                    )
+                    user_id = cursor.fetchone()[0]
+                conn.commit()
+                insert_time, insert_stmts = run(fn, conn, user_id, synthetic_completion_data(count))
+                update_time, update_stmts = run(fn, conn, user_id, synthetic_completion_data(count, score_offset=7))
+                print(f"{count:>8} {name:>8} {insert_time:>9.3f} {insert_stmts:>7} {update_time:>9.3f} {update_stmts:>7}")
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM completion_status WHERE user_id = %s", (user_id,))
+                    cursor.execute("DELETE FROM user_progress WHERE user_id = %s", (user_id,))
+                    cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_benchmark()
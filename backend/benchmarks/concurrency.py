@@ -0,0 +1,114 @@
+"""Requests/sec of the API under concurrent clients.
+
+Drives a running server with a mix of authenticated reads and writes so that
+event-loop stalls (blocking queries, password hashing) show up as lost
+throughput. Run it once against the old build and once against the new one
+with the same database::
+
+    uvicorn main:app --port 8000 &
+    python benchmarks/concurrency.py --base-url http://localhost:8000 --concurrency 50 200
+
+Requires ``httpx`` (``pip install httpx``).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+import httpx
+
+SUBJECTS = ["math_aa_hl", "physics_hl", "chemistry_sl", "economics_hl"]
+SESSIONS = ["May", "November"]
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    response = await client.post("/register", json={
+        "username": username, "email": f"{username}@bench.local", "password": password,
+    })
+    if response.status_code != 200:
+        response = await client.post("/token", data={"username": username, "password": password})
+        response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def random_completion() -> dict:
+    session = random.choice(SESSIONS)
+    year = random.randint(2016, 2024)
+    if year == 2020 and session == "May":
+        session = "November"
+    return {
+        "subject_id": random.choice(SUBJECTS),
+        "year": year,
+        "session": session,
+        "paper": f"Paper {random.randint(1, 3)}",
+        "timezone": random.choice([None, "TZ1", "TZ2"]),
+        "is_completed": True,
+        "score": random.randint(0, 100),
+    }
+
+
+async def worker(client, headers, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        roll = random.random()
+        started = time.perf_counter()
+        try:
+            if roll < 0.35:
+                response = await client.get("/completion", headers=headers)
+            elif roll < 0.6:
+                response = await client.get("/users/me", headers=headers)
+            elif roll < 0.8:
+                response = await client.get("/subjects", headers=headers)
+            else:
+                response = await client.post("/completion", json=random_completion(), headers=headers)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(base_url: str, token: str, concurrency: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(worker(client, headers, deadline, latencies, errors) for _ in range(concurrency)))
+    latencies.sort()
+    pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / duration,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per concurrency level")
+    parser.add_argument("--username", default=f"bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--password", default="bench-password")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        token = await login(client, args.username, args.password)
+
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for concurrency in args.concurrency:
+        result = await run_level(args.base_url, token, concurrency, args.duration)
+        print(f"{result['concurrency']:>8} {result['requests']:>9} {result['errors']:>7} "
+              f"{result['rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""Throughput of the streaming completion export and the COPY-based import.
+
+Drives a running server. Uploads a synthetic ``--rows`` line file (1M by
+default; papers cycle through the catalog, so later lines overwrite earlier
+ones as they would in a long history) for one user, then imports full
+histories for enough users to hold ``--rows`` rows and exports them all.
+Pass the server's PID to also report its peak resident memory::
+
+    uvicorn main:app --port 8000 &
+    python benchmarks/export_import.py --base-url http://localhost:8000 --server-pid $!
+
+Requires ``httpx`` (``pip install httpx``).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Catalog  # noqa: E402
+
+CHUNK_LINES = 10000
+
+
+def login(client: httpx.Client) -> dict:
+    username = f"bench_{uuid.uuid4().hex[:10]}"
+    response = client.post("/register", json={
+        "username": username, "email": f"{username}@bench.local", "password": "bench",
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def synthetic_lines(catalog: Catalog, rows: int, fmt: str):
+    """Yield the upload body in chunks of CHUNK_LINES lines."""
+    if fmt == "csv":
+        yield b"subject_id,year,session,paper,timezone,is_completed,score\n"
+    lines = []
+    for i in range(rows):
+        subject_id, year, session, paper, timezone = catalog.ref(i % len(catalog))
+        if fmt == "csv":
+            lines.append(f"{subject_id},{year},{session},{paper},{timezone or ''},true,{i % 101}\n")
+        else:
+            lines.append(json.dumps({
+                "subject_id": subject_id, "year": year, "session": session, "paper": paper,
+                "timezone": timezone, "is_completed": True, "score": i % 101,
+            }) + "\n")
+        if len(lines) == CHUNK_LINES:
+            yield "".join(lines).encode()
+            lines = []
+    if lines:
+        yield "".join(lines).encode()
+
+
+def peak_rss_mb(pid):
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def run_import(client, catalog, rows, fmt):
+    headers = login(client)
+    started = time.perf_counter()
+    response = client.post(
+        "/completion/import", params={"format": fmt}, headers=headers,
+        content=synthetic_lines(catalog, rows, fmt),
+    )
+    response.raise_for_status()
+    return time.perf_counter() - started, response.json()
+
+
+def run_export(client, users, fmt):
+    exported = 0
+    started = time.perf_counter()
+    for headers in users:
+        with client.stream("GET", "/completion/export", params={"format": fmt}, headers=headers) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    exported += 1
+        if fmt == "csv":
+            exported -= 1  # header
+    return time.perf_counter() - started, exported
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", nargs="+", default=["ndjson", "csv"], choices=["ndjson", "csv"])
+    parser.add_argument("--server-pid", type=int)
+    args = parser.parse_args()
+
+    with httpx.Client(base_url=args.base_url, timeout=None) as client:
+        catalog = Catalog(client.get("/timezone-config").json()["timezone_config"])
+        print(f"catalog: {len(catalog)} papers per user; server peak RSS {peak_rss_mb(args.server_pid)} MB")
+
+        for fmt in args.format:
+            elapsed, result = run_import(client, catalog, args.rows, fmt)
+            print(f"import {fmt:>6}: {args.rows} lines in {elapsed:.2f}s "
+                  f"({args.rows / elapsed:,.0f} lines/s) -> {result['imported']} rows; "
+                  f"server peak RSS {peak_rss_mb(args.server_pid)} MB")
+
+        # Full histories for enough users to export --rows rows in total
+        users = []
+        for _ in range(-(-args.rows // len(catalog))):
+            users.append(login(client))
+            client.post(
+                "/completion/import", headers=users[-1],
+                content=synthetic_lines(catalog, len(catalog), "ndjson"),
+            ).raise_for_status()
+
+        for fmt in args.format:
+            elapsed, exported = run_export(client, users, fmt)
+            print(f"export {fmt:>6}: {exported} rows from {len(users)} users in {elapsed:.2f}s "
+                  f"({exported / elapsed:,.0f} rows/s); server peak RSS {peak_rss_mb(args.server_pid)} MB")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,119 @@
+"""Cost of encoding, compressing and parsing large completion payloads.
+
+Builds synthetic completion maps of each ``--entries`` size (keys shaped like
+``GET /completion`` keys, most entries scored) and times, in process and
+without a database:
+
+* encoding the map as ``jsonable_encoder`` + ``JSONResponse`` (FastAPI's
+  default for a returned dict), as ``JSONResponse`` alone, and as
+  ``FastJSONResponse`` (orjson when installed);
+* compressing the encoded body with gzip and brotli at the per-request
+  levels, with the resulting sizes;
+* parsing a ``/completion/bulk`` body through the ``BulkCompletionStatus``
+  model and through ``parse_bulk_completion``::
+
+    cd backend
+    python benchmarks/json_payloads.py --entries 1000 10000 100000 --output json.json
+
+Reported times are medians over ``--repeat`` runs, in milliseconds.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import responses  # noqa: E402
+
+
+def completion_map(entries: int, rng: random.Random) -> dict:
+    data = {}
+    subjects = [f"subject{n}" for n in range(max(1, entries // 200))]
+    i = 0
+    while len(data) < entries:
+        subject = subjects[i % len(subjects)]
+        year = 2000 + (i // len(subjects)) % 25
+        session = ("May", "November")[(i // (len(subjects) * 25)) % 2]
+        paper = f"Paper {1 + (i // (len(subjects) * 50)) % 3}"
+        timezone = ("TZ1", "TZ2", None)[(i // (len(subjects) * 150)) % 3]
+        completed = rng.random() < 0.8
+        score = rng.randint(0, 100) if completed and rng.random() < 0.7 else None
+        data[main.completion_key(subject, year, session, paper, timezone)] = {"is_completed": completed, "score": score}
+        i += 1
+    return data
+
+
+def median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def measure(entries: int, repeat: int, rng: random.Random) -> dict:
+    data = completion_map(entries, rng)
+    body = responses.dumps(data)
+    bulk_body = responses.dumps({"completion_data": data})
+    result = {
+        "entries": entries,
+        "body_bytes": len(body),
+        "encode_ms": {
+            "jsonable_encoder+JSONResponse": median_ms(lambda: JSONResponse(jsonable_encoder(data)), repeat),
+            "JSONResponse": median_ms(lambda: JSONResponse(data), repeat),
+            "FastJSONResponse": median_ms(lambda: responses.FastJSONResponse(data), repeat),
+        },
+        "compress_ms": {
+            "gzip": median_ms(lambda: gzip.compress(body, compresslevel=responses.GZIP_LEVEL), repeat),
+        },
+        "compressed_bytes": {"gzip": len(gzip.compress(body, compresslevel=responses.GZIP_LEVEL))},
+        "parse_ms": {
+            "BulkCompletionStatus": median_ms(lambda: main.BulkCompletionStatus.parse_raw(bulk_body), repeat),
+            "parse_bulk_completion": median_ms(lambda: main.parse_bulk_completion(bulk_body), repeat),
+        },
+    }
+    if responses.brotli is not None:
+        brotli = responses.brotli
+        result["compress_ms"]["br"] = median_ms(lambda: brotli.compress(body, quality=responses.BROTLI_QUALITY), repeat)
+        result["compressed_bytes"]["br"] = len(brotli.compress(body, quality=responses.BROTLI_QUALITY))
+    return result
+
+
+def run_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"orjson: {'yes' if responses.orjson is not None else 'no'}, brotli: {'yes' if responses.brotli is not None else 'no'}")
+    results = []
+    for entries in args.entries:
+        result = measure(entries, args.repeat, rng)
+        results.append(result)
+        print(f"\n{entries} entries, {result['body_bytes'] / 1024:.0f} KiB")
+        for section in ("encode_ms", "compress_ms", "parse_ms"):
+            for name, ms in result[section].items():
+                size = result["compressed_bytes"].get(name) if section == "compress_ms" else None
+                extra = f"  ({size / 1024:.0f} KiB)" if size is not None else ""
+                print(f"  {section[:-3]:<9} {name:<30} {ms:>9.2f} ms{extra}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    run_benchmark()
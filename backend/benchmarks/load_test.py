@@ -0,0 +1,420 @@
+"""Load test of every API route with latency percentiles and DB round trips.
+
+Seeds a running server with synthetic users, each with a handful of subjects
+and a realistic completion history (``--history`` papers, mostly in their own
+subjects, most of them scored), then drives a weighted mix of ``POST /token``,
+``GET /users/me``, ``GET|POST /subjects``, ``GET|POST /completion``,
+``POST /completion/bulk`` and ``POST /feedback`` at each ``--concurrency``
+level for ``--duration`` seconds. Per route and overall it reports
+p50/p95/p99 latency, throughput, errors and database round trips per request
+(read from ``/metrics`` before and after each level), and writes everything
+as JSON for before/after comparisons::
+
+    RATE_LIMITING=false uvicorn main:app --port 8000 &
+    python benchmarks/load_test.py --users-file /tmp/load-users.json --output before.json
+    # change the backend, restart it against the same database
+    python benchmarks/load_test.py --users-file /tmp/load-users.json --output after.json --compare before.json
+
+``--users-file`` keeps the seeded accounts so later runs reuse the same data
+instead of seeding again. ``--seed`` fixes the generated histories and the
+request sequence. Writes buffered by ``WRITE_BEHIND_WINDOW`` are flushed
+outside any request, so their queries are not counted per route. All
+simulated users come from one address and log in repeatedly, so run the
+server with ``RATE_LIMITING=false`` unless the limits are what is measured;
+the concurrency cap stays on and its 503s count as errors.
+
+Requires ``httpx`` (``pip install httpx``).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Catalog  # noqa: E402
+
+PASSWORD = "load-test-password"
+SUBJECTS_PER_USER = 6
+SEED_CHUNK = 1000
+
+# Relative weight of each operation in the request mix
+DEFAULT_MIX = {
+    "completion_get": 25,
+    "completion_post": 25,
+    "users_me": 15,
+    "subjects_get": 12,
+    "completion_bulk": 6,
+    "token": 5,
+    "subjects_post": 4,
+    "feedback": 2,
+}
+
+# Method and route template of each operation, as labelled in /metrics
+ROUTES = {
+    "token": ("POST", "/token"),
+    "users_me": ("GET", "/users/me"),
+    "subjects_get": ("GET", "/subjects"),
+    "subjects_post": ("POST", "/subjects"),
+    "completion_get": ("GET", "/completion"),
+    "completion_post": ("POST", "/completion"),
+    "completion_bulk": ("POST", "/completion/bulk"),
+    "feedback": ("POST", "/feedback"),
+}
+
+METRIC_LINE = re.compile(r'^paperpath_(http_requests_total|db_queries_total)\{method="([^"]+)",route="([^"]+)"[^}]*\} (\S+)$')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def parse_mix(items):
+    mix = dict(DEFAULT_MIX)
+    for item in items or ():
+        name, _, weight = item.partition("=")
+        if name not in ROUTES or not weight:
+            raise SystemExit(f"--mix expects op=weight with op one of {', '.join(ROUTES)}")
+        mix[name] = float(weight)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise SystemExit("--mix leaves no operations to run")
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Seeding
+class LoadUser:
+    def __init__(self, username, token, subjects):
+        self.username = username
+        self.token = token
+        self.subjects = subjects
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+
+def completion_entry(rng):
+    scored = rng.random() < 0.7
+    return {"is_completed": True, "score": rng.randint(20, 100) if scored else None}
+
+
+def history(catalog, subjects, size, rng):
+    """Completion data for ``size`` papers, drawn from the user's subjects first."""
+    own = [paper_id for subject_id in subjects for paper_id in catalog.subject_ids(subject_id)]
+    rng.shuffle(own)
+    chosen = own[:size]
+    if len(chosen) < size:
+        own_ids = set(chosen)
+        others = [paper_id for paper_id in range(len(catalog)) if paper_id not in own_ids]
+        chosen += rng.sample(others, min(size - len(chosen), len(others)))
+    return {catalog.key(paper_id): completion_entry(rng) for paper_id in chosen}
+
+
+async def seed_user(client, catalog, run_id, index, history_size, rng):
+    username = f"load_{run_id}_{index}"
+    response = await client.post("/register", json={
+        "username": username, "email": f"{username}@bench.local", "password": PASSWORD,
+    })
+    response.raise_for_status()
+    # Subjects assessed without numbered papers (the arts) have nothing to track
+    trackable = [subject_id for subject_id in catalog.subjects if catalog.subject_ids(subject_id)]
+    user = LoadUser(username, response.json()["access_token"], rng.sample(trackable, SUBJECTS_PER_USER))
+    (await client.post("/subjects", json={"subjects": user.subjects}, headers=user.headers)).raise_for_status()
+    items = list(history(catalog, user.subjects, history_size, rng).items())
+    for start in range(0, len(items), SEED_CHUNK):
+        response = await client.post(
+            "/completion/bulk", json={"completion_data": dict(items[start:start + SEED_CHUNK])}, headers=user.headers,
+        )
+        response.raise_for_status()
+    return user
+
+
+async def seed(client, catalog, args, rng):
+    run_id = uuid.uuid4().hex[:8]
+    # One generator per user so histories do not depend on scheduling
+    user_rngs = [random.Random(rng.random()) for _ in range(args.users)]
+    semaphore = asyncio.Semaphore(args.seed_concurrency)
+
+    async def bounded(index):
+        async with semaphore:
+            return await seed_user(client, catalog, run_id, index, args.history, user_rngs[index])
+
+    return await asyncio.gather(*(bounded(index) for index in range(args.users)))
+
+
+async def load_users(client, path):
+    """Log the saved accounts back in; their subjects and histories are already stored."""
+    with open(path) as f:
+        saved = json.load(f)
+    users = []
+    for entry in saved["users"]:
+        response = await client.post("/token", data={"username": entry["username"], "password": PASSWORD})
+        response.raise_for_status()
+        users.append(LoadUser(entry["username"], response.json()["access_token"], entry["subjects"]))
+    return users, saved.get("history")
+
+
+def save_users(path, users, history_size):
+    with open(path, "w") as f:
+        json.dump({
+            "history": history_size,
+            "users": [{"username": user.username, "subjects": user.subjects} for user in users],
+        }, f, indent=2)
+
+
+# Load
+def random_paper(catalog, user, rng):
+    subject_ids = catalog.subject_ids(rng.choice(user.subjects))
+    return catalog.ref(rng.choice(subject_ids))
+
+
+def request_for(op, catalog, user, args, rng):
+    """(method, url, keyword arguments) of one request of the given operation."""
+    if op == "token":
+        return "POST", "/token", {"data": {"username": user.username, "password": PASSWORD}}
+    if op == "users_me":
+        return "GET", "/users/me", {"headers": user.headers}
+    if op == "subjects_get":
+        return "GET", "/subjects", {"headers": user.headers}
+    if op == "subjects_post":
+        return "POST", "/subjects", {"headers": user.headers, "json": {"subjects": user.subjects}}
+    if op == "completion_get":
+        return "GET", "/completion", {"headers": user.headers}
+    if op == "completion_post":
+        subject_id, year, session, paper, tz = random_paper(catalog, user, rng)
+        return "POST", "/completion", {"headers": user.headers, "json": {
+            "subject_id": subject_id, "year": year, "session": session, "paper": paper, "timezone": tz,
+            "is_completed": rng.random() < 0.9, "score": rng.randint(0, 100),
+        }}
+    if op == "completion_bulk":
+        data = {}
+        for _ in range(args.bulk_size):
+            subject_id, year, session, paper, tz = random_paper(catalog, user, rng)
+            key = f"{subject_id}-{year}-{session}-{paper}" + (f"-{tz}" if tz else "")
+            data[key] = {"is_completed": True, "score": rng.randint(0, 100)}
+        return "POST", "/completion/bulk", {"headers": user.headers, "json": {"completion_data": data}}
+    if op == "feedback":
+        return "POST", "/feedback", {"json": {"message": "Load test feedback", "user": user.username}}
+    raise ValueError(op)
+
+
+async def worker(client, catalog, users, mix, args, rng, deadline, results):
+    ops, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        op = rng.choices(ops, weights)[0]
+        method, url, kwargs = request_for(op, catalog, rng.choice(users), args, rng)
+        latencies, errors = results[op]
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def scrape_metrics(client):
+    """{(method, route): [requests, db queries]} from the server's /metrics."""
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    totals = {}
+    for line in response.text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, method, route, value = match.groups()
+            counts = totals.setdefault((method, route), [0, 0])
+            counts[0 if name == "http_requests_total" else 1] += float(value)
+    return totals
+
+
+def round_trips(before, after, method, route):
+    requests_before, queries_before = before.get((method, route), (0, 0))
+    requests_after, queries_after = after.get((method, route), (0, 0))
+    served = requests_after - requests_before
+    return round((queries_after - queries_before) / served, 2) if served else None
+
+
+async def run_level(args, catalog, users, mix, concurrency, rng):
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=120) as client:
+        before = await scrape_metrics(client)
+        results = {op: ([], []) for op in mix}
+        worker_rngs = [random.Random(rng.random()) for _ in range(concurrency)]
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, catalog, users, mix, args, worker_rngs[n], deadline, results) for n in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        after = await scrape_metrics(client)
+
+    routes = {}
+    total_queries = total_served = 0
+    for op, (latencies, errors) in results.items():
+        method, route = ROUTES[op]
+        trips = round_trips(before, after, method, route)
+        routes[op] = {
+            "method": method,
+            "route": route,
+            "requests": len(latencies),
+            "errors": len(errors),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            **latency_summary(latencies),
+            "db_round_trips_per_request": trips,
+        }
+        served = after.get((method, route), (0, 0))[0] - before.get((method, route), (0, 0))[0]
+        total_served += served
+        total_queries += after.get((method, route), (0, 0))[1] - before.get((method, route), (0, 0))[1]
+
+    all_latencies = [latency for latencies, _ in results.values() for latency in latencies]
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests": len(all_latencies),
+        "errors": sum(len(errors) for _, errors in results.values()),
+        "throughput_rps": round(len(all_latencies) / elapsed, 2),
+        **latency_summary(all_latencies),
+        "db_round_trips_per_request": round(total_queries / total_served, 2) if total_served else None,
+        "routes": routes,
+    }
+
+
+# Reporting
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']}: {level['requests']} requests, {level['errors']} errors, "
+          f"{level['throughput_rps']:.1f} req/s")
+    print(f"{'operation':<16} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'db trips':>9}")
+    rows = list(level["routes"].items()) + [("all", level)]
+    for op, r in rows:
+        p = lambda key: f"{r[key]:>8.1f}" if r[key] is not None else f"{'-':>8}"
+        trips = r["db_round_trips_per_request"]
+        print(f"{op:<16} {r['requests']:>9} {r['errors']:>7} {r['throughput_rps']:>8.1f} {p('p50_ms')} {p('p95_ms')} "
+              f"{p('p99_ms')} {trips if trips is not None else '-':>9}")
+
+
+def print_comparison(baseline, result):
+    """Relative change of throughput and latency percentiles against an earlier run."""
+    print(f"\nchange against {baseline.get('git_commit') or 'baseline'} (negative latency is faster)")
+    print(f"{'conc':>5} {'operation':<16} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'db trips':>9}")
+    previous_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in result["levels"]:
+        previous = previous_levels.get(level["concurrency"])
+        if previous is None:
+            continue
+        pairs = [(op, r, previous["routes"].get(op)) for op, r in level["routes"].items()] + [("all", level, previous)]
+        for op, r, old in pairs:
+            if old is None:
+                continue
+
+            def change(key):
+                if not old.get(key) or r.get(key) is None:
+                    return f"{'-':>8}"
+                return f"{(r[key] - old[key]) / old[key] * 100:>+7.1f}%"
+
+            old_trips, trips = old.get("db_round_trips_per_request"), r.get("db_round_trips_per_request")
+            trip_change = f"{old_trips}->{trips}" if old_trips != trips else "same"
+            print(f"{level['concurrency']:>5} {op:<16} {change('throughput_rps')} {change('p50_ms')} "
+                  f"{change('p95_ms')} {change('p99_ms')} {trip_change:>9}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=20, help="synthetic users to seed")
+    parser.add_argument("--history", type=int, default=2000, help="completed papers per seeded user")
+    parser.add_argument("--users-file", help="reuse the accounts saved here, or save newly seeded ones")
+    parser.add_argument("--seed-concurrency", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per concurrency level")
+    parser.add_argument("--bulk-size", type=int, default=50, help="entries per POST /completion/bulk")
+    parser.add_argument("--mix", nargs="+", metavar="OP=WEIGHT", help="override operation weights, 0 to skip")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for histories and the request mix")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="print changes against an earlier --output file")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+    # Separate from the seeding generator so reused accounts see the same requests
+    rng = random.Random(args.seed)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+        response = await client.get("/timezone-config")
+        response.raise_for_status()
+        catalog = Catalog(response.json()["timezone_config"])
+        server = (await client.get("/health")).json()
+
+        seed_started = time.perf_counter()
+        if args.users_file and os.path.exists(args.users_file):
+            users, history_size = await load_users(client, args.users_file)
+            print(f"Reusing {len(users)} users from {args.users_file}")
+        else:
+            users = await seed(client, catalog, args, random.Random(args.seed))
+            history_size = args.history
+            if args.users_file:
+                save_users(args.users_file, users, history_size)
+            print(f"Seeded {len(users)} users with {history_size} completed papers each "
+                  f"in {time.perf_counter() - seed_started:.1f}s")
+
+    result = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "base_url": args.base_url,
+        "storage": server.get("storage"),
+        "users": len(users),
+        "history_per_user": history_size,
+        "duration": args.duration,
+        "bulk_size": args.bulk_size,
+        "seed": args.seed,
+        "mix": mix,
+        "levels": [],
+    }
+    for concurrency in args.concurrency:
+        level = await run_level(args, catalog, users, mix, concurrency, rng)
+        result["levels"].append(level)
+        print_level(level)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), result)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
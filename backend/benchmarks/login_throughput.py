@@ -0,0 +1,112 @@
+"""Logins/sec and event-loop responsiveness while logins are in flight.
+
+Registers ``--users`` accounts against a running server, then has each
+concurrency level hammer ``POST /token`` for ``--duration`` seconds while a
+probe polls ``GET /health``. Hashing on the event loop shows up as probe
+latency close to the bcrypt cost; on the worker processes it stays flat and
+logins/sec scales with ``HASH_WORKERS``::
+
+    BCRYPT_ROUNDS=12 uvicorn main:app --port 8000 &
+    python benchmarks/login_throughput.py --base-url http://localhost:8000 --concurrency 1 8 32
+
+Requires ``httpx`` (``pip install httpx``).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+
+PASSWORD = "bench-password"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def register_users(client: httpx.AsyncClient, count: int):
+    usernames = [f"bench_{uuid.uuid4().hex[:10]}" for _ in range(count)]
+    for username in usernames:
+        response = await client.post("/register", json={
+            "username": username, "email": f"{username}@bench.local", "password": PASSWORD,
+        })
+        response.raise_for_status()
+    return usernames
+
+
+async def login_worker(client, usernames, offset, deadline, latencies, errors):
+    i = offset
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.post("/token", data={"username": usernames[i % len(usernames)], "password": PASSWORD})
+            if response.status_code != 200:
+                errors.append(response.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+            continue
+        finally:
+            i += 1
+        latencies.append(time.perf_counter() - started)
+
+
+async def probe(client, deadline, latencies):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        (await client.get("/health")).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+
+async def run_level(base_url, usernames, concurrency, duration):
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        latencies, probe_latencies, errors = [], [], []
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(
+            probe(client, deadline, probe_latencies),
+            *(login_worker(client, usernames, n, deadline, latencies, errors) for n in range(concurrency)),
+        )
+        elapsed = time.perf_counter() - started
+        hasher = (await client.get("/health")).json().get("password_hasher") or {}
+    return {
+        "concurrency": concurrency,
+        "logins": len(latencies),
+        "logins_per_sec": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else float("nan"),
+        "probe_p50_ms": statistics.median(probe_latencies) * 1000,
+        "probe_max_ms": max(probe_latencies) * 1000,
+        "errors": len(errors),
+        "workers": hasher.get("workers"),
+        "rounds": hasher.get("rounds"),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120) as client:
+        usernames = await register_users(client, args.users)
+
+    print(f"{'conc':>5} {'logins':>7} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'probe p50':>10} {'probe max':>10} {'errors':>7} {'workers':>8} {'rounds':>7}")
+    for concurrency in args.concurrency:
+        r = await run_level(args.base_url, usernames, concurrency, args.duration)
+        print(f"{r['concurrency']:>5} {r['logins']:>7} {r['logins_per_sec']:>9.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['probe_p50_ms']:>10.1f} {r['probe_max_ms']:>10.1f} {r['errors']:>7} "
+              f"{r['workers']!s:>8} {r['rounds']!s:>7}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
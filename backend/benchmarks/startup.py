@@ -0,0 +1,157 @@
+"""Cold-start cost of the API: import time, first request and readiness.
+
+Each run starts a fresh interpreter, so nothing is cached between runs but
+the operating system's file cache. It reports the time to ``import main``
+and, for a freshly launched uvicorn process, the time from launch until
+the first authenticated request (``GET /users/me``) is answered, until
+``GET /ready`` reports warm-up finished, and how long the first login then
+takes. Compare the eager and lazy modes against the same database::
+
+    cd backend
+    python benchmarks/startup.py --runs 5 --modes eager lazy --output startup.json
+
+The server inherits the environment (``DATABASE_URL`` and so on), with
+``LAZY_STARTUP`` set per mode. Requires ``httpx`` (``pip install httpx``).
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "startup-bench-password"
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def environment(mode: str) -> dict:
+    env = dict(os.environ)
+    env["LAZY_STARTUP"] = "true" if mode == "lazy" else "false"
+    return env
+
+
+def measure_import(mode: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND, env=environment(mode),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def launch(mode: str, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND, env=environment(mode), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def poll(client: httpx.Client, method: str, url: str, deadline: float, ok=lambda response: True, **kwargs):
+    """Retry a request until the server answers it with a 2xx for which ``ok`` holds."""
+    while time.perf_counter() < deadline:
+        try:
+            response = client.request(method, url, **kwargs)
+            if response.is_success and ok(response):
+                return response
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{method} {url} did not succeed in time")
+
+
+def register(mode: str, username: str) -> str:
+    """Create the benchmark user on a throwaway server; returns its token."""
+    port = free_port()
+    process = launch(mode, port)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            poll(client, "GET", "/ready", time.perf_counter() + 60)
+            response = client.post("/register", json={
+                "username": username, "email": f"{username}@bench.local", "password": PASSWORD,
+            })
+            response.raise_for_status()
+            return response.json()["access_token"]
+    finally:
+        stop(process)
+
+
+def measure_server(mode: str, username: str, token: str, timeout: float) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = launch(mode, port)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            deadline = started + timeout
+            poll(client, "GET", "/users/me", deadline, headers={"Authorization": f"Bearer {token}"})
+            first_request = time.perf_counter() - started
+            poll(client, "GET", "/ready", deadline)
+            ready = time.perf_counter() - started
+            login_started = time.perf_counter()
+            client.post("/token", data={"username": username, "password": PASSWORD}).raise_for_status()
+            first_login = time.perf_counter() - login_started
+    finally:
+        stop(process)
+    return {
+        "first_request_ms": first_request * 1000,
+        "ready_ms": ready * 1000,
+        "first_login_ms": first_login * 1000,
+    }
+
+
+def summarize(values):
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=["eager", "lazy"], default=["eager", "lazy"])
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds a server may take to answer")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    username = f"bench_{uuid.uuid4().hex[:10]}"
+    token = register(args.modes[0], username)
+
+    results = {"runs": args.runs, "modes": {}}
+    print(f"{'mode':<6} {'import ms':>10} {'first request ms':>17} {'ready ms':>9} {'first login ms':>15}")
+    for mode in args.modes:
+        imports, servers = [], []
+        for _ in range(args.runs):
+            imports.append(measure_import(mode))
+            servers.append(measure_server(mode, username, token, args.timeout))
+        summary = {"import_ms": summarize(imports)}
+        for key in servers[0]:
+            summary[key] = summarize([run[key] for run in servers])
+        results["modes"][mode] = summary
+        print(f"{mode:<6} {summary['import_ms']['median']:>10.1f} {summary['first_request_ms']['median']:>17.1f} "
+              f"{summary['ready_ms']['median']:>9.1f} {summary['first_login_ms']['median']:>15.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
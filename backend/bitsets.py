@@ -0,0 +1,213 @@
+"""Packed per-subject completion storage.
+
+Each (user, subject) pair is one ``completion_bitsets`` row: a bitset with one
+bit per catalog slot (set when the paper is completed) and a byte array with
+one score per slot: ``UNSCORED`` for a stored paper without a score and
+``NO_SCORE`` for a slot with no stored paper, so a paper marked not completed
+and unscored is reported as it is in rows mode. Slots come from
+:meth:`catalog.Catalog.slot`, so the layout only depends on the year, session,
+paper number and timezone and never shifts when the catalog grows.
+
+Bits are numbered like PostgreSQL's ``set_bit``: slot ``n`` is bit ``n % 8``
+(least significant first) of byte ``n // 8``.
+
+``completion_status`` stays the source of truth; these rows are a compact
+projection of it that serves full reads.
+"""
+import base64
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from catalog import EXAM_SESSIONS, FIRST_YEAR, MAX_PAPERS, SLOTS_PER_SUBJECT, TIMEZONES, Catalog
+
+logger = logging.getLogger(__name__)
+
+NO_SCORE = 255
+UNSCORED = 254
+BITSET_BYTES = (SLOTS_PER_SUBJECT + 7) // 8
+EMPTY_BITSET = bytes(BITSET_BYTES)
+EMPTY_SCORES = bytes([NO_SCORE]) * SLOTS_PER_SUBJECT
+
+
+def _slot_suffixes() -> List[str]:
+    # "-{year}-{session}-{paper}[-{TZ}]" for every slot, so decoding a set bit
+    # into a completion key is one list index and one concatenation
+    suffixes = []
+    for slot in range(SLOTS_PER_SUBJECT):
+        tz_index = slot % len(TIMEZONES)
+        paper_number = (slot // len(TIMEZONES)) % MAX_PAPERS + 1
+        session_index = slot // (len(TIMEZONES) * MAX_PAPERS)
+        year = FIRST_YEAR + session_index // len(EXAM_SESSIONS)
+        session = EXAM_SESSIONS[session_index % len(EXAM_SESSIONS)]
+        timezone = TIMEZONES[tz_index]
+        suffix = f"-{year}-{session}-Paper {paper_number}"
+        suffixes.append(f"{suffix}-{timezone}" if timezone else suffix)
+    return suffixes
+
+
+SLOT_SUFFIXES = _slot_suffixes()
+
+
+def paper_slot(year: int, session: str, paper: str, timezone: Optional[str]) -> Optional[int]:
+    """Slot of a completion_status row, or None if it has no place in the layout."""
+    if not paper.startswith("Paper ") or not paper[6:].isdigit():
+        return None
+    number = int(paper[6:])
+    if not 1 <= number <= MAX_PAPERS or session not in EXAM_SESSIONS or (timezone or None) not in TIMEZONES:
+        return None
+    slot = Catalog.slot(year, session, number, timezone)
+    return slot if 0 <= slot < SLOTS_PER_SUBJECT else None
+
+
+def encode(rows: Iterable[Tuple]) -> Tuple[bytes, bytes]:
+    """Pack ``(year, session, paper, timezone, is_completed, score)`` rows of one subject."""
+    completed = bytearray(BITSET_BYTES)
+    scores = bytearray(EMPTY_SCORES)
+    skipped = []
+    for year, session, paper, timezone, is_completed, score in rows:
+        slot = paper_slot(year, session, paper, timezone)
+        if slot is None:
+            skipped.append((year, session, paper, timezone))
+            continue
+        if is_completed:
+            completed[slot >> 3] |= 1 << (slot & 7)
+        scores[slot] = UNSCORED if score is None else score
+    if skipped:
+        logger.warning("Leaving %d papers outside the bitset layout out, e.g. %s", len(skipped), skipped[0])
+    return bytes(completed), bytes(scores)
+
+
+def decode(subject_id: str, completed: bytes, scores: bytes, into: Optional[Dict] = None) -> Dict:
+    """Expand one subject's bitset into the ``/completion`` map entries.
+
+    A slot is reported when its bit is set or its score byte is not ``NO_SCORE``.
+    """
+    result = {} if into is None else into
+    slots = set()
+    if scores != EMPTY_SCORES:
+        slots.update(slot for slot, score in enumerate(scores) if score != NO_SCORE)
+    bits = int.from_bytes(completed, "little")
+    while bits:
+        low = bits & -bits
+        slots.add(low.bit_length() - 1)
+        bits ^= low
+    for slot in sorted(slots):
+        score = scores[slot]
+        result[subject_id + SLOT_SUFFIXES[slot]] = {
+            "is_completed": bool(completed[slot >> 3] >> (slot & 7) & 1),
+            "score": None if score >= UNSCORED else score,
+        }
+    return result
+
+
+def compact_layout() -> Dict:
+    """Describes the slot layout so clients can decode the compact format."""
+    return {
+        "first_year": FIRST_YEAR,
+        "sessions": list(EXAM_SESSIONS),
+        "max_papers": MAX_PAPERS,
+        "timezones": [tz or "" for tz in TIMEZONES],
+        "slots": SLOTS_PER_SUBJECT,
+        "bit_order": "lsb0",
+        "no_score": NO_SCORE,
+        "unscored": UNSCORED,
+    }
+
+
+def compact_subject(completed: bytes, scores: bytes) -> Dict:
+    return {
+        "completed": base64.b64encode(completed).decode(),
+        "scores": base64.b64encode(scores).decode(),
+    }
+
+
+def rebuild(cursor, user_id: Optional[int] = None, subjects: Optional[Iterable[str]] = None):
+    """Recompute bitset rows from completion_status.
+
+    Limited to one user (and optionally some of their subjects) or, with no
+    arguments, every user. Subjects left without rows lose their bitset row.
+    """
+    query = """
+        SELECT user_id, subject_id, year, session, paper, timezone, is_completed, score
+        FROM completion_status
+    """
+    params = []
+    if user_id is not None:
+        query += " WHERE user_id = %s"
+        params.append(user_id)
+        if subjects is not None:
+            subjects = list(subjects)
+            query += " AND subject_id = ANY(%s)"
+            params.append(subjects)
+    query += " ORDER BY user_id, subject_id"
+    cursor.execute(query, params)
+
+    grouped: Dict[Tuple[int, str], List[Tuple]] = {}
+    for row in cursor.fetchall():
+        grouped.setdefault((row[0], row[1]), []).append(row[2:])
+
+    if user_id is None:
+        cursor.execute("DELETE FROM completion_bitsets")
+    elif subjects is None:
+        cursor.execute("DELETE FROM completion_bitsets WHERE user_id = %s", (user_id,))
+    else:
+        cursor.execute(
+            "DELETE FROM completion_bitsets WHERE user_id = %s AND subject_id = ANY(%s)", (user_id, subjects)
+        )
+    if grouped:
+        # Imported here so the SQLite backend, which shares the codec, never loads psycopg2
+        from psycopg2.extras import execute_values
+
+        execute_values(
+            cursor,
+            "INSERT INTO completion_bitsets (user_id, subject_id, completed, scores) VALUES %s",
+            [(uid, sid, *encode(rows)) for (uid, sid), rows in grouped.items()],
+        )
+
+
+def set_slot(cursor, user_id: int, subject_id: str, slot: int, is_completed: bool, score: Optional[int]):
+    """Write one paper into its subject's bitset row in a single statement."""
+    cursor.execute(
+        """
+        INSERT INTO completion_bitsets AS b (user_id, subject_id, completed, scores)
+        VALUES (%(user_id)s, %(subject_id)s,
+                set_bit(%(empty_bits)s, %(slot)s, %(bit)s),
+                set_byte(%(empty_scores)s, %(slot)s, %(score)s))
+        ON CONFLICT (user_id, subject_id) DO UPDATE SET
+            completed = set_bit(b.completed, %(slot)s, %(bit)s),
+            scores = set_byte(b.scores, %(slot)s, %(score)s),
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        {
+            "user_id": user_id,
+            "subject_id": subject_id,
+            "slot": slot,
+            "bit": 1 if is_completed else 0,
+            "score": UNSCORED if score is None else score,
+            "empty_bits": EMPTY_BITSET,
+            "empty_scores": EMPTY_SCORES,
+        },
+    )
+
+
+def fetch(cursor, user_id: int) -> List[Tuple[str, bytes, bytes]]:
+    cursor.execute(
+        "SELECT subject_id, completed, scores FROM completion_bitsets WHERE user_id = %s ORDER BY subject_id",
+        (user_id,),
+    )
+    return [(subject_id, bytes(completed), bytes(scores)) for subject_id, completed, scores in cursor.fetchall()]
+
+
+def mark_stale(cursor):
+    """Record that completion_status may have changed without the bitsets following."""
+    cursor.execute("UPDATE completion_bitsets_sync SET in_sync = FALSE WHERE in_sync")
+
+
+def ensure_synced(cursor) -> bool:
+    """Rebuild every bitset if they went stale; returns True if a rebuild ran."""
+    cursor.execute("SELECT in_sync FROM completion_bitsets_sync FOR UPDATE")
+    if cursor.fetchone()[0]:
+        return False
+    rebuild(cursor)
+    cursor.execute("UPDATE completion_bitsets_sync SET in_sync = TRUE")
+    return True
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, NamedTuple, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Keeps hit/miss/eviction counters so the effect of the cache can be read
+    from the health endpoint.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[1] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class Snapshot(NamedTuple):
+    """A serialized response body, as sent, with the headers that describe it."""
+    body: bytes
+    etag: str
+    cursor: Optional[str]
+    encoding: Optional[str] = None
+
+
+# Rough per-entry cost beyond the body: the dict slot, tuple and header strings
+SNAPSHOT_OVERHEAD_BYTES = 256
+# Users whose version is remembered individually before they are all reset
+MAX_TRACKED_VERSIONS = 100_000
+
+
+class SnapshotCache:
+    """Thread-safe LRU of per-user response snapshots, bounded by total bytes.
+
+    Every user has a version number that ``bump`` advances whenever their
+    data changes, dropping their snapshot. A reader takes ``version(user)``
+    before it reads the data and passes it to ``set``, which discards the
+    snapshot if the user's data changed meanwhile, so a write racing a read
+    can never leave a stale snapshot behind. ``bump(None)`` invalidates every
+    user, for when changes may have been missed.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Tuple[int, Snapshot]]" = OrderedDict()
+        self._versions: Dict[Hashable, int] = {}
+        # Version of every user not in _versions
+        self._floor = 0
+        self._clock = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale = 0
+
+    def version(self, key: Hashable) -> int:
+        with self._lock:
+            return self._versions.get(key, self._floor)
+
+    def get(self, key: Hashable) -> Optional[Snapshot]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, version: int, snapshot: Snapshot):
+        size = _snapshot_size(snapshot)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._versions.get(key, self._floor) != version:
+                self.stale += 1
+                return
+            self._discard(key)
+            self._data[key] = (version, snapshot)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= _snapshot_size(evicted)
+                self.evictions += 1
+
+    def bump(self, key: Optional[Hashable]):
+        with self._lock:
+            self._clock += 1
+            if key is None:
+                self.invalidations += len(self._data)
+                self._floor = self._clock
+                self._versions.clear()
+                self._data.clear()
+                self._bytes = 0
+                return
+            if len(self._versions) >= MAX_TRACKED_VERSIONS:
+                # Forgetting versions only makes reads in flight discard their snapshots
+                self._floor = self._clock
+                self._clock += 1
+                self._versions.clear()
+            self._versions[key] = self._clock
+            if self._discard(key):
+                self.invalidations += 1
+
+    def _discard(self, key: Hashable) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= _snapshot_size(entry[1])
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale": self.stale,
+            }
+
+
+def _snapshot_size(snapshot: Snapshot) -> int:
+    return len(snapshot.body) + SNAPSHOT_OVERHEAD_BYTES
@@ -0,0 +1,124 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Exam years and sessions offered by the tracker (matches the frontend)
+FIRST_YEAR = 2014
+LAST_YEAR = 2024
+EXAM_SESSIONS = ("May", "November")
+
+# Sessions that never took place
+CANCELLED_SESSIONS = frozenset({(2020, "May")})
+
+# Timezone variants of a paper; None is the paper without a variant. Users can
+# switch variants on for any paper, so every paper accepts all three.
+TIMEZONES = (None, "TZ1", "TZ2")
+
+# Upper bound on papers per session, used to keep per-subject slots stable
+MAX_PAPERS = 8
+
+
+class PaperRef(NamedTuple):
+    subject_id: str
+    year: int
+    session: str
+    paper: str
+    timezone: Optional[str]
+
+
+def is_valid_session(year: int, session: str) -> bool:
+    return (
+        FIRST_YEAR <= year <= LAST_YEAR
+        and session in EXAM_SESSIONS
+        and (year, session) not in CANCELLED_SESSIONS
+    )
+
+
+def paper_numbers(papers: Dict[str, bool]) -> List[int]:
+    """Paper numbers from a timezone-config entry ({"paper1": true, "essay": false, ...})."""
+    numbers = []
+    for paper_key in papers:
+        if paper_key.startswith("paper") and paper_key[5:].isdigit():
+            numbers.append(int(paper_key[5:]))
+    return sorted(numbers)
+
+
+class Catalog:
+    """Every trackable (subject, year, session, paper, timezone) tuple.
+
+    Built once from the timezone configuration. Each tuple gets a dense integer
+    ID (``0..len(catalog)-1``, ordered by subject, year, session, paper and
+    timezone) for compact storage, and a per-subject ``slot`` that depends
+    only on the year, session, paper number and timezone, so it stays put
+    when papers or subjects are added to the configuration. Validation and
+    reverse lookup are dictionary and list indexing.
+    """
+
+    def __init__(self, timezone_config: Dict[str, Dict[str, bool]]):
+        self._ids: Dict[PaperRef, int] = {}
+        self._refs: List[PaperRef] = []
+        self._slots: List[int] = []
+        self._subject_ranges: Dict[str, Tuple[int, int]] = {}
+        self._available: Dict[Tuple[str, int], int] = {}
+
+        for subject_id in sorted(timezone_config):
+            papers = timezone_config[subject_id]
+            numbers = [n for n in paper_numbers(papers) if n <= MAX_PAPERS]
+            # Papers a student sees by default: both variants or the plain paper
+            per_session = sum(2 if papers.get(f"paper{n}") else 1 for n in numbers)
+            start = len(self._refs)
+            for year in range(FIRST_YEAR, LAST_YEAR + 1):
+                sessions = [s for s in EXAM_SESSIONS if is_valid_session(year, s)]
+                self._available[(subject_id, year)] = per_session * len(sessions)
+                for session in sessions:
+                    for number in numbers:
+                        for timezone in TIMEZONES:
+                            ref = PaperRef(subject_id, year, session, f"Paper {number}", timezone)
+                            self._ids[ref] = len(self._refs)
+                            self._refs.append(ref)
+                            self._slots.append(self.slot(year, session, number, timezone))
+            self._subject_ranges[subject_id] = (start, len(self._refs))
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+    def __contains__(self, subject_id: str) -> bool:
+        return subject_id in self._subject_ranges
+
+    @property
+    def subjects(self) -> List[str]:
+        return list(self._subject_ranges)
+
+    def lookup(self, subject_id: str, year: int, session: str, paper: str, timezone: Optional[str] = None) -> Optional[int]:
+        """Dense ID of a paper, or None if the catalog has no such paper."""
+        return self._ids.get(PaperRef(subject_id, year, session, paper, timezone or None))
+
+    def ref(self, paper_id: int) -> PaperRef:
+        return self._refs[paper_id]
+
+    def key(self, paper_id: int) -> str:
+        """The completion key ("{subject}-{year}-{session}-{paper}[-{TZ}]") of an ID."""
+        subject_id, year, session, paper, timezone = self._refs[paper_id]
+        if timezone:
+            return f"{subject_id}-{year}-{session}-{paper}-{timezone}"
+        return f"{subject_id}-{year}-{session}-{paper}"
+
+    def subject_ids(self, subject_id: str) -> range:
+        """The contiguous block of dense IDs belonging to one subject."""
+        return range(*self._subject_ranges.get(subject_id, (0, 0)))
+
+    def subject_slot(self, paper_id: int) -> int:
+        return self._slots[paper_id]
+
+    def available(self, subject_id: str, year: int) -> int:
+        """Papers a student can complete in a subject and year, counting TZ variants
+        the configuration enables."""
+        return self._available.get((subject_id, year), 0)
+
+    @staticmethod
+    def slot(year: int, session: str, paper_number: int, timezone: Optional[str]) -> int:
+        """Stable position of a paper within its subject (see :data:`SLOTS_PER_SUBJECT`)."""
+        session_index = (year - FIRST_YEAR) * len(EXAM_SESSIONS) + EXAM_SESSIONS.index(session)
+        return (session_index * MAX_PAPERS + paper_number - 1) * len(TIMEZONES) + TIMEZONES.index(timezone or None)
+
+
+# Slot space of one subject, including the holes left by cancelled sessions
+SLOTS_PER_SUBJECT = (LAST_YEAR - FIRST_YEAR + 1) * len(EXAM_SESSIONS) * MAX_PAPERS * len(TIMEZONES)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class AttemptCompactor:
+    """Folds queued completion attempts into the stored completion state.
+
+    Writes only append to the attempt log and its queue; every ``interval``
+    seconds ``compact(None, batch_size)`` folds the oldest queued attempts,
+    repeating while full batches come back. ``compact`` returns how many
+    queued attempts it folded.
+
+    Like the write-behind buffer, this process remembers which users it
+    appended for (``appended``), and ``compact_user`` folds such a user's
+    queue right away so reads that follow see the user's own writes. Writes
+    made through other worker processes show up within ``interval``.
+    """
+
+    def __init__(
+        self,
+        compact: Callable[[Optional[int], int], Awaitable[int]],
+        interval: float = 1.0,
+        batch_size: int = 1000,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._compact = compact
+        self._pending_users: Set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.folded = 0
+        self.runs = 0
+        self.failures = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer and fold everything still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.drain()
+
+    def appended(self, *user_ids: int):
+        self._pending_users.update(user_ids)
+
+    async def compact_user(self, user_id: int):
+        if user_id not in self._pending_users:
+            return
+        self._pending_users.discard(user_id)
+        try:
+            self.folded += await self._compact(user_id, self.batch_size)
+        except Exception:
+            self.failures += 1
+            self._pending_users.add(user_id)
+            raise
+
+    async def drain(self):
+        """Fold queued attempts batch by batch until the queue is empty."""
+        self.runs += 1
+        while True:
+            try:
+                folded = await self._compact(None, self.batch_size)
+            except Exception:
+                self.failures += 1
+                raise
+            self.folded += folded
+            if folded < self.batch_size:
+                break
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "pending_users": len(self._pending_users),
+            "folded": self.folded,
+            "runs": self.runs,
+            "failures": self.failures,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("Attempt compaction failed; retrying in %.1fs", self.interval)
@@ -0,0 +1,419 @@
+import asyncio
+import functools
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, List, Optional, Sequence
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be acquired within the pool timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections shared by every route.
+
+    Connections are opened lazily up to ``max_size`` and kept warm down to
+    ``min_size``. Idle connections are checked with ``SELECT 1`` before reuse
+    once they have been idle for ``health_check_interval`` seconds, and are
+    recycled after ``max_lifetime`` seconds so server-side state never grows
+    unbounded.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 10.0,
+        max_lifetime: float = 1800.0,
+        health_check_interval: float = 30.0,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size=%s, max_size=%s" % (min_size, max_size))
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition()
+        # Idle connections as (conn, created_at, last_used_at); used LIFO so
+        # the warmest connection is handed out first.
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._connections_created = 0
+        self._connections_recycled = 0
+        self._health_check_failures = 0
+
+    def open(self):
+        """Open ``min_size`` connections up front so the first requests are warm."""
+        with self._cond:
+            missing = max(self.min_size - self._size, 0)
+            self._size += missing
+        for opened in range(missing):
+            try:
+                conn = self._connect()
+            except Exception:
+                # Give back this slot and the ones not yet tried
+                with self._cond:
+                    self._size -= missing - opened
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        """Close every idle connection and refuse new acquisitions."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Borrow a connection for the duration of a ``with`` block.
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises, so callers never have to manage commit/close.
+        """
+        conn = self._acquire(self.timeout if timeout is None else timeout)
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except BaseException:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self._release(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            in_use = self._size - len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "acquisitions": self._acquisitions,
+                "timeouts": self._timeouts,
+                "wait_time_total_ms": round(self._wait_time_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_time_total * 1000 / self._acquisitions, 3) if self._acquisitions else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+                "connections_created": self._connections_created,
+                "connections_recycled": self._connections_recycled,
+                "health_check_failures": self._health_check_failures,
+            }
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._connections_created += 1
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _acquire(self, timeout: float):
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            candidate = None
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while True:
+                        if self._closed:
+                            raise PoolTimeout("Connection pool is closed")
+                        if self._idle:
+                            candidate = self._idle.pop()
+                            break
+                        if self._size < self.max_size:
+                            self._size += 1
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                "Timed out after %.1fs waiting for a database connection" % timeout
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if candidate is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn = self._checkout(*candidate)
+                if conn is None:
+                    continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._acquisitions += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return conn
+
+    def _checkout(self, conn, created_at, last_used_at):
+        """Validate an idle connection; returns None if it had to be dropped."""
+        now = time.monotonic()
+        healthy = not conn.closed
+        if healthy and self.max_lifetime and now - created_at > self.max_lifetime:
+            with self._cond:
+                self._connections_recycled += 1
+            healthy = False
+        elif healthy and now - last_used_at > self.health_check_interval:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._health_check_failures += 1
+                healthy = False
+        if healthy:
+            return conn
+        self._discard(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        return None
+
+    def _release(self, conn):
+        reusable = not conn.closed
+        if reusable and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+        with self._cond:
+            if reusable and not self._closed:
+                self._idle.append((conn, self._created_at.get(id(conn), time.monotonic()), time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not reusable or self._closed:
+            self._discard(conn)
+
+
+class AsyncDatabase:
+    """Awaitable query surface over a :class:`ConnectionPool`.
+
+    psycopg2 is a blocking driver, so every query runs on a dedicated
+    executor instead of the event loop. The executor is sized to the pool so
+    a worker thread never sits waiting for a connection, and excess work
+    queues in the executor rather than on the pool's lock.
+
+    Held transactions keep their connection while they wait on a client, so
+    at most ``max_transactions`` (a quarter of the pool by default) are open
+    at once, on threads of their own; the rest of the pool and the main
+    executor are left to :meth:`run`.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_workers: Optional[int] = None,
+        on_query: Optional[Callable[[float, int], None]] = None,
+        max_transactions: Optional[int] = None,
+    ):
+        self.pool = pool
+        # Called on the event loop after each run() with (seconds, rows returned)
+        self.on_query = on_query
+        self.max_transactions = max_transactions or max(1, pool.max_size // 4)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, pool.max_size - self.max_transactions), thread_name_prefix="db"
+        )
+        self._transaction_executor = ThreadPoolExecutor(
+            max_workers=self.max_transactions, thread_name_prefix="db-tx"
+        )
+        self._transaction_slots = asyncio.Semaphore(self.max_transactions)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Call ``fn(cursor, *args)`` inside a single pooled transaction."""
+        loop = asyncio.get_running_loop()
+        result, elapsed, rows = await loop.run_in_executor(
+            self._executor, functools.partial(self._run_sync, fn, *args)
+        )
+        if self.on_query is not None:
+            self.on_query(elapsed, rows)
+        return result
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Hold one pooled connection across several awaits.
+
+        Yields a :class:`Transaction`; its ``run`` calls share the connection
+        and one transaction, committed when the block exits normally and
+        rolled back if it raises. Meant for work that interleaves queries with
+        network I/O, such as streaming a response or an upload.
+
+        Waits up to the pool timeout for one of the ``max_transactions``
+        slots, then raises :class:`PoolTimeout`.
+        """
+        try:
+            await asyncio.wait_for(self._transaction_slots.acquire(), self.pool.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(
+                "Timed out after %.1fs waiting for one of %d transaction slots" % (self.pool.timeout, self.max_transactions)
+            )
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._transaction_executor
+            manager = self.pool.connection()
+            entering = loop.run_in_executor(executor, manager.__enter__)
+            try:
+                conn = await asyncio.shield(entering)
+            except asyncio.CancelledError:
+                # The thread still checks a connection out; give it back once it has
+                entering.add_done_callback(functools.partial(_exit_unused, loop, executor, manager))
+                raise
+            try:
+                yield Transaction(self, conn)
+            except BaseException as e:
+                try:
+                    await loop.run_in_executor(executor, manager.__exit__, type(e), e, e.__traceback__)
+                except BaseException:
+                    pass  # __exit__ re-raises e after rolling back
+                raise
+            else:
+                await loop.run_in_executor(executor, manager.__exit__, None, None, None)
+        finally:
+            self._transaction_slots.release()
+
+    async def fetchone(self, query: str, params: Optional[Sequence] = None):
+        return await self.run(_fetchone, query, params)
+
+    async def fetchall(self, query: str, params: Optional[Sequence] = None):
+        return await self.run(_fetchall, query, params)
+
+    async def execute(self, query: str, params: Optional[Sequence] = None) -> int:
+        """Execute a statement and return the affected row count."""
+        return await self.run(_execute, query, params)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        self._transaction_executor.shutdown(wait=True)
+
+    def _run_sync(self, fn, *args):
+        start = time.perf_counter()
+        with self.pool.connection() as conn:
+            result, rows = _run_on_connection(conn, fn, *args)
+        return result, time.perf_counter() - start, rows
+
+
+class Transaction:
+    """A pooled connection held by :meth:`AsyncDatabase.transaction`."""
+
+    _names = itertools.count()
+
+    def __init__(self, database: AsyncDatabase, connection):
+        self.database = database
+        self.connection = connection
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Call ``fn(cursor, *args)`` on the held connection."""
+        start = time.perf_counter()
+        result, rows = await self._call(_run_on_connection, self.connection, fn, *args)
+        self._report(time.perf_counter() - start, rows)
+        return result
+
+    async def stream(self, query: str, params: Optional[Sequence] = None, chunk_size: int = 2000) -> AsyncIterator[List[tuple]]:
+        """Yield the rows of ``query`` in chunks from a server-side cursor.
+
+        Only one chunk is held in memory at a time, however large the result.
+        """
+        cursor = self.connection.cursor(name=f"stream_{next(self._names)}")
+        cursor.itersize = chunk_size
+        elapsed = 0.0
+        total = 0
+        try:
+            start = time.perf_counter()
+            await self._call(cursor.execute, query, params)
+            elapsed += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                rows = await self._call(cursor.fetchmany, chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                total += len(rows)
+                yield rows
+        finally:
+            await self._call(cursor.close)
+            self._report(elapsed, total)
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.database._transaction_executor, functools.partial(fn, *args))
+
+    def _report(self, elapsed: float, rows: int):
+        if self.database.on_query is not None:
+            self.database.on_query(elapsed, rows)
+
+
+def _exit_unused(loop, executor, manager, entering):
+    """Done callback releasing a connection checked out for a cancelled transaction."""
+    if not entering.cancelled() and entering.exception() is None:
+        loop.run_in_executor(executor, manager.__exit__, None, None, None)
+
+
+def _run_on_connection(conn, fn, *args):
+    with conn.cursor() as cursor:
+        result = fn(cursor, *args)
+        # rowcount of the last statement, when it produced a result set
+        rows = cursor.rowcount if cursor.description is not None and cursor.rowcount > 0 else 0
+    return result, rows
+
+
+def _fetchone(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchone()
+
+
+def _fetchall(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def _execute(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.rowcount
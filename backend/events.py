@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "completion_changes"
+# PostgreSQL rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7500
+
+RESYNC = {"type": "resync"}
+
+
+def format_event(event: dict, event_id: Optional[str] = None) -> str:
+    """Encode an event for a text/event-stream response."""
+    data = {key: value for key, value in event.items() if key != "type"}
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event['type']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """One open event stream of a user.
+
+    Events wait in a bounded queue until the stream sends them. A stream that
+    falls ``max_pending`` events behind has its backlog replaced by a single
+    ``resync`` event telling the client to re-read its state.
+    """
+
+    def __init__(self, user_id: int, max_pending: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self.closed = False
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """The next event, or None after ``timeout`` seconds or once closed."""
+        if self.closed:
+            return None
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _offer(self, event: Optional[dict]) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC if event is not None else None)
+            return False
+
+
+class EventBroker:
+    """In-process fan-out of per-user completion events to open streams.
+
+    ``publish`` hands an event to every stream the user has open in this
+    process, and tells every ``watch`` callback whose data changed. Must be
+    used from the event loop.
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._watchers: List[Callable[[Optional[int]], None]] = []
+
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        self.close_all()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id, self.max_pending)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+
+    def watch(self, callback: Callable[[Optional[int]], None]):
+        """Call ``callback(user_id)`` for every event delivered in this process,
+        and ``callback(None)`` when events may have been missed."""
+        self._watchers.append(callback)
+
+    async def publish(self, user_id: int, event: dict):
+        self.published += 1
+        self._deliver(user_id, event)
+
+    def close_all(self):
+        """End every open stream, e.g. at shutdown."""
+        for subscribers in list(self._subscribers.values()):
+            for subscription in subscribers:
+                subscription.closed = True
+                subscription._offer(None)
+
+    def _deliver(self, user_id: int, event: dict):
+        self._notify_watchers(user_id)
+        for subscription in self._subscribers.get(user_id, ()):
+            if subscription._offer(event):
+                self.delivered += 1
+            else:
+                self.overflows += 1
+
+    def _deliver_all(self, event: dict):
+        self._notify_watchers(None)
+        for user_id in list(self._subscribers):
+            self._deliver(user_id, event)
+
+    def _notify_watchers(self, user_id: Optional[int]):
+        for watcher in self._watchers:
+            watcher(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "broker": "local",
+            "streams": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "users": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+class PostgresEventBroker(EventBroker):
+    """Fan-out across worker processes through PostgreSQL LISTEN/NOTIFY.
+
+    ``publish`` sends NOTIFY on ``CHANNEL`` from a dedicated connection, one
+    event at a time so a worker's events keep their order. Every worker, this
+    one included, delivers what arrives on its LISTEN connection, which the
+    event loop watches directly. Large change sets are split to fit the
+    NOTIFY payload limit. After the LISTEN connection is lost and
+    re-established, local streams get a ``resync`` event since notifications
+    may have been missed meanwhile.
+    """
+
+    def __init__(self, dsn: str, max_pending: int = 256, reconnect_delay: float = 1.0):
+        super().__init__(max_pending)
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events")
+        self._publisher = None
+        self._task: Optional[asyncio.Task] = None
+        self._listening = False
+
+        self.notifications = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_publisher)
+        await super().stop()
+
+    async def publish(self, user_id: int, event: dict):
+        self.published += 1
+        payloads = list(_notify_payloads(user_id, event))
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._notify, payloads)
+
+    def _notify(self, payloads: List[str]):
+        # psycopg2 is imported on use so the local broker never loads it
+        import psycopg2
+        import psycopg2.extensions
+
+        for attempt in range(2):
+            try:
+                if self._publisher is None or self._publisher.closed:
+                    self._publisher = psycopg2.connect(self.dsn)
+                    self._publisher.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with self._publisher.cursor() as cursor:
+                    # The parts of a split event go out in one round trip, in order
+                    cursor.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload", (CHANNEL, payloads))
+                return
+            except psycopg2.OperationalError:
+                # A stale connection gets one retry on a fresh one
+                self._close_publisher()
+                if attempt:
+                    raise
+
+    def _close_publisher(self):
+        import psycopg2
+
+        if self._publisher is not None:
+            try:
+                self._publisher.close()
+            except psycopg2.Error:
+                pass
+            self._publisher = None
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await loop.run_in_executor(None, self._connect_listener)
+                if not first:
+                    self.reconnects += 1
+                    logger.info("Event listener reconnected")
+                    self._deliver_all(RESYNC)
+                first = False
+                lost = loop.create_future()
+                # Keep the fd: fileno() raises once the connection has died
+                fd = conn.fileno()
+                loop.add_reader(fd, self._on_readable, conn, lost)
+                self._listening = True
+                try:
+                    await lost
+                finally:
+                    self._listening = False
+                    loop.remove_reader(fd)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Event listener connection lost: %s", e)
+            finally:
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _connect_listener(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return conn
+
+    def _on_readable(self, conn, lost: asyncio.Future):
+        import psycopg2
+
+        try:
+            conn.poll()
+        except psycopg2.Error as e:
+            if not lost.done():
+                lost.set_exception(e)
+            return
+        while conn.notifies:
+            notification = conn.notifies.pop(0)
+            self.notifications += 1
+            try:
+                message = json.loads(notification.payload)
+                self._deliver(message["user_id"], message["event"])
+            except (ValueError, KeyError):
+                logger.warning("Ignoring malformed event notification")
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "broker": "postgres",
+            "listening": self._listening,
+            "notifications": self.notifications,
+            "reconnects": self.reconnects,
+        })
+        return stats
+
+
+def _notify_payloads(user_id: int, event: dict) -> Iterator[str]:
+    """Serialize an event as one or more NOTIFY payloads, splitting its changes to fit."""
+    payload = json.dumps({"user_id": user_id, "event": event}, separators=(",", ":"))
+    changes = event.get("changes")
+    if len(payload.encode()) <= MAX_NOTIFY_BYTES or not changes or len(changes) == 1:
+        yield payload
+        return
+    items = list(changes.items())
+    half = len(items) // 2
+    for part in (items[:half], items[half:]):
+        yield from _notify_payloads(user_id, {**event, "changes": dict(part)})
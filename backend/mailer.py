@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+
+logger = logging.getLogger(__name__)
+
+
+class FeedbackMailer:
+    """Background delivery of the feedback outbox as digest emails.
+
+    Every ``interval`` seconds the pending outbox rows are claimed through
+    ``storage.claim_feedback`` (so several workers never send the same row),
+    formatted into one digest and sent over a single SMTP connection that is
+    kept open between batches. Failed batches are retried with exponential
+    backoff up to ``max_attempts``.
+
+    All SMTP and database work runs on one dedicated thread, so the event loop
+    never blocks and the SMTP connection is never shared between threads.
+    """
+
+    def __init__(
+        self,
+        storage,
+        host: str,
+        port: int,
+        recipient: str,
+        sender: str = "",
+        username: str = "",
+        password: str = "",
+        use_tls: bool = True,
+        interval: float = 60.0,
+        batch_size: int = 50,
+        max_attempts: int = 8,
+        backoff_base: float = 60.0,
+        backoff_max: float = 3600.0,
+        idle_timeout: float = 240.0,
+    ):
+        self.storage = storage
+        self.host = host
+        self.port = port
+        self.recipient = recipient
+        self.sender = sender or username
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_timeout = idle_timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mailer")
+        self._task: Optional[asyncio.Task] = None
+        self._smtp: Optional["smtplib.SMTP"] = None
+        self._smtp_used_at = 0.0
+
+        self.sent_messages = 0
+        self.sent_digests = 0
+        self.failed_attempts = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "sent_messages": self.sent_messages,
+            "sent_digests": self.sent_digests,
+            "failed_attempts": self.failed_attempts,
+            "connected": self._smtp is not None,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                while await loop.run_in_executor(self._executor, self.deliver_pending) == self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error delivering feedback")
+
+    def deliver_pending(self) -> int:
+        """Send one digest of pending feedback; returns the number of messages sent."""
+        with self.storage.claim_feedback(self.batch_size, self.max_attempts) as claim:
+            rows = claim.rows
+            if not rows:
+                if self._smtp is not None and time.monotonic() - self._smtp_used_at > self.idle_timeout:
+                    self._disconnect()
+                return 0
+
+            try:
+                self._send(self._digest(rows))
+            except Exception as e:
+                self.failed_attempts += 1
+                self._disconnect()
+                logger.warning("Feedback digest delivery failed, will retry: %s", e)
+                claim.failed(str(e), self.backoff_base, self.backoff_max)
+                return 0
+
+            claim.sent()
+            self.sent_messages += len(rows)
+            self.sent_digests += 1
+            logger.info("Feedback digest with %d message(s) sent to %s", len(rows), self.recipient)
+            return len(rows)
+
+    def _digest(self, rows) -> "MIMEMultipart":
+        # The email package is only loaded once there is feedback to send
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        msg = MIMEMultipart()
+        msg["From"] = self.sender
+        msg["To"] = self.recipient
+        msg["Subject"] = "IB Paper Tracker Feedback" if len(rows) == 1 else f"IB Paper Tracker Feedback ({len(rows)} messages)"
+
+        sections = []
+        for _, message, email, user_identifier, timestamp in rows:
+            sections.append(f"""
+        New Feedback from IB Paper Tracker:
+
+        From: {user_identifier if user_identifier else email if email else 'Anonymous'}
+        Time: {timestamp.isoformat() if timestamp else datetime.now().isoformat()}
+
+        Message:
+        {message}
+        """)
+        msg.attach(MIMEText("\n        ----------------------------------------\n".join(sections), "plain"))
+        return msg
+
+    def _send(self, msg):
+        smtp = self._connection()
+        smtp.send_message(msg)
+        self._smtp_used_at = time.monotonic()
+
+    def _connection(self) -> "smtplib.SMTP":
+        import smtplib
+
+        # Reuse the open session if the server still answers
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._disconnect()
+
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
@@ -1,51 +1,285 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conint
 from typing import List, Dict, Optional, Any
 from datetime import datetime, timedelta
 import jwt
-from passlib.context import CryptContext
 import os
 import json
-import psycopg2
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import hashlib
+import logging
+import math
+import time
+import asyncio
+from admission import AdmissionControl, AdmissionMiddleware, ConcurrencyLimiter, InMemoryBucketStore, parse_rate
+from events import RESYNC, EventBroker, PostgresEventBroker, format_event
+import bitsets
+from cache import Snapshot, SnapshotCache, TTLCache
+from compactor import AttemptCompactor
+from catalog import FIRST_YEAR, LAST_YEAR, Catalog, is_valid_session
+from metrics import MetricsMiddleware, RequestMetrics, record_query
+from passwords import DEFAULT_ROUNDS, PasswordHasher
+from responses import (
+    FastJSONResponse, StaticPayload, accepted_encodings, decode_body, dumps as json_dumps, encode_body, encoded_response,
+    etag_matches, loads as json_loads,
+)
+from stats import build_stats
+from storage import RejectedWrite, UserExists
+from transfer import FORMATS, RecordError, RecordParser, csv_header, format_rows
+from writebehind import WriteBehindBuffer
 from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 
 # test
 
 # Load environment variables from .env
 load_dotenv()
 
-# Initialize FastAPI
-app = FastAPI(title="IB Paper Tracker API")
+# Logging: LOG_LEVEL=DEBUG enables per-request diagnostics
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+logger = logging.getLogger("paperpath")
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with your frontend domain
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Per-route request counts, latency and database time, served at /metrics
+request_metrics = RequestMetrics()
 
-# Database connection string from .env
+# Database connection string from .env; sqlite:///path/to/file.db selects the
+# embedded SQLite backend instead of PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Connection pool configuration
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))
+DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", 30))
+
+# Optional comma-separated streaming replicas for per-user reads. A replica
+# more than REPLICA_MAX_LAG seconds behind, or failing its check every
+# REPLICA_CHECK_INTERVAL seconds, is taken out of rotation; a user's reads
+# stay on the primary for READ_YOUR_WRITES_WINDOW seconds after they write.
+# That pin is kept per worker process: with several workers, completion writes
+# reach the other workers' pins only through EVENTS_BROKER=postgres, and other
+# writes (registration, subjects) need a single worker or sticky sessions.
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 2))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 2))
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 5))
+
+# SQLite backend: read-only connections beside the single writer, and seconds
+# the writer waits for the file lock held by another process
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", 4))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", 5))
+
+# bcrypt cost for new hashes (existing ones are rehashed on login) and the
+# number of hashing processes (default: one per core)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", DEFAULT_ROUNDS))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 0)) or None
+
+# Timezone configuration file and how often (seconds) to check it for changes
+TIMEZONE_CONFIG_PATH = os.getenv(
+    "TIMEZONE_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "timezone-config.json")
+)
+TIMEZONE_CONFIG_CHECK_INTERVAL = float(os.getenv("TIMEZONE_CONFIG_CHECK_INTERVAL", 30))
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", 86400))
+
+# Rows sent per INSERT statement by the bulk completion upsert
+BULK_UPSERT_PAGE_SIZE = int(os.getenv("BULK_UPSERT_PAGE_SIZE", 1000))
+
+# Seconds subtracted from a delta-sync cursor so rows committed slightly out of
+# timestamp order are not missed (clients apply the overlap idempotently)
+DELTA_SYNC_OVERLAP = float(os.getenv("DELTA_SYNC_OVERLAP", 2))
+
+# "rows" reads completion_status; "bitset" also keeps packed per-subject
+# bitsets (completion_bitsets) on every write and serves full reads from them
+COMPLETION_STORAGE = os.getenv("COMPLETION_STORAGE", "rows").lower()
+if COMPLETION_STORAGE not in ("rows", "bitset"):
+    raise ValueError(f"COMPLETION_STORAGE must be 'rows' or 'bitset', not {COMPLETION_STORAGE!r}")
+
+# Seconds POST /completion writes are buffered so repeated changes to the same
+# paper collapse into one upsert; 0 writes every request through immediately
+WRITE_BEHIND_WINDOW = float(os.getenv("WRITE_BEHIND_WINDOW", 0))
+
+# Every single-paper write is kept in the completion_attempts log. With
+# ATTEMPT_COMPACT_INTERVAL at 0 the stored state is updated in the same
+# transaction; above 0 writes only append to the log, and a background task
+# folds up to ATTEMPT_COMPACT_BATCH queued attempts at a time into the stored
+# state every ATTEMPT_COMPACT_INTERVAL seconds
+ATTEMPT_COMPACT_INTERVAL = float(os.getenv("ATTEMPT_COMPACT_INTERVAL", 0))
+ATTEMPT_COMPACT_BATCH = int(os.getenv("ATTEMPT_COMPACT_BATCH", 1000))
+ATTEMPT_HISTORY_MAX_LIMIT = 500
+
+# Live completion events (GET /completion/events): "local" fans out within
+# one process, "postgres" across workers through LISTEN/NOTIFY. Streams send a
+# comment every EVENT_STREAM_HEARTBEAT seconds so proxies keep them open, and
+# a stream more than EVENT_STREAM_MAX_PENDING events behind is told to resync.
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "local").lower()
+if EVENTS_BROKER not in ("local", "postgres"):
+    raise ValueError(f"EVENTS_BROKER must be 'local' or 'postgres', not {EVENTS_BROKER!r}")
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT", 15))
+EVENT_STREAM_MAX_PENDING = int(os.getenv("EVENT_STREAM_MAX_PENDING", 256))
+
+# GET /completion bodies of at least this many bytes are sent gzip or brotli
+# compressed when the client accepts it
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+
+# Rows per server-side cursor fetch when exporting, and per COPY when importing
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 2000))
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", 50000))
+
+# Admission control. Each route class has a token bucket per user (per client
+# IP for anonymous requests and logins) given as "<requests>/<seconds>"; ""
+# or "0" lifts it, and RATE_LIMITING=false lifts them all. Behind a proxy run
+# uvicorn with --proxy-headers so the client IP is the real one. A whole school
+# behind NAT shares one IP, so the login limit per IP is generous and /token
+# is also limited per username ("login_user"). At most
+# MAX_CONCURRENT_REQUESTS database-bound requests run at once (default: the
+# pool size, 0 for no cap); up to ADMISSION_QUEUE_SIZE more wait for up to
+# ADMISSION_QUEUE_TIMEOUT seconds, and the rest are answered 503.
+RATE_LIMITING = os.getenv("RATE_LIMITING", "true").lower() not in ("0", "false", "no")
+RATE_LIMITS = {
+    "login": os.getenv("RATE_LIMIT_LOGIN", "300/60"),
+    "login_user": os.getenv("RATE_LIMIT_LOGIN_USER", "10/60"),
+    "write": os.getenv("RATE_LIMIT_WRITE", "300/60"),
+    "bulk": os.getenv("RATE_LIMIT_BULK", "30/60"),
+    "feedback": os.getenv("RATE_LIMIT_FEEDBACK", "5/60"),
+    "read": os.getenv("RATE_LIMIT_READ", "600/60"),
+}
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", 100000))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", DB_POOL_MAX_SIZE))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+
+# Authenticated-user cache configuration
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+
+# Bytes of serialized GET /completion bodies kept in memory; 0 disables. Unset,
+# 32 MiB with the postgres events broker and off otherwise (see completion_cache)
+COMPLETION_CACHE_BYTES = os.getenv("COMPLETION_CACHE_BYTES")
+
 # Email configuration
 EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.gmail.com")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
 EMAIL_USERNAME = os.getenv("EMAIL_USERNAME", "")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
 EMAIL_RECIPIENT = os.getenv("EMAIL_RECIPIENT", "")
+EMAIL_FROM = os.getenv("EMAIL_FROM", EMAIL_USERNAME or "paperpath@localhost")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() not in ("0", "false", "no")
+
+# Feedback is queued in feedback_outbox and mailed as digests in the background
+FEEDBACK_DIGEST_INTERVAL = float(os.getenv("FEEDBACK_DIGEST_INTERVAL", 60))
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", 50))
+FEEDBACK_MAX_ATTEMPTS = int(os.getenv("FEEDBACK_MAX_ATTEMPTS", 8))
+FEEDBACK_RETRY_BASE = float(os.getenv("FEEDBACK_RETRY_BASE", 60))
+FEEDBACK_RETRY_MAX = float(os.getenv("FEEDBACK_RETRY_MAX", 3600))
 
-# SQLAlchemy setup
-engine = create_engine(DATABASE_URL)
+# Cold starts: with LAZY_STARTUP the server takes requests as soon as the
+# storage is open. Migrations run in the background (data routes wait for
+# them) and the password hashing processes start on the first login.
+# GET /ready reports when warm-up has finished.
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "false").lower() in ("1", "true", "yes")
+
+# Storage behind every route: PostgreSQL on a shared connection pool, or an
+# embedded SQLite file for single-node deployments
+if DATABASE_URL and DATABASE_URL.startswith("sqlite:"):
+    # Each backend's modules (and driver) are only imported when selected
+    from sqlite_storage import SQLiteStorage, sqlite_path
+
+    storage = SQLiteStorage(
+        sqlite_path(DATABASE_URL),
+        readers=SQLITE_READERS,
+        busy_timeout=SQLITE_BUSY_TIMEOUT,
+        maintain_bitsets=COMPLETION_STORAGE == "bitset",
+        on_query=record_query,
+    )
+    if DATABASE_READ_URLS:
+        logger.warning("DATABASE_READ_URL is ignored with SQLite storage")
+    read_replicas = None
+else:
+    from db import ConnectionPool
+    from postgres_storage import PostgresStorage
+    from replicas import ReplicaSet
+
+    def connection_pool(dsn: str) -> ConnectionPool:
+        return ConnectionPool(
+            dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            health_check_interval=DB_POOL_HEALTH_CHECK_INTERVAL,
+        )
+
+    read_replicas = ReplicaSet(
+        [connection_pool(url) for url in DATABASE_READ_URLS],
+        max_lag=REPLICA_MAX_LAG,
+        check_interval=REPLICA_CHECK_INTERVAL,
+        read_your_writes=READ_YOUR_WRITES_WINDOW,
+        on_query=record_query,
+    ) if DATABASE_READ_URLS else None
+    storage = PostgresStorage(
+        connection_pool(DATABASE_URL),
+        maintain_bitsets=COMPLETION_STORAGE == "bitset",
+        upsert_page_size=BULK_UPSERT_PAGE_SIZE,
+        on_query=record_query,
+        replicas=read_replicas,
+    )
+
+# Fan-out of completion changes to every open stream of the same user
+if EVENTS_BROKER == "postgres" and storage.name == "postgresql":
+    event_broker = PostgresEventBroker(DATABASE_URL, max_pending=EVENT_STREAM_MAX_PENDING)
+else:
+    if EVENTS_BROKER == "postgres":
+        logger.warning("EVENTS_BROKER=postgres needs PostgreSQL storage; using the local broker")
+    event_broker = EventBroker(max_pending=EVENT_STREAM_MAX_PENDING)
+
+# Serialized completion maps by user. Writes through this process drop the
+# user's snapshot directly; other workers' writes only reach it as events of a
+# broker that spans processes, so without one the cache is off unless asked for
+# (safe with a single worker).
+if COMPLETION_CACHE_BYTES is None:
+    COMPLETION_CACHE_BYTES = 32 * 1024 * 1024 if isinstance(event_broker, PostgresEventBroker) else 0
+completion_cache = SnapshotCache(max_bytes=int(COMPLETION_CACHE_BYTES))
+event_broker.watch(completion_cache.bump)
+
+def pin_to_primary(user_id: Optional[int]):
+    """Extend read-your-writes to completion writes made through other workers"""
+    if user_id is not None:
+        read_replicas.wrote(user_id)
+
+if read_replicas is not None:
+    event_broker.watch(pin_to_primary)
+    if not isinstance(event_broker, PostgresEventBroker) and int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        logger.warning(
+            "Read replicas with several workers and the local events broker: a user's read "
+            "may reach a lagging replica through another worker; set EVENTS_BROKER=postgres"
+        )
+
+# Outbox delivery needs a recipient and either credentials or a plain local relay
+feedback_mailer = None
+if EMAIL_RECIPIENT and ((EMAIL_USERNAME and EMAIL_PASSWORD) or not EMAIL_USE_TLS):
+    from mailer import FeedbackMailer
+
+    feedback_mailer = FeedbackMailer(
+        storage,
+        host=EMAIL_HOST,
+        port=EMAIL_PORT,
+        recipient=EMAIL_RECIPIENT,
+        sender=EMAIL_FROM,
+        username=EMAIL_USERNAME,
+        password=EMAIL_PASSWORD,
+        use_tls=EMAIL_USE_TLS,
+        interval=FEEDBACK_DIGEST_INTERVAL,
+        batch_size=FEEDBACK_BATCH_SIZE,
+        max_attempts=FEEDBACK_MAX_ATTEMPTS,
+        backoff_base=FEEDBACK_RETRY_BASE,
+        backoff_max=FEEDBACK_RETRY_MAX,
+    )
+
+# Password hashing runs on worker processes so it never stalls the event loop
+password_hasher = PasswordHasher(rounds=BCRYPT_ROUNDS, workers=HASH_WORKERS)
 
 # IB Subject Groups
 IB_SUBJECT_GROUPS = {
@@ -69,156 +303,154 @@ IB_SUBJECT_GROUPS = {
     ]
 }
 
+# Catalog responses (/subject-groups, /timezone-config) are serialized and
+# compressed once; clients may cache them for this many seconds
+subject_groups_payload = StaticPayload({"subject_groups": IB_SUBJECT_GROUPS}, max_age=CATALOG_CACHE_MAX_AGE)
+timezone_config_payload = StaticPayload({"timezone_config": {}}, max_age=CATALOG_CACHE_MAX_AGE)
+
 # Load timezone configuration from JSON file
 TIMEZONE_CONFIG = {}
-try:
-    with open('timezone-config.json', 'r') as f:
-        TIMEZONE_CONFIG = json.load(f)
-except Exception as e:
-    print(f"Warning: Could not load timezone-config.json: {e}")
-    # If the file doesn't exist, the TIMEZONE_CONFIG will remain empty
-    # The application will still function but without timezone support
-
-# Initialize database
-def init_db():
+# Index of every valid paper, rebuilt whenever the timezone config is reloaded
+paper_catalog = Catalog({})
+_timezone_config_mtime = None
+_timezone_config_checked_at = 0.0
+
+def load_timezone_config() -> bool:
+    """(Re)load timezone-config.json into TIMEZONE_CONFIG and rebuild its payload"""
+    global _timezone_config_mtime, timezone_config_payload, paper_catalog
     try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Create subjects table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_subjects (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            subjects TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        
-        # Create completion status table with timezone field and score
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS completion_status (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL,
-            subject_id TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            session TEXT NOT NULL,
-            paper TEXT NOT NULL,
-            timezone TEXT,
-            is_completed BOOLEAN NOT NULL DEFAULT FALSE,
-            score INTEGER CHECK (score >= 0 AND score <= 100),
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-
-        # Check if score column exists and add it if it doesn't
-        cursor.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='completion_status' AND column_name='score'
-        """)
-        
-        if not cursor.fetchone():
-            print("[DEBUG] Adding score column to completion_status table...")
-            cursor.execute("""
-            ALTER TABLE completion_status 
-            ADD COLUMN score INTEGER CHECK (score >= 0 AND score <= 100)
-            """)
-            print("[DEBUG] Score column added successfully")
-        
-        cursor.close()
-        conn.close()
-        print("PostgreSQL database initialized successfully")
+        mtime = os.stat(TIMEZONE_CONFIG_PATH).st_mtime
+        with open(TIMEZONE_CONFIG_PATH, 'r') as f:
+            config = json.load(f)
     except Exception as e:
-        print(f"Error initializing PostgreSQL database: {e}")
+        logger.warning("Could not load timezone-config.json: %s", e)
+        # If the file doesn't exist, the TIMEZONE_CONFIG will remain empty
+        # The application will still function but without timezone support
+        return False
+    
+    # Update in place so every holder of TIMEZONE_CONFIG sees the new data
+    TIMEZONE_CONFIG.clear()
+    TIMEZONE_CONFIG.update(config)
+    _timezone_config_mtime = mtime
+    timezone_config_payload = StaticPayload({"timezone_config": TIMEZONE_CONFIG}, max_age=CATALOG_CACHE_MAX_AGE)
+    paper_catalog = Catalog(TIMEZONE_CONFIG)
+    return True
 
-def migrate_completion_data():
-    """
-    Migrate existing completion data to support timezone field.
-    This function should be run once after updating the database schema.
+def refresh_timezone_config():
+    """Reload the timezone config if the file changed on disk.
+
+    Every worker checks the file's mtime at most once per
+    TIMEZONE_CONFIG_CHECK_INTERVAL, so edits are picked up without a restart.
     """
+    global _timezone_config_checked_at
+    now = time.monotonic()
+    if now - _timezone_config_checked_at < TIMEZONE_CONFIG_CHECK_INTERVAL:
+        return
+    _timezone_config_checked_at = now
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # First, make sure the timezone column exists
-        cursor.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='completion_status' AND column_name='timezone'
-        """)
-        
-        if not cursor.fetchone():
-            print("Adding timezone column to completion_status table...")
-            cursor.execute("ALTER TABLE completion_status ADD COLUMN timezone TEXT")
-        
-        # Now migrate the data
-        # Get all completion status records
-        cursor.execute("""
-        SELECT id, subject_id, paper FROM completion_status WHERE timezone IS NULL
-        """)
-        
-        records = cursor.fetchall()
-        print(f"Found {len(records)} records to migrate")
-        
-        # Process each record
-        updated_count = 0
-        for record_id, subject_id, paper in records:
-            paper_key = paper.lower().replace(' ', '')
-            
-            # Check if this subject-paper has TZ variants
-            if subject_id in TIMEZONE_CONFIG and paper_key in TIMEZONE_CONFIG[subject_id]:
-                if TIMEZONE_CONFIG[subject_id][paper_key]:
-                    # This paper should have TZ variants, set to TZ1 as default
-                    cursor.execute("""
-                    UPDATE completion_status SET timezone = 'TZ1' WHERE id = %s
-                    """, (record_id,))
-                    updated_count += 1
-            
-        print(f"Updated {updated_count} records")
-        
-        cursor.close()
-        conn.close()
-        print("Migration completed successfully")
-        
-    except Exception as e:
-        print(f"Error during migration: {e}")
+        mtime = os.stat(TIMEZONE_CONFIG_PATH).st_mtime
+    except OSError:
+        return
+    if mtime != _timezone_config_mtime and load_timezone_config():
+        logger.info("Reloaded timezone-config.json")
+
+load_timezone_config()
+
+def prepare_storage():
+    """Bring the schema and completion bitsets up to date (blocking)."""
+    # A no-op when the database is current
+    try:
+        applied = storage.migrate(TIMEZONE_CONFIG)
+        if applied:
+            logger.info("Applied database migrations: %s", applied)
+    except Exception:
+        logger.exception("Error running database migrations")
+
+    # Bitsets are only maintained in bitset mode; rebuild them if they fell behind
+    try:
+        if storage.sync_bitsets(COMPLETION_STORAGE == "bitset"):
+            logger.info("Rebuilt completion bitsets from completion_status")
+    except Exception:
+        logger.exception("Error syncing completion bitsets")
+
+# Seconds startup took until the storage was prepared; None while warming up
+warm_up_seconds: Optional[float] = None
+warm_up_task: Optional[asyncio.Task] = None
+
+async def warm_up(started: float):
+    global warm_up_seconds
+    await asyncio.get_running_loop().run_in_executor(None, prepare_storage)
+    warm_up_seconds = time.monotonic() - started
+    logger.info("Warm-up finished after %.2fs", warm_up_seconds)
+
+async def wait_for_warm_up():
+    """Dependency of every data route: hold requests until the storage is prepared"""
+    if warm_up_task is not None and not warm_up_task.done():
+        await asyncio.shield(warm_up_task)
 
-# Test database connection at startup
-@app.on_event("startup")
 async def startup_event():
+    global warm_up_seconds, warm_up_task
+    started = time.monotonic()
+    # Opening the pool makes the first connection, which preparation and the
+    # first requests then reuse
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.close()
-        print("Successfully connected to PostgreSQL database!")
+        storage.open()
+        logger.info("Successfully connected to %s storage", storage.name)
     except Exception as e:
-        print(f"PostgreSQL connection error: {e}")
-    
-    # Initialize database
-    init_db()
-    
-    # Run migration for existing data
-    migrate_completion_data()
+        logger.error("%s connection error: %s", storage.name, e)
+
+    if LAZY_STARTUP:
+        # Serve as soon as possible; hashing processes start on the first login
+        warm_up_task = asyncio.get_running_loop().create_task(warm_up(started))
+    else:
+        prepare_storage()
+        warm_up_seconds = time.monotonic() - started
+        password_hasher.start()
+
+    if read_replicas is not None:
+        read_replicas.start(storage.pool)
+
+    event_broker.start()
+
+    if completion_buffer is not None:
+        completion_buffer.start()
+
+    if attempt_compactor is not None:
+        attempt_compactor.start()
+
+    if feedback_mailer is not None:
+        feedback_mailer.start()
+    else:
+        logger.info("Feedback email delivery disabled - email configuration not provided")
+
+async def shutdown_event():
+    # Let an unfinished migration complete rather than close the storage under it
+    if warm_up_task is not None:
+        await warm_up_task
+    await event_broker.stop()
+    if feedback_mailer is not None:
+        await feedback_mailer.stop()
+    # Write out buffered completion changes before the storage goes away
+    if completion_buffer is not None:
+        await completion_buffer.stop()
+    if attempt_compactor is not None:
+        await attempt_compactor.stop()
+    if read_replicas is not None:
+        await read_replicas.stop()
+    password_hasher.shutdown()
+    storage.close()
+
+# Data routes wait for warm-up; service routes (health, readiness, metrics and
+# the static catalog) answer right away. create_app() mounts both.
+router = APIRouter(dependencies=[Depends(wait_for_warm_up)])
+service_router = APIRouter()
 
 # Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Cache of UserInDB keyed by username so authenticated requests skip the users lookup
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-for-development")  # Change in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
@@ -249,11 +481,41 @@ class CompletionStatus(BaseModel):
     paper: str
     timezone: Optional[str] = None
     is_completed: bool
-    score: Optional[int] = None
+    score: Optional[conint(ge=0, le=100)] = None
 
 class BulkCompletionStatus(BaseModel):
     completion_data: Dict[str, Dict[str, Any]]
 
+def parse_bulk_completion(body: bytes) -> Dict[str, Dict[str, Any]]:
+    """The completion_data of a BulkCompletionStatus body, checked by hand.
+
+    A full sync carries one entry per tracked paper, and validating each
+    through the model costs more than the write itself; only the shape is
+    checked here and completion_rows skips entries it cannot use.
+    """
+    def invalid(loc, msg, error_type):
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=[{"loc": ["body", *loc], "msg": msg, "type": error_type}]
+        )
+
+    try:
+        body = json_loads(body)
+    except ValueError:
+        raise invalid([], "Invalid JSON body", "value_error.jsondecode")
+    completion_data = body.get("completion_data") if isinstance(body, dict) else None
+    if completion_data is None:
+        raise invalid(["completion_data"], "field required", "value_error.missing")
+    if not isinstance(completion_data, dict):
+        raise invalid(["completion_data"], "value is not a valid dict", "type_error.dict")
+    for key, value in completion_data.items():
+        if not isinstance(value, dict):
+            raise invalid(["completion_data", key], "value is not a valid dict", "type_error.dict")
+    return completion_data
+
+async def read_bulk_completion(request: Request) -> Dict[str, Dict[str, Any]]:
+    return parse_bulk_completion(await request.body())
+
 class FeedbackModel(BaseModel):
     message: str
     email: Optional[str] = None
@@ -261,34 +523,44 @@ class FeedbackModel(BaseModel):
     user: Optional[str] = None
 
 # Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def get_user(username: str):
+async def get_user(username: str, user_id: Optional[int] = None):
+    # Serve from the cache unless the token was issued for a different account
+    user = user_cache.get(username)
+    if user is not None and (user_id is None or user.id == user_id):
+        return user
+    
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, email, password_hash FROM users WHERE username = %s", (username,))
-        user_data = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
+        user_data = await storage.get_user(username)
+
         if user_data:
-            return UserInDB(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3])
+            user = UserInDB(id=user_data[0], username=user_data[1], email=user_data[2], password_hash=user_data[3])
+            user_cache.set(username, user)
+            return user
+        user_cache.invalidate(username)
         return None
-    except Exception as e:
-        print(f"Error getting user from PostgreSQL: {e}")
+    except Exception:
+        logger.exception("Error getting user")
         return None
 
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
+def invalidate_user(username: str):
+    """Drop a cached user; call after anything that changes a users row."""
+    user_cache.invalidate(username)
+
+async def authenticate_user(username: str, password: str):
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.password_hash):
+    matches, new_hash = await password_hasher.verify(password, user.password_hash)
+    if not matches:
         return False
+    if new_hash is not None:
+        # Stored with a different BCRYPT_ROUNDS; a failed upgrade must not fail the login
+        try:
+            # Only replace the hash that was verified, in case the password changed meanwhile
+            await storage.replace_password_hash(user.id, user.password_hash, new_hash)
+            invalidate_user(username)
+        except Exception:
+            logger.exception("Error rehashing password for user %s", user.id)
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -318,7 +590,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except jwt.PyJWTError:
         raise credentials_exception
         
-    user = get_user(username=username)
+    user = await get_user(username=username, user_id=payload.get("uid"))
     if user is None:
         raise credentials_exception
         
@@ -331,75 +603,244 @@ async def get_current_user_optional(token: str = Depends(oauth2_scheme)):
         username: str = payload.get("sub")
         if username is None:
             return None
-        user = get_user(username=username)
+        user = await get_user(username=username, user_id=payload.get("uid"))
         if user is None:
             return None
         return user
     except Exception:
         return None
 
-def is_valid_session(year: int, session: str) -> bool:
-    # No exams in May 2020
-    if year == 2020 and session == 'May':
-        return False
-    return True
+async def get_stream_user(request: Request, access_token: Optional[str] = None):
+    """get_current_user for event streams, which also accepts ?access_token= since EventSource cannot set headers"""
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else access_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await get_current_user(token)
 
-# Routes
-@app.post("/register", response_model=Token)
-async def register_user(user: User):
+# Route class of every database-bound route; anything else (health, readiness,
+# metrics, the static catalog and event streams) is admitted unconditionally
+ROUTE_CLASSES = {
+    ("POST", "/token"): "login",
+    ("POST", "/register"): "login",
+    ("POST", "/completion"): "write",
+    ("POST", "/subjects"): "write",
+    ("POST", "/completion/bulk"): "bulk",
+    ("POST", "/completion/import"): "bulk",
+    ("POST", "/feedback"): "feedback",
+    ("GET", "/users/me"): "read",
+    ("GET", "/subjects"): "read",
+    ("GET", "/completion"): "read",
+    ("GET", "/completion/history"): "read",
+    ("GET", "/completion/export"): "read",
+    ("GET", "/stats"): "read",
+}
+
+def route_class(method: str, path: str) -> Optional[str]:
+    return ROUTE_CLASSES.get((method, path))
+
+def client_identity(scope, route_class: str) -> str:
+    """Rate-limit key of a request: the token's user, else the client IP.
+
+    Only the token signature is checked, so this costs no database round
+    trip. Logins are always keyed by IP.
+    """
+    if route_class != "login":
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer":
+                    try:
+                        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+                        return f"user:{payload.get('uid') or payload.get('sub')}"
+                    except jwt.PyJWTError:
+                        pass
+                break
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+admission = AdmissionControl(
+    route_class,
+    client_identity,
+    {
+        name: limit for name, limit in ((name, parse_rate(spec)) for name, spec in RATE_LIMITS.items())
+        if limit is not None and RATE_LIMITING
+    },
+    InMemoryBucketStore(RATE_LIMIT_MAX_BUCKETS),
+    ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT)
+    if MAX_CONCURRENT_REQUESTS > 0 else None,
+)
+
+def is_known_paper(subject_id: str, year: int, session: str, paper: str, timezone: Optional[str]) -> bool:
+    """Check a paper against the catalog; without a loaded catalog only the session is checked"""
+    if not paper_catalog:
+        return is_valid_session(year, session)
+    return paper_catalog.lookup(subject_id, year, session, paper, timezone) is not None
+
+def completion_key(subject_id: str, year: int, session: str, paper: str, timezone: Optional[str]) -> str:
+    # Include timezone in the key if it exists
+    if timezone:
+        return f"{subject_id}-{year}-{session}-{paper}-{timezone}"
+    return f"{subject_id}-{year}-{session}-{paper}"
+
+def parse_completion_key(key: str):
+    """Split a "{subject}-{year}-{session}-{paper}[-{timezone}]" key.
+
+    Returns (subject_id, year, session, paper, timezone) with timezone None when
+    the key has no suffix, or None if the key is malformed.
+    """
+    parts = key.split('-')
+    if len(parts) == 4:
+        subject_id, year, session, paper = parts
+        timezone = None
+    elif len(parts) == 5:
+        subject_id, year, session, paper, timezone = parts
+    else:
+        return None
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Check if username already exists
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user.username,))
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already registered"
-            )
-        
-        # Check if email already exists
-        cursor.execute("SELECT id FROM users WHERE email = %s", (user.email,))
-        if cursor.fetchone():
-            cursor.close()
-            conn.close()
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered"
-            )
+        year = int(year)
+    except ValueError:
+        return None
+    return subject_id, year, session, paper, timezone or None
+
+def completion_rows(completion_data: Dict[str, Dict[str, Any]]):
+    """Turn a /completion/bulk payload into one storage row per known paper.
+
+    Malformed keys, papers missing from the catalog and entries whose
+    is_completed is not a bool or whose score is not None or an int in 0-100
+    are skipped; when a payload names the same paper twice the later key wins.
+    """
+    rows = {}
+    for key, value in completion_data.items():
+        parsed = parse_completion_key(key)
+        if parsed is None:
+            logger.debug("Skipping malformed completion key: %s", key)
+            continue
+        subject_id, year, session, paper, timezone = parsed
         
-        # Create new user
-        hashed_password = get_password_hash(user.password)
-        cursor.execute(
-            "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id",
-            (user.username, user.email, hashed_password)
+        # Skip papers that do not exist (invalid sessions, unknown subjects...)
+        if not is_known_paper(subject_id, year, session, paper, timezone):
+            logger.debug("Skipping unknown paper: %s", key)
+            continue
+
+        is_completed, score = value.get('is_completed', False), value.get('score')
+        if not isinstance(is_completed, bool) or not (
+            score is None or (type(score) is int and 0 <= score <= 100)
+        ):
+            logger.debug("Skipping invalid completion value for %s: %r", key, value)
+            continue
+
+        rows[(subject_id, year, session, paper, timezone or '')] = (
+            subject_id, year, session, paper, timezone, is_completed, score
         )
-        user_id = cursor.fetchone()[0]
-        
-        cursor.close()
-        conn.close()
+    return list(rows.values())
+
+async def _flush_completion_batch(entries):
+    batch = [
+        (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+        for user_id, (subject_id, year, session, paper, _), (timezone, is_completed, score) in entries
+    ]
+    if attempt_compactor is not None:
+        await storage.append_attempts(batch)
+        attempt_compactor.appended(*{entry[0] for entry in batch})
+    else:
+        await storage.write_completion_batch(batch)
+
+# Optional write-behind buffer for POST /completion (see WRITE_BEHIND_WINDOW)
+completion_buffer = WriteBehindBuffer(_flush_completion_batch, window=WRITE_BEHIND_WINDOW, rejects=(RejectedWrite,)) if WRITE_BEHIND_WINDOW > 0 else None
+
+# Optional background compaction of the attempt log (see ATTEMPT_COMPACT_INTERVAL)
+attempt_compactor = (
+    AttemptCompactor(storage.compact_attempts, interval=ATTEMPT_COMPACT_INTERVAL, batch_size=ATTEMPT_COMPACT_BATCH)
+    if ATTEMPT_COMPACT_INTERVAL > 0 else None
+)
+
+async def flush_pending_writes(user_id: int):
+    """Write out the user's buffered and uncompacted completion changes so a following read sees them"""
+    if completion_buffer is not None:
+        await completion_buffer.flush_user(user_id)
+    if attempt_compactor is not None:
+        await attempt_compactor.compact_user(user_id)
+
+def completion_etag(user_id: int, count: int, last_updated: Optional[datetime], since: Optional[datetime], variant: str = "") -> str:
+    """ETag of the user's completion state, from the storage's version probe (row count and newest updated_at)"""
+    version = f"{user_id}:{count}:{last_updated.isoformat() if last_updated else ''}:{since.isoformat() if since else ''}:{variant}"
+    return '"' + hashlib.sha256(version.encode()).hexdigest()[:32] + '"'
+
+def completion_snapshot_response(snapshot: Snapshot, request: Request) -> Response:
+    headers = {"ETag": snapshot.etag, "Cache-Control": "private, no-cache"}
+    if snapshot.cursor:
+        headers["X-Completion-Cursor"] = snapshot.cursor
+    if etag_matches(request.headers.get("if-none-match"), snapshot.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    accept_encoding = request.headers.get("accept-encoding")
+    body, encoding = snapshot.body, snapshot.encoding
+    if encoding is None or encoding not in accepted_encodings(accept_encoding):
+        # Stored uncompressed or in a coding this client does not accept
+        body, encoding = encode_body(decode_body(body, encoding), accept_encoding, COMPRESS_MIN_BYTES)
+    return encoded_response(body, encoding, headers)
+
+def completion_changes(rows) -> Dict[str, Dict[str, Any]]:
+    """Paper rows as a delta keyed like the GET /completion map"""
+    return {
+        completion_key(subject_id, year, session, paper, timezone): {"is_completed": bool(is_completed), "score": score}
+        for subject_id, year, session, paper, timezone, is_completed, score in rows
+    }
+
+async def publish_completion(user_id: int, rows):
+    """Push written paper rows to the user's open event streams; None asks them to resync"""
+    event = RESYNC if rows is None else {"type": "completion", "changes": completion_changes(rows)}
+    if event is not RESYNC and not event["changes"]:
+        return
+    try:
+        await event_broker.publish(user_id, event)
+    except Exception:
+        # The write itself succeeded; streams catch up on their next reconnect
+        logger.exception("Error publishing completion event for user %s", user_id)
+
+# Routes
+@router.post("/register", response_model=Token)
+async def register_user(user: User):
+    try:
+        # Hash on the worker processes before borrowing a connection
+        hashed_password = await password_hasher.hash(user.password)
+        user_id = await storage.create_user(user.username, user.email, hashed_password)
+        invalidate_user(user.username)
         
         # Create access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data={"sub": user.username, "uid": user_id}, expires_delta=access_token_expires
         )
         
         return {"access_token": access_token, "token_type": "bearer"}
-    except Exception as e:
-        print(f"Error registering user: {e}")
+    except UserExists as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception:
+        logger.exception("Error registering user")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error registering user"
         )
 
-@app.post("/token", response_model=Token)
+@router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    # Per account, so guessing one password is slow however many IPs try it
+    wait = await admission.take("login_user", form_data.username)
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -409,349 +850,636 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id}, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/users/me")
+@router.get("/users/me")
 async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
     return {"id": current_user.id, "username": current_user.username, "email": current_user.email}
 
-@app.post("/subjects")
+@router.post("/subjects")
 async def save_subjects(subject_list: SubjectList, current_user: UserInDB = Depends(get_current_user)):
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Check if user already has subjects saved
-        cursor.execute("SELECT id FROM user_subjects WHERE user_id = %s", (current_user.id,))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing subjects
-            cursor.execute(
-                "UPDATE user_subjects SET subjects = %s WHERE user_id = %s",
-                (json.dumps(subject_list.subjects), current_user.id)
-            )
-        else:
-            # Create new subjects entry
-            cursor.execute(
-                "INSERT INTO user_subjects (user_id, subjects) VALUES (%s, %s)",
-                (current_user.id, json.dumps(subject_list.subjects))
-            )
-        
-        cursor.close()
-        conn.close()
+        await storage.save_subjects(current_user.id, subject_list.subjects)
         
         return {"status": "success", "message": "Subjects saved successfully"}
-    except Exception as e:
-        print(f"Error saving subjects: {e}")
+    except Exception:
+        logger.exception("Error saving subjects")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error saving subjects"
         )
 
-@app.get("/subjects")
+@router.get("/subjects")
 async def get_subjects(current_user: UserInDB = Depends(get_current_user)):
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT subjects FROM user_subjects WHERE user_id = %s", (current_user.id,))
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        if result:
-            subjects = json.loads(result[0])
-            return {"subjects": subjects}
-        else:
-            return {"subjects": []}
-    except Exception as e:
-        print(f"Error getting subjects: {e}")
+        subjects = await storage.get_subjects(current_user.id)
+        return {"subjects": subjects or []}
+    except Exception:
+        logger.exception("Error getting subjects")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving subjects"
         )
 
-@app.get("/subject-groups")
-async def get_subject_groups():
+@service_router.get("/subject-groups")
+async def get_subject_groups(request: Request):
     """Return all available IB subject groups and their subjects"""
-    return {"subject_groups": IB_SUBJECT_GROUPS}
+    return subject_groups_payload.response(request)
 
-@app.get("/timezone-config")
-async def get_timezone_config():
+@service_router.get("/timezone-config")
+async def get_timezone_config(request: Request):
     """Return the timezone configuration for all subjects"""
-    return {"timezone_config": TIMEZONE_CONFIG}
+    refresh_timezone_config()
+    return timezone_config_payload.response(request)
+
+@service_router.get("/health")
+async def health():
+    """Return service health, storage, admission, user and completion cache, hashing, mailer, write-behind, compaction and event stream statistics"""
+    return {
+        "status": "ok",
+        "storage": storage.name,
+        "pool": storage.stats(),
+        "admission": admission.stats(),
+        "user_cache": user_cache.stats(),
+        "completion_cache": completion_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "feedback_mailer": feedback_mailer.stats() if feedback_mailer is not None else None,
+        "write_behind": completion_buffer.stats() if completion_buffer is not None else None,
+        "attempt_compactor": attempt_compactor.stats() if attempt_compactor is not None else None,
+        "events": event_broker.stats(),
+    }
+
+@service_router.get("/ready")
+async def ready():
+    """Readiness probe: 503 until startup warm-up has finished"""
+    if warm_up_seconds is None:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "warming up"})
+    return {"status": "ready", "lazy_startup": LAZY_STARTUP, "warm_up_seconds": round(warm_up_seconds, 3)}
+
+@service_router.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-route traffic and latency plus storage and cache gauges"""
+    cache_stats = user_cache.stats()
+    snapshot_stats = completion_cache.stats()
+    hasher_stats = password_hasher.stats()
+    gauges = storage.gauges()
+    gauges.update({
+        "user_cache_hits": cache_stats["hits"],
+        "user_cache_misses": cache_stats["misses"],
+        "completion_cache_hits": snapshot_stats["hits"],
+        "completion_cache_misses": snapshot_stats["misses"],
+        "completion_cache_bytes": snapshot_stats["bytes"],
+        "completion_cache_evictions": snapshot_stats["evictions"],
+        "password_hash_in_flight": hasher_stats["in_flight"],
+        "password_rehashes": hasher_stats["rehashes"],
+    })
+    if completion_buffer is not None:
+        buffer_stats = completion_buffer.stats()
+        gauges["write_behind_pending"] = buffer_stats["pending"]
+        gauges["write_behind_received"] = buffer_stats["received"]
+        gauges["write_behind_absorbed"] = buffer_stats["absorbed"]
+        gauges["write_behind_flushed"] = buffer_stats["flushed"]
+        gauges["write_behind_failures"] = buffer_stats["failures"]
+        gauges["write_behind_rejected"] = buffer_stats["rejected"]
+    if attempt_compactor is not None:
+        compactor_stats = attempt_compactor.stats()
+        gauges["attempts_compacted"] = compactor_stats["folded"]
+        gauges["attempt_compaction_failures"] = compactor_stats["failures"]
+    admission_stats = admission.stats()
+    for name, rejected in admission_stats["rate_limited"].items():
+        gauges[f"rate_limited_{name}"] = rejected
+    if admission.limiter is not None:
+        concurrency = admission_stats["concurrency"]
+        gauges["admission_in_flight"] = concurrency["in_flight"]
+        gauges["admission_waiting"] = concurrency["waiting"]
+        gauges["admission_queued"] = concurrency["queued"]
+        gauges["admission_shed"] = concurrency["shed"]
+        gauges["admission_timed_out"] = concurrency["timed_out"]
+        gauges["admission_wait_seconds"] = concurrency["wait_seconds"]
+    event_stats = event_broker.stats()
+    gauges["event_streams_open"] = event_stats["streams"]
+    gauges["events_published"] = event_stats["published"]
+    gauges["events_delivered"] = event_stats["delivered"]
+    gauges["event_stream_overflows"] = event_stats["overflows"]
+    return Response(
+        content=request_metrics.render(gauges),
+        media_type="text/plain; version=0.0.4"
+    )
+
+@router.post("/completion")
+async def update_completion(completion: CompletionStatus, current_user: Optional[UserInDB] = Depends(get_current_user_optional)):
+    # Reject papers that cannot exist before touching the database
+    if not is_valid_session(completion.year, completion.session):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid exam session"
+        )
+    if not is_known_paper(completion.subject_id, completion.year, completion.session, completion.paper, completion.timezone):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown paper"
+        )
 
-@app.post("/completion")
-async def update_completion(status: CompletionStatus, current_user: Optional[UserInDB] = Depends(get_current_user_optional)):
     try:
-        # Validate the session
-        if not is_valid_session(status.year, status.session):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid exam session"
-            )
-            
-        print(f"[DEBUG] Updating completion status:")
-        print(f"[DEBUG] Status data: {status}")
+        logger.debug("Updating completion status: %s", completion)
         
-        if current_user:
-            # Existing code for authenticated users
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.autocommit = True
-            cursor = conn.cursor()
-            
-            # Check if this specific paper status already exists
-            query = """
-                SELECT id FROM completion_status 
-                WHERE user_id = %s AND subject_id = %s AND year = %s 
-                AND session = %s AND paper = %s
-            """
-            params = [current_user.id, status.subject_id, status.year, status.session, status.paper]
-            
-            # Add timezone to query if provided
-            if status.timezone:
-                query += " AND timezone = %s"
-                params.append(status.timezone)
-            else:
-                query += " AND (timezone IS NULL OR timezone = '')"
-                
-            print(f"[DEBUG] Executing query: {query}")
-            print(f"[DEBUG] With params: {params}")
-            cursor.execute(query, params)
-            existing = cursor.fetchone()
-            
-            if existing:
-                # Update existing status
-                print(f"[DEBUG] Updating existing status ID {existing[0]}")
-                cursor.execute(
-                    """
-                    UPDATE completion_status 
-                    SET is_completed = %s, score = %s, updated_at = CURRENT_TIMESTAMP 
-                    WHERE id = %s
-                    """,
-                    (status.is_completed, status.score, existing[0])
-                )
-            else:
-                # Create new status
-                print(f"[DEBUG] Creating new status")
-                cursor.execute(
-                    """
-                    INSERT INTO completion_status 
-                    (user_id, subject_id, year, session, paper, timezone, is_completed, score) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    """,
-                    (current_user.id, status.subject_id, status.year, status.session, 
-                     status.paper, status.timezone, status.is_completed, status.score)
-                )
-                print(f"[DEBUG] New status created successfully")
-            
-            cursor.close()
-            conn.close()
+        if current_user and completion_buffer is not None:
+            # Buffered: acknowledged now, written with the next batch
+            timezone = completion.timezone or None
+            completion_buffer.put(
+                current_user.id,
+                (completion.subject_id, completion.year, completion.session, completion.paper, timezone or ''),
+                (timezone, completion.is_completed, completion.score)
+            )
+            completion_cache.bump(current_user.id)
+            await publish_completion(current_user.id, [
+                (completion.subject_id, completion.year, completion.session, completion.paper, timezone, completion.is_completed, completion.score)
+            ])
+            return {
+                "status": "success",
+                "completion": {
+                    "subject_id": completion.subject_id,
+                    "year": completion.year,
+                    "session": completion.session,
+                    "paper": completion.paper,
+                    "timezone": timezone,
+                    "is_completed": completion.is_completed,
+                    "score": completion.score,
+                    "updated_at": None
+                }
+            }
+        elif current_user and attempt_compactor is not None:
+            # Logged: appended now, folded into the stored state by the compactor
+            timezone = completion.timezone or None
+            entry = (completion.subject_id, completion.year, completion.session, completion.paper, timezone, completion.is_completed, completion.score)
+            await storage.append_attempts([(current_user.id, *entry)])
+            attempt_compactor.appended(current_user.id)
+            completion_cache.bump(current_user.id)
+            await publish_completion(current_user.id, [entry])
+            return {
+                "status": "success",
+                "completion": {
+                    "subject_id": completion.subject_id,
+                    "year": completion.year,
+                    "session": completion.session,
+                    "paper": completion.paper,
+                    "timezone": timezone,
+                    "is_completed": completion.is_completed,
+                    "score": completion.score,
+                    "updated_at": None
+                }
+            }
+        elif current_user:
+            subject_id, year, session, paper, timezone, is_completed, score, updated_at = await storage.update_completion(
+                current_user.id, completion.subject_id, completion.year, completion.session, completion.paper,
+                completion.timezone or None, completion.is_completed, completion.score
+            )
+            completion_cache.bump(current_user.id)
+            await publish_completion(current_user.id, [(subject_id, year, session, paper, timezone, is_completed, score)])
             
-            return {"status": "success"}
+            return {
+                "status": "success",
+                "completion": {
+                    "subject_id": subject_id,
+                    "year": year,
+                    "session": session,
+                    "paper": paper,
+                    "timezone": timezone,
+                    "is_completed": is_completed,
+                    "score": score,
+                    "updated_at": updated_at.isoformat() if updated_at else None
+                }
+            }
         else:
             # For anonymous users, just return success since they'll use local storage
             return {"status": "success"}
             
-    except Exception as e:
-        print(f"[ERROR] Error updating completion status: {e}")
+    except Exception:
+        logger.exception("Error updating completion status")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error updating completion status"
         )
 
-@app.post("/completion/bulk")
-async def bulk_update_completion(data: BulkCompletionStatus, current_user: Optional[UserInDB] = Depends(get_current_user_optional)):
+@router.post(
+    "/completion/bulk",
+    openapi_extra={"requestBody": {
+        "content": {"application/json": {"schema": BulkCompletionStatus.schema()}}, "required": True
+    }},
+)
+async def bulk_update_completion(
+    completion_data: Dict[str, Dict[str, Any]] = Depends(read_bulk_completion),
+    current_user: Optional[UserInDB] = Depends(get_current_user_optional)
+):
     try:
         if current_user:
-            conn = psycopg2.connect(DATABASE_URL)
-            conn.autocommit = True
-            cursor = conn.cursor()
-            
-            # First, delete any May 2020 entries
-            cursor.execute("""
-                DELETE FROM completion_status 
-                WHERE user_id = %s AND year = 2020 AND session = 'May'
-            """, (current_user.id,))
-            
-            for key, value in data.completion_data.items():
-                subject_id, year, session, paper, *timezone_part = key.split('-')
-                year = int(year)
-                
-                # Skip invalid sessions
-                if not is_valid_session(year, session):
-                    continue
-                    
-                query = """
-                    SELECT id FROM completion_status 
-                    WHERE user_id = %s AND subject_id = %s AND year = %s 
-                    AND session = %s AND paper = %s
-                """
-                params = [current_user.id, subject_id, int(year), session, paper]
-                
-                if timezone:
-                    query += " AND timezone = %s"
-                    params.append(timezone)
-                else:
-                    query += " AND (timezone IS NULL OR timezone = '')"
-                    
-                cursor.execute(query, params)
-                existing = cursor.fetchone()
-                
-                if existing:
-                    cursor.execute(
-                        """
-                        UPDATE completion_status 
-                        SET is_completed = %s, score = %s, updated_at = CURRENT_TIMESTAMP 
-                        WHERE id = %s
-                        """,
-                        (value['is_completed'], value.get('score'), existing[0])
-                    )
-                else:
-                    cursor.execute(
-                        """
-                        INSERT INTO completion_status 
-                        (user_id, subject_id, year, session, paper, timezone, is_completed, score) 
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """,
-                        (current_user.id, subject_id, int(year), session, paper, 
-                         timezone, value['is_completed'], value.get('score'))
-                    )
-            
-            cursor.close()
-            conn.close()
+            # Buffered single writes are older than this sync, so land them first
+            await flush_pending_writes(current_user.id)
+            rows = completion_rows(completion_data)
+            await storage.bulk_update_completion(current_user.id, rows)
+            completion_cache.bump(current_user.id)
+            await publish_completion(current_user.id, rows)
         
         return {"status": "success", "message": "Bulk completion status updated"}
-    except Exception as e:
-        print(f"[ERROR] Error updating bulk completion status: {e}")
+    except Exception:
+        logger.exception("Error updating bulk completion status")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error updating bulk completion status"
         )
 
-@app.get("/completion")
-async def get_completion(current_user: Optional[UserInDB] = Depends(get_current_user_optional)):
+@router.get("/completion")
+async def get_completion(
+    request: Request,
+    since: Optional[str] = None,
+    format: str = "json",
+    current_user: Optional[UserInDB] = Depends(get_current_user_optional)
+):
+    """Return the user's completion map.
+
+    With ``since=<cursor>`` only papers changed after the cursor are returned,
+    as ``{"changes": {...}, "cursor": ...}``. With ``format=compact`` the full
+    state is returned as base64 per-subject bitsets plus score arrays, with
+    the slot layout needed to decode them. Every response carries an ETag;
+    a matching If-None-Match is answered with 304 Not Modified.
+    """
+    if format not in ("json", "compact"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'json' or 'compact'"
+        )
+    if since is not None:
+        if format == "compact":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="since is not supported with format=compact"
+            )
+        try:
+            since_at = datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid since cursor"
+            )
+    else:
+        since_at = None
+    
     try:
         if not current_user:
             # For anonymous users, return empty completion data
             # They will use local storage on the frontend
             return {}
             
-        print(f"[DEBUG] Fetching completion data for user {current_user.id}")
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        
-        query = """
-            SELECT subject_id, year, session, paper, timezone, is_completed, score
-            FROM completion_status 
-            WHERE user_id = %s
-        """
-        print(f"[DEBUG] Executing query: {query}")
-        cursor.execute(query, (current_user.id,))
-        
-        results = cursor.fetchall()
-        print(f"[DEBUG] Found {len(results)} completion records")
+        # The full map is served from its serialized snapshot while the user's
+        # version is unchanged; no pending write can exist while it is cached
+        if_none_match = request.headers.get("if-none-match")
+        cacheable = since_at is None and format == "json"
+        if cacheable:
+            snapshot = completion_cache.get(current_user.id)
+            if snapshot is not None:
+                return completion_snapshot_response(snapshot, request)
+            cache_version = completion_cache.version(current_user.id)
+
+        await flush_pending_writes(current_user.id)
+        use_bitsets = COMPLETION_STORAGE == "bitset" and since_at is None
+        version = {}
+
+        def is_current(count, last_updated):
+            version["etag"] = completion_etag(current_user.id, count, last_updated, since_at, format)
+            return etag_matches(if_none_match, version["etag"])
+
+        if use_bitsets:
+            count, last_updated, results = await storage.fetch_completion_bitsets(current_user.id, is_current)
+        else:
+            # Re-read a short overlap so rows committed with an older timestamp are not missed
+            overlap_since = since_at - timedelta(seconds=DELTA_SYNC_OVERLAP) if since_at is not None else None
+            count, last_updated, results = await storage.fetch_completion(current_user.id, overlap_since, is_current)
+        etag = version["etag"]
+        next_cursor = last_updated.isoformat() if last_updated else (since_at.isoformat() if since_at else None)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if next_cursor:
+            headers["X-Completion-Cursor"] = next_cursor
+        if results is None:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        logger.debug("Fetched %d completion records for user %s", len(results), current_user.id)
         
-        completion_data = {}
-        for row in results:
-            subject_id, year, session, paper, timezone, is_completed, score = row
-            # Include timezone in the key if it exists
-            if timezone:  # timezone
-                key = f"{subject_id}-{year}-{session}-{paper}-{timezone}"
-            else:
-                key = f"{subject_id}-{year}-{session}-{paper}"
-                
-            # Always return an object with is_completed and score properties
-            completion_data[key] = {
-                "is_completed": bool(is_completed),  # Ensure boolean
-                "score": score if score is not None else None
+        if not use_bitsets and format == "compact":
+            # Pack the rows the same way the bitset table stores them
+            by_subject = {}
+            for subject_id, year, session, paper, timezone, is_completed, score in results:
+                by_subject.setdefault(subject_id, []).append((year, session, paper, timezone, is_completed, score))
+            results = [(subject_id, *bitsets.encode(rows)) for subject_id, rows in sorted(by_subject.items())]
+
+        if format == "compact":
+            body = {
+                "layout": bitsets.compact_layout(),
+                "subjects": {
+                    subject_id: bitsets.compact_subject(completed, scores)
+                    for subject_id, completed, scores in results
+                },
             }
-            print(f"[DEBUG] Record {key}: {completion_data[key]}")
-        
-        cursor.close()
-        conn.close()
+            body, encoding = encode_body(json_dumps(body), request.headers.get("accept-encoding"), COMPRESS_MIN_BYTES)
+            return encoded_response(body, encoding, headers)
+
+        completion_data = {}
+        if use_bitsets:
+            for subject_id, completed, scores in results:
+                bitsets.decode(subject_id, completed, scores, into=completion_data)
+        else:
+            for row in results:
+                subject_id, year, session, paper, timezone, is_completed, score = row
+                key = completion_key(subject_id, year, session, paper, timezone)
+                    
+                # Always return an object with is_completed and score properties
+                completion_data[key] = {
+                    "is_completed": bool(is_completed),  # Ensure boolean
+                    "score": score if score is not None else None
+                }
         
-        return completion_data
-    except Exception as e:
-        print(f"[ERROR] Error getting completion data: {e}")
+        body = completion_data if since_at is None else {"changes": completion_data, "cursor": next_cursor}
+        body, encoding = encode_body(json_dumps(body), request.headers.get("accept-encoding"), COMPRESS_MIN_BYTES)
+        if cacheable:
+            completion_cache.set(current_user.id, cache_version, Snapshot(body, etag, next_cursor, encoding))
+        return encoded_response(body, encoding, headers)
+    except Exception:
+        logger.exception("Error getting completion data")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving completion data"
         )
 
-@app.post("/feedback")
-async def submit_feedback(feedback: FeedbackModel):
+@router.get("/completion/history")
+async def completion_history(
+    key: str,
+    before: Optional[str] = None,
+    limit: int = 50,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Return the recorded attempts at one paper, newest first.
+
+    ``key`` is a completion key as used by GET /completion. Pages hold up to
+    ``limit`` attempts; pass the returned ``next_before`` as ``before`` to get
+    the next, older page.
+    """
+    parsed = parse_completion_key(key)
+    if parsed is None or not is_known_paper(*parsed):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown paper"
+        )
+    if not 1 <= limit <= ATTEMPT_HISTORY_MAX_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"limit must be between 1 and {ATTEMPT_HISTORY_MAX_LIMIT}"
+        )
     try:
-        # Create email message
-        msg = MIMEMultipart()
-        msg["From"] = EMAIL_USERNAME
-        msg["To"] = EMAIL_RECIPIENT
-        msg["Subject"] = "IB Paper Tracker Feedback"
-        
-        # Format the email body
-        email_body = f"""
-        New Feedback from IB Paper Tracker:
-        
-        From: {feedback.user if feedback.user else feedback.email if feedback.email else 'Anonymous'}
-        Time: {feedback.timestamp if feedback.timestamp else datetime.now().isoformat()}
-        
-        Message:
-        {feedback.message}
-        """
-        
-        msg.attach(MIMEText(email_body, "plain"))
-        
-        # Save feedback to database if needed
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # Create feedback table if it doesn't exist
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_feedback (
-            id SERIAL PRIMARY KEY,
-            message TEXT NOT NULL,
-            email TEXT,
-            user_identifier TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        before_at = datetime.fromisoformat(before) if before is not None else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid before cursor"
         )
-        ''')
-        
-        # Save the feedback
-        cursor.execute(
-            "INSERT INTO user_feedback (message, email, user_identifier, timestamp) VALUES (%s, %s, %s, %s)",
-            (feedback.message, feedback.email, feedback.user, 
-             datetime.now() if not feedback.timestamp else datetime.fromisoformat(feedback.timestamp.replace('Z', '+00:00')))
+
+    try:
+        await flush_pending_writes(current_user.id)
+        attempts = await storage.fetch_attempts(current_user.id, *parsed, before_at, limit)
+    except Exception:
+        logger.exception("Error getting completion history")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error retrieving completion history"
         )
-        
-        cursor.close()
-        conn.close()
-        
-        # Send email if configured
-        if EMAIL_USERNAME and EMAIL_PASSWORD and EMAIL_RECIPIENT:
-            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-            server.starttls()
-            server.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-            server.send_message(msg)
-            server.quit()
-            print(f"Feedback email sent to {EMAIL_RECIPIENT}")
-        else:
-            print("Email sending skipped - email configuration not provided")
-        
+    return {
+        "key": key,
+        "attempts": [
+            {"is_completed": bool(is_completed), "score": score, "recorded_at": recorded_at.isoformat()}
+            for recorded_at, is_completed, score in attempts
+        ],
+        "next_before": attempts[-1][0].isoformat() if len(attempts) == limit else None,
+    }
+
+@router.get("/completion/events")
+async def completion_events(
+    request: Request,
+    since: Optional[str] = None,
+    current_user: UserInDB = Depends(get_stream_user)
+):
+    """Stream the user's completion changes as Server-Sent Events.
+
+    Every write from any of the user's devices arrives as a ``completion``
+    event whose ``changes`` have the same shape as the GET /completion map.
+    The first event, ``ready``, carries the completion cursor as its event
+    id; when EventSource reconnects with it as Last-Event-ID (or a client
+    passes ``since=<cursor>``), the changes made in between are sent right
+    after it. ``resync`` means changes were lost and the map should be re-read.
+    """
+    cursor = request.headers.get("last-event-id") or since
+    try:
+        since_at = datetime.fromisoformat(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid since cursor"
+        )
+
+    async def events():
+        # Subscribe before catching up so nothing written meanwhile is missed
+        subscription = event_broker.subscribe(current_user.id)
+        try:
+            yield "retry: 3000\n\n"
+            try:
+                await flush_pending_writes(current_user.id)
+                if since_at is None:
+                    count, last_updated, rows = await storage.fetch_completion(
+                        current_user.id, is_current=lambda count, last_updated: True
+                    )
+                else:
+                    count, last_updated, rows = await storage.fetch_completion(
+                        current_user.id, since_at - timedelta(seconds=DELTA_SYNC_OVERLAP)
+                    )
+                next_cursor = (last_updated or since_at or datetime(1970, 1, 1)).isoformat()
+                yield format_event({"type": "ready", "cursor": next_cursor}, event_id=next_cursor)
+                if rows:
+                    yield format_event({"type": "completion", "changes": completion_changes(rows)})
+            except Exception:
+                logger.exception("Error catching up completion events for user %s", current_user.id)
+                yield format_event(RESYNC)
+
+            while True:
+                event = await subscription.next(EVENT_STREAM_HEARTBEAT)
+                if event is not None:
+                    yield format_event(event)
+                elif subscription.closed:
+                    break
+                else:
+                    yield ": ping\n\n"
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/completion/export")
+async def export_completion(format: str = "ndjson", current_user: UserInDB = Depends(get_current_user)):
+    """Stream the user's full completion history as NDJSON or CSV.
+
+    Rows are read EXPORT_CHUNK_ROWS at a time, so memory stays flat however
+    large the history is.
+    """
+    if format not in FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'ndjson' or 'csv'"
+        )
+    await flush_pending_writes(current_user.id)
+
+    async def lines():
+        if format == "csv":
+            yield csv_header()
+        async for rows in storage.export_completion(current_user.id, EXPORT_CHUNK_ROWS):
+            yield format_rows(rows, format)
+
+    return StreamingResponse(
+        lines(),
+        media_type=FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="completion.{format}"'}
+    )
+
+@router.post("/completion/import")
+async def import_completion(request: Request, format: str = "ndjson", current_user: UserInDB = Depends(get_current_user)):
+    """Merge an uploaded NDJSON or CSV file (the export format) into the user's completion.
+
+    The request body is parsed as it arrives and staged IMPORT_BATCH_ROWS at
+    a time (COPY into a temporary table on PostgreSQL), then merged with one
+    upsert. Papers missing from the catalog are skipped; a malformed line
+    rejects the whole import.
+    """
+    if format not in FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="format must be 'ndjson' or 'csv'"
+        )
+    await flush_pending_writes(current_user.id)
+
+    parser = RecordParser(format)
+    received = skipped = 0
+    try:
+        async with storage.import_completion(current_user.id) as staged:
+            batch = []
+
+            async def stage(records):
+                nonlocal batch, received, skipped
+                for subject_id, year, session, paper, timezone, is_completed, score in records:
+                    received += 1
+                    if not is_known_paper(subject_id, year, session, paper, timezone):
+                        skipped += 1
+                        continue
+                    batch.append((subject_id, year, session, paper, timezone, is_completed, score))
+                if len(batch) >= IMPORT_BATCH_ROWS:
+                    await staged.stage(batch)
+                    batch = []
+
+            async for chunk in request.stream():
+                await stage(parser.feed(chunk))
+            await stage(parser.close())
+            if batch:
+                await staged.stage(batch)
+            merged = await staged.merge()
+    except RecordError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {format} upload, {e}"
+        )
+    except Exception:
+        logger.exception("Error importing completion data")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error importing completion data"
+        )
+    if merged:
+        completion_cache.bump(current_user.id)
+        # Too large for a delta; open streams re-read the state instead
+        await publish_completion(current_user.id, None)
+    return {"status": "success", "received": received, "imported": merged, "skipped": skipped}
+
+@router.get("/stats")
+async def get_stats(
+    start_year: int = FIRST_YEAR,
+    end_year: int = LAST_YEAR,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Return completion counts, percentages and scores per subject and per year.
+
+    Served from the user_progress summary that the completion write paths keep
+    up to date. Percentages are measured against the paper catalog for the
+    requested year range.
+    """
+    if start_year > end_year:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_year must not be after end_year"
+        )
+    try:
+        await flush_pending_writes(current_user.id)
+        subjects, rows = await storage.fetch_progress(current_user.id)
+        years = range(max(start_year, FIRST_YEAR), min(end_year, LAST_YEAR) + 1)
+        return build_stats(rows, subjects, years, paper_catalog.available)
+    except Exception:
+        logger.exception("Error getting stats")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error retrieving stats"
+        )
+
+@router.post("/feedback")
+async def submit_feedback(feedback: FeedbackModel):
+    try:
+        # Only enqueue; the background mailer sends digests of the outbox
+        timestamp = datetime.now() if not feedback.timestamp else datetime.fromisoformat(feedback.timestamp.replace('Z', '+00:00'))
+        await storage.save_feedback(feedback.message, feedback.email, feedback.user, timestamp)
         return {"status": "success", "message": "Feedback received"}
-    except Exception as e:
-        print(f"Error processing feedback: {e}")
+    except Exception:
+        logger.exception("Error processing feedback")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error processing feedback"
         )
 
+def create_app() -> FastAPI:
+    """Build the ASGI app around this module's storage and workers.
+
+    ``uvicorn main:app`` serves the instance below; ``uvicorn main:create_app
+    --factory`` builds it on demand.
+    """
+    app = FastAPI(title="IB Paper Tracker API", default_response_class=FastJSONResponse)
+
+    # Inside CORS so rejections carry its headers, and inside metrics so they are counted
+    app.add_middleware(AdmissionMiddleware, control=admission)
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, replace with your frontend domain
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+    app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
+    app.include_router(service_router)
+    app.include_router(router)
+    app.add_event_handler("startup", startup_event)
+    app.add_event_handler("shutdown", shutdown_event)
+    return app
+
+app = create_app()
+
 # Run the application
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,181 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Label used for requests that did not match any route, to bound cardinality
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class QueryStats:
+    """Database work attributed to the request being served."""
+
+    __slots__ = ("queries", "seconds", "rows")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+
+
+_current_query_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "current_query_stats", default=None
+)
+
+
+def record_query(seconds: float, rows: int):
+    """Attribute one database round trip to the current request, if any."""
+    stats = _current_query_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+        stats.rows += rows
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class RequestMetrics:
+    """Per-route request counters and latency histograms.
+
+    Rendered in the Prometheus text exposition format, so no client library is
+    needed. Routes are labelled by their path template (``/completion``), never
+    by the raw URL.
+    """
+
+    def __init__(self, prefix: str = "paperpath", buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, str], int] = {}
+        self._latency: Dict[Tuple[str, str], _Histogram] = {}
+        self._db_latency: Dict[Tuple[str, str], _Histogram] = {}
+        self._db_queries: Dict[Tuple[str, str], int] = {}
+        self._db_rows: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, query_stats: QueryStats):
+        key = (method, route)
+        with self._lock:
+            request_key = (method, route, str(status_code))
+            self._requests[request_key] = self._requests.get(request_key, 0) + 1
+            self._observe(self._latency, key, seconds)
+            self._observe(self._db_latency, key, query_stats.seconds)
+            self._db_queries[key] = self._db_queries.get(key, 0) + query_stats.queries
+            self._db_rows[key] = self._db_rows.get(key, 0) + query_stats.rows
+
+    def _observe(self, histograms, key, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(len(self.buckets) + 1)
+        histogram.counts[bisect.bisect_left(self.buckets, value)] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Prometheus text format; ``gauges`` are appended as unlabelled gauges."""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {p}_http_requests_total Requests served, by route and status code.")
+            lines.append(f"# TYPE {p}_http_requests_total counter")
+            for (method, route, code), value in sorted(self._requests.items()):
+                lines.append(f'{p}_http_requests_total{{method="{method}",route="{_escape(route)}",status="{code}"}} {value}')
+
+            self._render_histogram(
+                lines, f"{p}_http_request_duration_seconds", "Request latency, by route.", self._latency
+            )
+            self._render_histogram(
+                lines, f"{p}_http_request_db_seconds", "Database time spent per request, by route.", self._db_latency
+            )
+
+            lines.append(f"# HELP {p}_db_queries_total Database round trips, by route.")
+            lines.append(f"# TYPE {p}_db_queries_total counter")
+            for (method, route), value in sorted(self._db_queries.items()):
+                lines.append(f'{p}_db_queries_total{{method="{method}",route="{_escape(route)}"}} {value}')
+
+            lines.append(f"# HELP {p}_db_rows_total Rows returned by the database, by route.")
+            lines.append(f"# TYPE {p}_db_rows_total counter")
+            for (method, route), value in sorted(self._db_rows.items()):
+                lines.append(f'{p}_db_rows_total{{method="{method}",route="{_escape(route)}"}} {value}')
+
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, lines, name, help_text, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (method, route), histogram in sorted(histograms.items()):
+            labels = f'method="{method}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request into a :class:`RequestMetrics`.
+
+    Implemented as plain ASGI rather than ``BaseHTTPMiddleware`` so the
+    endpoint runs in the same task and streaming responses are not buffered.
+    The route template is read from the endpoint the router matched.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths: Optional[Dict] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        query_stats = QueryStats()
+        token = _current_query_stats.set(query_stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_query_stats.reset(token)
+            self.metrics.observe(scope["method"], self._route(scope), status_code, elapsed, query_stats)
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if self._route_paths is None:
+            app = scope.get("app")
+            self._route_paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in getattr(app, "routes", ())
+                if hasattr(route, "path")
+            }
+        return self._route_paths.get(endpoint, UNMATCHED_ROUTE)
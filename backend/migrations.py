@@ -0,0 +1,348 @@
+"""Versioned schema migrations.
+
+Each migration is registered with a version number and runs exactly once per
+database, in version order, while holding a PostgreSQL advisory lock so that
+several workers booting together do not race. Applied versions are recorded
+in ``schema_version``; when the database is already current, startup costs a
+single read of that table.
+"""
+import logging
+from typing import Callable, Dict, List, NamedTuple
+
+from psycopg2.extras import execute_values
+
+# Arbitrary constant shared by every worker: pg_advisory_lock(MIGRATION_LOCK_ID)
+MIGRATION_LOCK_ID = 7300563140125474
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register ``fn(cursor, timezone_config)`` as schema version ``version``."""
+    def register(fn):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT to_regclass('schema_version')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute("SELECT COALESCE(max(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def run_migrations(pool, timezone_config: Dict) -> List[int]:
+    """Bring the database up to date; returns the versions that were applied."""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        if current_version(cursor) >= latest_version():
+            return []
+        conn.commit()
+
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.commit()
+
+            # Re-read under the lock: another worker may have migrated meanwhile
+            cursor.execute("SELECT version FROM schema_version")
+            applied_versions = {row[0] for row in cursor.fetchall()}
+            applied = []
+            for m in MIGRATIONS:
+                if m.version in applied_versions:
+                    continue
+                logger.info("Applying migration %s: %s", m.version, m.description)
+                m.apply(cursor, timezone_config)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (m.version, m.description)
+                )
+                conn.commit()
+                applied.append(m.version)
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            conn.commit()
+
+
+@migration(1, "create users, user_subjects and completion_status")
+def _create_base_tables(cursor, timezone_config):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_subjects (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        subjects TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS completion_status (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL DEFAULT FALSE,
+        score INTEGER CHECK (score >= 0 AND score <= 100),
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+
+@migration(2, "add completion_status.score and completion_status.timezone")
+def _add_score_and_timezone(cursor, timezone_config):
+    # Databases created before these columns existed
+    cursor.execute("""
+    ALTER TABLE completion_status
+    ADD COLUMN IF NOT EXISTS score INTEGER CHECK (score >= 0 AND score <= 100)
+    """)
+    cursor.execute("ALTER TABLE completion_status ADD COLUMN IF NOT EXISTS timezone TEXT")
+
+
+@migration(3, "default papers with timezone variants to TZ1")
+def _backfill_tz1(cursor, timezone_config):
+    if not timezone_config:
+        cursor.execute("SELECT 1 FROM completion_status WHERE timezone IS NULL LIMIT 1")
+        if cursor.fetchone() is not None:
+            # Roll back and retry on the next start rather than record the step as done
+            raise RuntimeError("timezone-config.json is not loaded; cannot default papers to TZ1")
+    variants = [
+        (subject_id, paper_key)
+        for subject_id, papers in timezone_config.items()
+        for paper_key, has_variants in papers.items()
+        if has_variants
+    ]
+    if not variants:
+        return
+    # One set-based UPDATE; rows that would collide with an existing TZ1 entry
+    # for the same paper are left untouched
+    execute_values(
+        cursor,
+        """
+        UPDATE completion_status c
+        SET timezone = 'TZ1', updated_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS tz (subject_id, paper_key)
+        WHERE c.timezone IS NULL
+        AND c.subject_id = tz.subject_id
+        AND replace(lower(c.paper), ' ', '') = tz.paper_key
+        AND NOT EXISTS (
+            SELECT 1 FROM completion_status o
+            WHERE o.user_id = c.user_id AND o.subject_id = c.subject_id
+            AND o.year = c.year AND o.session = c.session AND o.paper = c.paper
+            AND o.timezone = 'TZ1'
+        )
+        """,
+        variants,
+        page_size=len(variants)
+    )
+    logger.info("Defaulted %d completion records to TZ1", cursor.rowcount)
+
+
+@migration(4, "unique paper key on a normalized timezone column")
+def _unique_paper_key(cursor, timezone_config):
+    # timezone_key normalizes NULL and '' (no timezone variant) to ''
+    cursor.execute("""
+    ALTER TABLE completion_status ADD COLUMN IF NOT EXISTS timezone_key TEXT
+    GENERATED ALWAYS AS (COALESCE(timezone, '')) STORED
+    """)
+    # Collapse duplicates to the most recently updated row
+    cursor.execute("""
+    DELETE FROM completion_status a
+    USING completion_status b
+    WHERE a.user_id = b.user_id AND a.subject_id = b.subject_id
+    AND a.year = b.year AND a.session = b.session AND a.paper = b.paper
+    AND a.timezone_key = b.timezone_key
+    AND (COALESCE(a.updated_at, '-infinity'), a.id) < (COALESCE(b.updated_at, '-infinity'), b.id)
+    """)
+    logger.info("Removed %d duplicate completion records", cursor.rowcount)
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS completion_status_user_paper_key ON completion_status
+    (user_id, subject_id, year, session, paper, timezone_key)
+    """)
+
+
+@migration(5, "index completion_status (user_id, updated_at) for delta sync")
+def _index_updated_at(cursor, timezone_config):
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_status_user_updated
+    ON completion_status (user_id, updated_at)
+    """)
+
+
+@migration(6, "feedback table and delivery outbox")
+def _feedback_outbox(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_feedback (
+        id SERIAL PRIMARY KEY,
+        message TEXT NOT NULL,
+        email TEXT,
+        user_identifier TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS feedback_outbox (
+        id SERIAL PRIMARY KEY,
+        feedback_id INTEGER NOT NULL REFERENCES user_feedback (id),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP,
+        last_error TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS feedback_outbox_pending
+    ON feedback_outbox (next_attempt_at) WHERE sent_at IS NULL
+    """)
+
+
+@migration(7, "per-user progress summary for /stats")
+def _user_progress(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_progress (
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        completed INTEGER NOT NULL DEFAULT 0,
+        scored INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        best_score INTEGER,
+        latest_score INTEGER,
+        latest_at TIMESTAMP,
+        PRIMARY KEY (user_id, subject_id, year)
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO user_progress
+    (user_id, subject_id, year, completed, scored, score_sum, best_score, latest_score, latest_at)
+    SELECT user_id, subject_id, year,
+           count(*) FILTER (WHERE is_completed),
+           count(score) FILTER (WHERE is_completed),
+           COALESCE(sum(score) FILTER (WHERE is_completed), 0),
+           max(score) FILTER (WHERE is_completed),
+           (array_agg(score ORDER BY updated_at DESC NULLS LAST, id DESC)
+               FILTER (WHERE is_completed AND score IS NOT NULL))[1],
+           max(updated_at) FILTER (WHERE is_completed AND score IS NOT NULL)
+    FROM completion_status
+    GROUP BY user_id, subject_id, year
+    ON CONFLICT (user_id, subject_id, year) DO NOTHING
+    """)
+    logger.info("Summarized progress for %d user subject-years", cursor.rowcount)
+
+
+@migration(8, "packed per-subject completion bitsets")
+def _completion_bitsets(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_bitsets (
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        subject_id TEXT NOT NULL,
+        completed BYTEA NOT NULL,
+        scores BYTEA NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, subject_id)
+    )
+    """)
+    # Single row: FALSE until the bitsets are built from completion_status, and
+    # again whenever the app runs without maintaining them
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_bitsets_sync (
+        singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+        in_sync BOOLEAN NOT NULL
+    )
+    """)
+    cursor.execute("INSERT INTO completion_bitsets_sync (in_sync) VALUES (FALSE) ON CONFLICT DO NOTHING")
+
+
+@migration(9, "append-only completion attempt log and its compaction queue")
+def _completion_attempts(cursor, timezone_config):
+    # Insert-only: no primary key, foreign key or updates, and a single index
+    # serving the per-paper history
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_attempts (
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone_key TEXT NOT NULL DEFAULT '',
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER,
+        recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_attempts_paper_history ON completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, recorded_at)
+    """)
+    # Attempts not yet folded into completion_status; rows are deleted as they are compacted
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_attempt_queue (
+        id BIGSERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_attempt_queue_user ON completion_attempt_queue (user_id)
+    """)
+    # The stored state is each paper's latest attempt so far
+    cursor.execute("""
+    INSERT INTO completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, is_completed, score, recorded_at)
+    SELECT user_id, subject_id, year, session, paper, timezone_key, is_completed, score,
+           COALESCE(updated_at, CURRENT_TIMESTAMP)
+    FROM completion_status
+    """)
+    logger.info("Seeded the attempt log with %d completion records", cursor.rowcount)
+
+
+@migration(10, "rebuild completion bitsets to keep unscored papers")
+def _rebuild_bitsets_unscored(cursor, timezone_config):
+    # Bitsets built before UNSCORED existed drop papers stored as not completed and unscored
+    cursor.execute("UPDATE completion_bitsets_sync SET in_sync = FALSE")
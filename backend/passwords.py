@@ -0,0 +1,125 @@
+"""bcrypt hashing on a process pool so logins never block the event loop.
+
+Worker processes keep the CPU-bound hashing out of the app process entirely,
+so a registration rush cannot starve other requests of the interpreter. The
+hashing functions live at module level so the (spawned) workers only import
+this module, not the app.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+
+_contexts: Dict[int, "CryptContext"] = {}
+
+
+def _context(rounds: int) -> "CryptContext":
+    # Pinning min and max to the configured cost makes any other cost "needs update"
+    context = _contexts.get(rounds)
+    if context is None:
+        # Only the workers hash, so the app process never imports passlib
+        from passlib.context import CryptContext
+
+        context = _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+    return context
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def verify_password(password: str, password_hash: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """Return (matches, new_hash); new_hash is set when the stored cost is not ``rounds``."""
+    return _context(rounds).verify_and_update(password, password_hash)
+
+
+class PasswordHasher:
+    """Runs bcrypt hash/verify on a fixed pool of worker processes.
+
+    ``workers`` defaults to the number of cores. ``verify`` reports a
+    replacement hash whenever the stored hash was made with a cost other than
+    ``rounds``, so raising or lowering the cost migrates users as they log in.
+    """
+
+    def __init__(self, rounds: int = DEFAULT_ROUNDS, workers: Optional[int] = None):
+        if not 4 <= rounds <= 31:
+            raise ValueError(f"bcrypt rounds must be between 4 and 31, not {rounds}")
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        self.in_flight = 0
+        self.hashes = 0
+        self.verifies = 0
+        self.rehashes = 0
+
+    def start(self):
+        """Start the workers and load bcrypt in each so the first logins are not slowed."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_context, self.rounds)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def hash(self, password: str) -> str:
+        self.hashes += 1
+        return await self._submit(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        self.verifies += 1
+        matches, new_hash = await self._submit(verify_password, password, password_hash, self.rounds)
+        if new_hash is not None:
+            self.rehashes += 1
+        return matches, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "in_flight": self.in_flight,
+            "hashes": self.hashes,
+            "verifies": self.verifies,
+            "rehashes": self.rehashes,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the app process holds pool and executor threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        self.in_flight += 1
+        executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next caller
+            logger.exception("Password hashing pool broke; restarting it")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False)
+            raise
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,683 @@
+"""PostgreSQL implementation of :class:`storage.Storage`.
+
+Each ``_helper(cursor, ...)`` below runs inside a single pooled transaction on
+the database executor (see :class:`db.AsyncDatabase`); the async methods are
+thin wrappers around them. Per-user reads go to a read replica when a
+:class:`replicas.ReplicaSet` is configured.
+"""
+import csv
+import io
+import json
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import bitsets
+from db import AsyncDatabase, ConnectionPool, PoolTimeout
+from migrations import run_migrations
+from replicas import ReplicaSet
+from storage import (
+    CompletionImport, FeedbackClaim, RejectedWrite, Storage, UserExists, VersionCheck, check_scores, valid_score,
+)
+
+logger = logging.getLogger(__name__)
+
+_UPSERT_COMPLETION_SQL = """
+    INSERT INTO completion_status
+    (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+    VALUES %s
+    ON CONFLICT (user_id, subject_id, year, session, paper, timezone_key)
+    DO UPDATE SET is_completed = EXCLUDED.is_completed, score = EXCLUDED.score,
+                  updated_at = CURRENT_TIMESTAMP
+"""
+
+_LOG_ATTEMPTS_SQL = """
+    INSERT INTO completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, is_completed, score)
+    VALUES %s
+"""
+
+# Log the attempts of set-based writes (bulk syncs) that change a paper's
+# stored state; run before the upsert, so papers a full sync repeats unchanged
+# add no history
+_LOG_CHANGED_ATTEMPTS_SQL = """
+    INSERT INTO completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, is_completed, score)
+    SELECT v.user_id, v.subject_id, v.year, v.session, v.paper, v.timezone_key, v.is_completed, v.score
+    FROM (VALUES %s) AS v (user_id, subject_id, year, session, paper, timezone_key, is_completed, score)
+    LEFT JOIN completion_status c
+    ON c.user_id = v.user_id AND c.subject_id = v.subject_id AND c.year = v.year
+    AND c.session = v.session AND c.paper = v.paper AND c.timezone_key = v.timezone_key
+    WHERE c.user_id IS NULL OR c.is_completed IS DISTINCT FROM v.is_completed OR c.score IS DISTINCT FROM v.score
+"""
+_LOG_CHANGED_ATTEMPTS_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s::boolean, %s::integer)"
+
+# Log attempts and queue them for compaction in one statement
+_APPEND_ATTEMPTS_SQL = """
+    WITH attempt AS (
+        INSERT INTO completion_attempts
+        (user_id, subject_id, year, session, paper, timezone_key, is_completed, score)
+        VALUES %s
+        RETURNING user_id, subject_id, year, session, paper, timezone_key, is_completed, score
+    )
+    INSERT INTO completion_attempt_queue
+    (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+    SELECT user_id, subject_id, year, session, paper, NULLIF(timezone_key, ''), is_completed, score
+    FROM attempt
+"""
+
+# Arbitrary constant: pg_try_advisory_xact_lock(COMPACTION_LOCK_ID) lets one
+# worker at a time drain the queue, so batches are folded in queue order
+COMPACTION_LOCK_ID = 7300563140125475
+
+# Recompute the user_progress rows of the given (subject_id, year) groups from
+# completion_status; each group covers at most a few dozen rows
+_REFRESH_PROGRESS_SQL = """
+    INSERT INTO user_progress AS p
+    (user_id, subject_id, year, completed, scored, score_sum, best_score, latest_score, latest_at)
+    SELECT %(user_id)s, g.subject_id, g.year,
+           count(*) FILTER (WHERE c.is_completed),
+           count(c.score) FILTER (WHERE c.is_completed),
+           COALESCE(sum(c.score) FILTER (WHERE c.is_completed), 0),
+           max(c.score) FILTER (WHERE c.is_completed),
+           (array_agg(c.score ORDER BY c.updated_at DESC NULLS LAST, c.id DESC)
+               FILTER (WHERE c.is_completed AND c.score IS NOT NULL))[1],
+           max(c.updated_at) FILTER (WHERE c.is_completed AND c.score IS NOT NULL)
+    FROM unnest(%(subjects)s::text[], %(years)s::integer[]) AS g (subject_id, year)
+    LEFT JOIN completion_status c
+        ON c.user_id = %(user_id)s AND c.subject_id = g.subject_id AND c.year = g.year
+    GROUP BY g.subject_id, g.year
+    ON CONFLICT (user_id, subject_id, year) DO UPDATE SET
+        completed = EXCLUDED.completed, scored = EXCLUDED.scored, score_sum = EXCLUDED.score_sum,
+        best_score = EXCLUDED.best_score, latest_score = EXCLUDED.latest_score,
+        latest_at = EXCLUDED.latest_at
+"""
+
+
+class PostgresStorage(Storage):
+    """Storage on a shared :class:`db.ConnectionPool`.
+
+    With ``maintain_bitsets`` every completion write also updates the packed
+    ``completion_bitsets`` rows. Bulk upserts send ``upsert_page_size`` rows
+    per INSERT statement.
+
+    With ``replicas``, user, subject, completion and progress reads are spread
+    over the healthy replicas, except for users who wrote recently. A read
+    that fails on a replica ejects it and is retried on the primary.
+    """
+
+    name = "postgresql"
+
+    def __init__(
+        self, pool: ConnectionPool, maintain_bitsets: bool = False, upsert_page_size: int = 1000,
+        on_query=None, replicas: Optional[ReplicaSet] = None
+    ):
+        self.pool = pool
+        self.database = AsyncDatabase(pool, on_query=on_query)
+        self.maintain_bitsets = maintain_bitsets
+        self.upsert_page_size = upsert_page_size
+        self.replicas = replicas
+
+    # Lifecycle
+    def open(self):
+        self.pool.open()
+        if self.replicas is not None:
+            self.replicas.open(self.pool)
+
+    def close(self):
+        self.database.shutdown()
+        if self.replicas is not None:
+            self.replicas.close()
+        self.pool.close()
+
+    def migrate(self, timezone_config: Dict) -> List[int]:
+        return run_migrations(self.pool, timezone_config)
+
+    def sync_bitsets(self, maintained: bool) -> bool:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if maintained:
+                return bitsets.ensure_synced(cursor)
+            bitsets.mark_stale(cursor)
+            return False
+
+    def stats(self) -> dict:
+        stats = self.pool.stats()
+        if self.replicas is not None:
+            stats["read_replicas"] = self.replicas.stats()
+        return stats
+
+    def gauges(self) -> Dict[str, float]:
+        pool_stats = self.pool.stats()
+        gauges = {
+            "db_pool_size": pool_stats["size"],
+            "db_pool_in_use": pool_stats["in_use"],
+            "db_pool_waiting": pool_stats["waiting"],
+            "db_pool_timeouts": pool_stats["timeouts"],
+        }
+        if self.replicas is not None:
+            gauges.update(self.replicas.gauges())
+        return gauges
+
+    # Read routing
+    async def _read(self, key, fn, *args):
+        """Run a read-only ``fn(cursor, *args)`` on a replica when ``key`` may read from one."""
+        replica = self.replicas.choose(key) if self.replicas is not None else None
+        if replica is not None:
+            try:
+                return await replica.database.run(fn, *args)
+            except (psycopg2.OperationalError, PoolTimeout) as e:
+                self.replicas.eject(replica, e)
+        return await self.database.run(fn, *args)
+
+    def _wrote(self, *keys):
+        if self.replicas is not None:
+            self.replicas.wrote(*keys)
+
+    # Users
+    async def get_user(self, username: str):
+        user = await self._read(("username", username), _fetch_user, username)
+        if user is None and self.replicas is not None:
+            # Possibly registered on another worker and not replicated yet
+            user = await self.database.run(_fetch_user, username)
+        return user
+
+    async def create_user(self, username: str, email: str, password_hash: str) -> int:
+        user_id = await self.database.run(_create_user, username, email, password_hash)
+        self._wrote(("username", username), user_id)
+        return user_id
+
+    async def replace_password_hash(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        # Only replace the hash that was verified, in case the password changed meanwhile
+        return await self.database.execute(
+            "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+            (new_hash, user_id, old_hash)
+        ) > 0
+
+    # Subjects
+    async def save_subjects(self, user_id: int, subjects: List[str]):
+        await self.database.run(_save_subjects, user_id, subjects)
+        self._wrote(user_id)
+
+    async def get_subjects(self, user_id: int) -> Optional[List[str]]:
+        return await self._read(user_id, _fetch_subjects, user_id)
+
+    # Completion
+    async def update_completion(self, user_id, subject_id, year, session, paper, timezone, is_completed, score):
+        stored = await self.database.run(
+            self._update_completion, user_id, (subject_id, year, session, paper, timezone, is_completed, score)
+        )
+        self._wrote(user_id)
+        return stored
+
+    async def bulk_update_completion(self, user_id: int, rows: Sequence[Tuple]):
+        await self.database.run(self._bulk_update_completion, user_id, rows)
+        self._wrote(user_id)
+
+    async def write_completion_batch(self, entries: Sequence[Tuple]):
+        try:
+            await self.database.run(self._write_completion_batch, entries)
+        except (psycopg2.IntegrityError, psycopg2.DataError) as e:
+            raise RejectedWrite(str(e).strip()) from e
+        self._wrote(*{entry[0] for entry in entries})
+
+    async def append_attempts(self, entries: Sequence[Tuple]):
+        check_scores(entries)
+        await self.database.run(_append_attempts, entries, self.upsert_page_size)
+        self._wrote(*{entry[0] for entry in entries})
+
+    async def compact_attempts(self, user_id: Optional[int] = None, limit: int = 1000) -> int:
+        folded, users = await self.database.run(self._compact_attempts, user_id, limit)
+        self._wrote(*users)
+        return folded
+
+    async def fetch_attempts(self, user_id, subject_id, year, session, paper, timezone, before, limit):
+        return await self._read(
+            user_id, _fetch_attempts, user_id, subject_id, year, session, paper, timezone, before, limit
+        )
+
+    async def fetch_completion(self, user_id: int, since: Optional[datetime] = None, is_current: Optional[VersionCheck] = None):
+        return await self._read(user_id, _fetch_completion, user_id, since, is_current)
+
+    async def fetch_completion_bitsets(self, user_id: int, is_current: Optional[VersionCheck] = None):
+        return await self._read(user_id, _fetch_completion_bitsets, user_id, is_current)
+
+    async def export_completion(self, user_id: int, chunk_size: int):
+        # A server-side cursor keeps one chunk in memory however large the history
+        async with self.database.transaction() as tx:
+            async for rows in tx.stream(
+                """
+                SELECT subject_id, year, session, paper, timezone, is_completed, score, updated_at
+                FROM completion_status WHERE user_id = %s
+                ORDER BY subject_id, year, session, paper, timezone_key
+                """,
+                (user_id,),
+                chunk_size=chunk_size
+            ):
+                yield rows
+
+    @asynccontextmanager
+    async def import_completion(self, user_id: int):
+        async with self.database.transaction() as tx:
+            await tx.run(_create_import_staging)
+            yield _PostgresImport(self, tx, user_id)
+        self._wrote(user_id)
+
+    async def fetch_progress(self, user_id: int):
+        return await self._read(user_id, _fetch_progress, user_id)
+
+    # Feedback
+    async def save_feedback(self, message, email, user, timestamp):
+        # Store the feedback and queue it for the mailer in one statement
+        await self.database.execute(
+            """
+            WITH fb AS (
+                INSERT INTO user_feedback (message, email, user_identifier, timestamp)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id
+            )
+            INSERT INTO feedback_outbox (feedback_id) SELECT id FROM fb
+            """,
+            (message, email, user, timestamp)
+        )
+
+    @contextmanager
+    def claim_feedback(self, batch_size: int, max_attempts: int):
+        # Row locks keep other workers off the batch until this transaction ends
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT o.id, f.message, f.email, f.user_identifier, f.timestamp
+                FROM feedback_outbox o
+                JOIN user_feedback f ON f.id = o.feedback_id
+                WHERE o.sent_at IS NULL AND o.next_attempt_at <= CURRENT_TIMESTAMP
+                AND o.attempts < %s
+                ORDER BY o.id
+                LIMIT %s
+                FOR UPDATE OF o SKIP LOCKED
+                """,
+                (max_attempts, batch_size)
+            )
+            yield _PostgresFeedbackClaim(cursor, cursor.fetchall())
+
+    # Cursor-level write paths
+    def _update_completion(self, cursor, user_id: int, row: Tuple):
+        # Insert or update the paper in one atomic statement keyed on the unique
+        # index, logging the attempt in the same round trip
+        subject_id, year, session, paper, timezone, is_completed, score = row
+        cursor.execute(
+            """
+            WITH stored AS (
+                INSERT INTO completion_status
+                (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, subject_id, year, session, paper, timezone_key)
+                DO UPDATE SET is_completed = EXCLUDED.is_completed, score = EXCLUDED.score,
+                              updated_at = CURRENT_TIMESTAMP
+                RETURNING subject_id, year, session, paper, timezone, timezone_key, is_completed, score, updated_at
+            ), attempt AS (
+                INSERT INTO completion_attempts
+                (user_id, subject_id, year, session, paper, timezone_key, is_completed, score, recorded_at)
+                SELECT %s, subject_id, year, session, paper, timezone_key, is_completed, score, updated_at
+                FROM stored
+            )
+            SELECT subject_id, year, session, paper, timezone, is_completed, score, updated_at FROM stored
+            """,
+            (user_id, subject_id, year, session, paper, timezone or None, is_completed, score, user_id)
+        )
+        stored = cursor.fetchone()
+        _refresh_progress(cursor, user_id, [(subject_id, year)])
+        if self.maintain_bitsets:
+            slot = bitsets.paper_slot(year, session, paper, timezone)
+            if slot is not None:
+                bitsets.set_slot(cursor, user_id, subject_id, slot, is_completed, score)
+        return stored
+
+    def _bulk_update_completion(self, cursor, user_id: int, rows: Sequence[Tuple]):
+        # First, delete any May 2020 entries
+        cursor.execute("""
+            DELETE FROM completion_status
+            WHERE user_id = %s AND year = 2020 AND session = 'May'
+            RETURNING subject_id, year
+        """, (user_id,))
+        touched = set(cursor.fetchall())
+        entries = _in_key_order([(user_id, *row) for row in rows])
+        if entries:
+            execute_values(
+                cursor, _LOG_CHANGED_ATTEMPTS_SQL, _attempt_rows(entries),
+                template=_LOG_CHANGED_ATTEMPTS_TEMPLATE, page_size=self.upsert_page_size
+            )
+        self._upsert_completion_rows(cursor, entries)
+        touched.update((row[0], row[1]) for row in rows)
+        self._completion_rows_written(cursor, user_id, touched)
+
+    def _write_completion_batch(self, cursor, entries: Sequence[Tuple], log_attempts: bool = True):
+        touched = {}
+        for user_id, subject_id, year, *_ in entries:
+            touched.setdefault(user_id, set()).add((subject_id, year))
+        self._upsert_completion_rows(cursor, _in_key_order(entries))
+        if log_attempts:
+            execute_values(cursor, _LOG_ATTEMPTS_SQL, _attempt_rows(entries), page_size=self.upsert_page_size)
+        for user_id, groups in touched.items():
+            self._completion_rows_written(cursor, user_id, groups)
+
+    def _compact_attempts(self, cursor, user_id: Optional[int], limit: int):
+        if user_id is not None:
+            # Waits for rows a running compaction holds, so the caller's next read sees them folded
+            cursor.execute(
+                """
+                DELETE FROM completion_attempt_queue WHERE user_id = %s
+                RETURNING id, user_id, subject_id, year, session, paper, timezone, is_completed, score
+                """,
+                (user_id,)
+            )
+        else:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (COMPACTION_LOCK_ID,))
+            if not cursor.fetchone()[0]:
+                return 0, set()
+            cursor.execute(
+                """
+                DELETE FROM completion_attempt_queue WHERE id IN (
+                    SELECT id FROM completion_attempt_queue ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, user_id, subject_id, year, session, paper, timezone, is_completed, score
+                """,
+                (limit,)
+            )
+        queued = sorted(cursor.fetchall())
+        entries = _latest_attempts(_valid_attempts(queued))
+        self._write_completion_batch(cursor, entries, log_attempts=False)
+        return len(queued), {entry[0] for entry in entries}
+
+    def _upsert_completion_rows(self, cursor, rows):
+        """Upsert (user_id, subject_id, year, session, paper, timezone, is_completed, score) rows"""
+        if not rows:
+            return
+        execute_values(cursor, _UPSERT_COMPLETION_SQL, rows, page_size=self.upsert_page_size)
+
+    def _completion_rows_written(self, cursor, user_id: int, touched):
+        """Update the derived progress summary and bitsets for the touched (subject_id, year) groups"""
+        _refresh_progress(cursor, user_id, touched)
+        if self.maintain_bitsets and touched:
+            bitsets.rebuild(cursor, user_id, {subject_id for subject_id, _ in touched})
+
+
+class _PostgresImport(CompletionImport):
+    """Stages rows with COPY into a temporary table on the held connection."""
+
+    def __init__(self, storage: PostgresStorage, tx, user_id: int):
+        self.storage = storage
+        self.tx = tx
+        self.user_id = user_id
+
+    async def stage(self, rows):
+        if not rows:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        await self.tx.run(_copy_import_batch, buffer)
+
+    async def merge(self) -> int:
+        return await self.tx.run(self._merge)
+
+    def _merge(self, cursor) -> int:
+        """Upsert the staged rows into completion_status; the last line per paper wins"""
+        # Log the papers whose state the import changes, as bulk syncs do
+        cursor.execute(
+            """
+            INSERT INTO completion_attempts
+            (user_id, subject_id, year, session, paper, timezone_key, is_completed, score)
+            SELECT %s, i.subject_id, i.year, i.session, i.paper, i.timezone_key, i.is_completed, i.score
+            FROM (
+                SELECT DISTINCT ON (subject_id, year, session, paper, COALESCE(timezone, ''))
+                       subject_id, year, session, paper, COALESCE(timezone, '') AS timezone_key, is_completed, score
+                FROM completion_import
+                ORDER BY subject_id, year, session, paper, COALESCE(timezone, ''), seq DESC
+            ) i
+            LEFT JOIN completion_status c
+            ON c.user_id = %s AND c.subject_id = i.subject_id AND c.year = i.year
+            AND c.session = i.session AND c.paper = i.paper AND c.timezone_key = i.timezone_key
+            WHERE c.user_id IS NULL OR c.is_completed IS DISTINCT FROM i.is_completed OR c.score IS DISTINCT FROM i.score
+            """,
+            (self.user_id, self.user_id)
+        )
+        cursor.execute(
+            """
+            INSERT INTO completion_status
+            (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+            SELECT DISTINCT ON (subject_id, year, session, paper, COALESCE(timezone, ''))
+                   %s, subject_id, year, session, paper, timezone, is_completed, score
+            FROM completion_import
+            ORDER BY subject_id, year, session, paper, COALESCE(timezone, ''), seq DESC
+            ON CONFLICT (user_id, subject_id, year, session, paper, timezone_key)
+            DO UPDATE SET is_completed = EXCLUDED.is_completed, score = EXCLUDED.score,
+                          updated_at = CURRENT_TIMESTAMP
+            """,
+            (self.user_id,)
+        )
+        merged = cursor.rowcount
+        cursor.execute("SELECT DISTINCT subject_id, year FROM completion_import")
+        self.storage._completion_rows_written(cursor, self.user_id, cursor.fetchall())
+        return merged
+
+
+class _PostgresFeedbackClaim(FeedbackClaim):
+    def __init__(self, cursor, rows):
+        self.cursor = cursor
+        self.rows = rows
+
+    def sent(self):
+        self.cursor.execute(
+            "UPDATE feedback_outbox SET sent_at = CURRENT_TIMESTAMP, attempts = attempts + 1 WHERE id = ANY(%s)",
+            ([row[0] for row in self.rows],)
+        )
+
+    def failed(self, error: str, backoff_base: float, backoff_max: float):
+        self.cursor.execute(
+            """
+            UPDATE feedback_outbox
+            SET attempts = attempts + 1, last_error = %s,
+                next_attempt_at = CURRENT_TIMESTAMP
+                    + LEAST(%s * power(2, attempts), %s) * INTERVAL '1 second'
+            WHERE id = ANY(%s)
+            """,
+            (error[:500], backoff_base, backoff_max, [row[0] for row in self.rows])
+        )
+
+
+def _fetch_user(cursor, username: str):
+    cursor.execute("SELECT id, username, email, password_hash FROM users WHERE username = %s", (username,))
+    return cursor.fetchone()
+
+
+def _create_user(cursor, username: str, email: str, password_hash: str):
+    # Check if username already exists
+    cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+    if cursor.fetchone():
+        raise UserExists("username")
+
+    # Check if email already exists
+    cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+    if cursor.fetchone():
+        raise UserExists("email")
+
+    # Create new user
+    cursor.execute(
+        "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s) RETURNING id",
+        (username, email, password_hash)
+    )
+    return cursor.fetchone()[0]
+
+
+def _save_subjects(cursor, user_id: int, subjects: List[str]):
+    # Check if user already has subjects saved
+    cursor.execute("SELECT id FROM user_subjects WHERE user_id = %s", (user_id,))
+    existing = cursor.fetchone()
+
+    if existing:
+        # Update existing subjects
+        cursor.execute(
+            "UPDATE user_subjects SET subjects = %s WHERE user_id = %s",
+            (json.dumps(subjects), user_id)
+        )
+    else:
+        # Create new subjects entry
+        cursor.execute(
+            "INSERT INTO user_subjects (user_id, subjects) VALUES (%s, %s)",
+            (user_id, json.dumps(subjects))
+        )
+
+
+def _fetch_subjects(cursor, user_id: int) -> Optional[List[str]]:
+    cursor.execute("SELECT subjects FROM user_subjects WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _refresh_progress(cursor, user_id: int, groups):
+    """Bring the stored /stats summary up to date for the touched (subject_id, year) groups"""
+    groups = sorted(set(groups))
+    if not groups:
+        return
+    cursor.execute(_REFRESH_PROGRESS_SQL, {
+        "user_id": user_id,
+        "subjects": [subject_id for subject_id, _ in groups],
+        "years": [year for _, year in groups],
+    })
+
+
+def _attempt_rows(entries: Sequence[Tuple]) -> List[Tuple]:
+    """Batch entries as completion_attempts rows (no timezone variant is '')"""
+    return [
+        (user_id, subject_id, year, session, paper, timezone or '', is_completed, score)
+        for user_id, subject_id, year, session, paper, timezone, is_completed, score in entries
+    ]
+
+
+def _append_attempts(cursor, entries: Sequence[Tuple], page_size: int):
+    execute_values(cursor, _APPEND_ATTEMPTS_SQL, _attempt_rows(entries), page_size=page_size)
+
+
+def _in_key_order(entries: Sequence[Tuple]) -> List[Tuple]:
+    """Batch entries sorted by completion_status's unique key.
+
+    Upserts lock rows in the order given, so writers overlapping on a user's
+    papers must all use this order to not deadlock.
+    """
+    return sorted(entries, key=lambda entry: (*entry[:5], entry[5] or ''))
+
+
+def _valid_attempts(queued: Sequence[Tuple]) -> List[Tuple]:
+    """Queued ``(id, *entry)`` rows whose score completion_status accepts; the others are logged and dropped"""
+    valid = [row for row in queued if valid_score(row[8])]
+    if len(valid) < len(queued):
+        skipped = [row for row in queued if not valid_score(row[8])]
+        logger.warning("Skipping %d queued attempts with invalid scores (ids %s)", len(skipped), [row[0] for row in skipped])
+    return valid
+
+
+def _latest_attempts(queued: Sequence[Tuple]) -> List[Tuple]:
+    """Batch entries of the last queued attempt per paper, from ``(id, *entry)`` rows in id order"""
+    latest = {}
+    for _, user_id, subject_id, year, session, paper, timezone, is_completed, score in queued:
+        latest[(user_id, subject_id, year, session, paper, timezone or '')] = (
+            user_id, subject_id, year, session, paper, timezone, is_completed, score
+        )
+    return list(latest.values())
+
+
+def _fetch_attempts(cursor, user_id, subject_id, year, session, paper, timezone, before, limit):
+    # Served from the history index, newest first
+    query = """
+        SELECT recorded_at, is_completed, score FROM completion_attempts
+        WHERE user_id = %s AND subject_id = %s AND year = %s AND session = %s AND paper = %s
+        AND timezone_key = %s
+    """
+    params = [user_id, subject_id, year, session, paper, timezone or '']
+    if before is not None:
+        query += " AND recorded_at < %s"
+        params.append(before)
+    query += " ORDER BY recorded_at DESC LIMIT %s"
+    params.append(limit)
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def _completion_version(cursor, user_id: int):
+    # Answered from the (user_id, updated_at) index, so an unchanged state never reads the rows
+    cursor.execute(
+        "SELECT count(*), max(updated_at) FROM completion_status WHERE user_id = %s",
+        (user_id,)
+    )
+    return cursor.fetchone()
+
+
+def _fetch_completion(cursor, user_id: int, since: Optional[datetime], is_current: Optional[VersionCheck]):
+    count, last_updated = _completion_version(cursor, user_id)
+    if is_current is not None and is_current(count, last_updated):
+        return count, last_updated, None
+
+    query = """
+        SELECT subject_id, year, session, paper, timezone, is_completed, score
+        FROM completion_status
+        WHERE user_id = %s
+    """
+    params = [user_id]
+    if since is not None:
+        query += " AND updated_at > %s"
+        params.append(since)
+    cursor.execute(query, params)
+    return count, last_updated, cursor.fetchall()
+
+
+def _fetch_completion_bitsets(cursor, user_id: int, is_current: Optional[VersionCheck]):
+    count, last_updated = _completion_version(cursor, user_id)
+    if is_current is not None and is_current(count, last_updated):
+        return count, last_updated, None
+    return count, last_updated, bitsets.fetch(cursor, user_id)
+
+
+def _create_import_staging(cursor):
+    # Session-private and dropped with the transaction; seq keeps upload order
+    cursor.execute("""
+    CREATE TEMP TABLE completion_import (
+        seq BIGSERIAL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER
+    ) ON COMMIT DROP
+    """)
+
+
+def _copy_import_batch(cursor, buffer: io.StringIO):
+    buffer.seek(0)
+    cursor.copy_expert(
+        """
+        COPY completion_import (subject_id, year, session, paper, timezone, is_completed, score)
+        FROM STDIN WITH (FORMAT csv)
+        """,
+        buffer
+    )
+
+
+def _fetch_progress(cursor, user_id: int):
+    cursor.execute("SELECT subjects FROM user_subjects WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    subjects = json.loads(row[0]) if row else []
+    cursor.execute(
+        """
+        SELECT subject_id, year, completed, scored, score_sum, best_score, latest_score, latest_at
+        FROM user_progress WHERE user_id = %s
+        """,
+        (user_id,)
+    )
+    return subjects, cursor.fetchall()
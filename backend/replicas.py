@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+import psycopg2.extensions
+
+from db import AsyncDatabase, ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+def describe_dsn(dsn: str) -> str:
+    """host:port/dbname of a connection string, without credentials."""
+    try:
+        params = psycopg2.extensions.parse_dsn(dsn)
+    except psycopg2.ProgrammingError:
+        return "<invalid dsn>"
+    return f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+
+
+def _describe(error: Exception) -> str:
+    # psycopg2 messages span several indented lines
+    return " ".join(str(error).split()) or type(error).__name__
+
+
+class Replica:
+    """One read replica: its pool, query surface and last health check."""
+
+    def __init__(self, pool: ConnectionPool, database: AsyncDatabase):
+        self.pool = pool
+        self.database = database
+        self.name = describe_dsn(pool.dsn)
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = "not checked yet"
+        self.checked_at = 0.0
+        self.reads = 0
+        self.ejections = 0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": None if self.lag is None else round(self.lag, 3),
+            "error": self.error,
+            "reads": self.reads,
+            "ejections": self.ejections,
+            "pool": self.pool.stats(),
+        }
+
+
+class ReplicaSet:
+    """Round-robin routing of read-only queries over streaming replicas.
+
+    A background task checks every replica each ``check_interval`` seconds
+    and ejects it while it is unreachable, not in recovery, or more than
+    ``max_lag`` seconds behind the primary; it rejoins on the first good
+    check. Lag is zero while the replica has replayed the primary's current
+    WAL position, and otherwise the time since it last replayed a
+    transaction.
+
+    A user who wrote within the last ``read_your_writes`` seconds is routed
+    to the primary (``choose`` returns None) so they always see their own
+    changes. The window is per process, like the write-behind buffer.
+    """
+
+    def __init__(
+        self,
+        pools: List[ConnectionPool],
+        max_lag: float = 2.0,
+        check_interval: float = 2.0,
+        read_your_writes: float = 5.0,
+        on_query: Optional[Callable[[float, int], None]] = None,
+    ):
+        self.replicas = [Replica(pool, AsyncDatabase(pool, on_query=on_query)) for pool in pools]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+
+        self._lock = threading.Lock()
+        self._writes: Dict[Hashable, float] = {}
+        self._turn = itertools.count()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replicas")
+        self._task: Optional[asyncio.Task] = None
+
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.fallbacks = 0
+
+    # Lifecycle
+    def open(self, primary: ConnectionPool):
+        """Open the replica pools and run a first check against ``primary``."""
+        for replica in self.replicas:
+            try:
+                replica.pool.open()
+            except Exception as e:
+                logger.error("Read replica %s is unavailable: %s", replica.name, e)
+        self.check(primary)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for replica in self.replicas:
+            replica.database.shutdown()
+            replica.pool.close()
+
+    def start(self, primary: ConnectionPool):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(primary))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, primary: ConnectionPool):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await loop.run_in_executor(self._executor, self.check, primary)
+            except Exception:
+                logger.exception("Error checking read replicas")
+
+    # Routing
+    def wrote(self, *keys: Hashable):
+        """Pin the given users (ids or usernames) to the primary for the read-your-writes window."""
+        until = time.monotonic() + self.read_your_writes
+        with self._lock:
+            for key in keys:
+                self._writes[key] = until
+
+    def choose(self, key: Optional[Hashable] = None) -> Optional[Replica]:
+        """The next healthy replica for a read by ``key``, or None to use the primary."""
+        now = time.monotonic()
+        with self._lock:
+            if key is not None and key in self._writes:
+                if self._writes[key] > now:
+                    self.pinned_reads += 1
+                    return None
+                del self._writes[key]
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            if not healthy:
+                self.primary_reads += 1
+                return None
+            replica = healthy[next(self._turn) % len(healthy)]
+            replica.reads += 1
+            return replica
+
+    def eject(self, replica: Replica, error: Exception):
+        """Take a replica out of rotation after a failed read; the next good check restores it."""
+        with self._lock:
+            self.fallbacks += 1
+            if replica.healthy:
+                replica.healthy = False
+                replica.ejections += 1
+                replica.error = _describe(error)
+                logger.warning("Ejected read replica %s: %s", replica.name, replica.error)
+
+    # Health checks
+    def check(self, primary: ConnectionPool):
+        """Measure every replica's lag against the primary's current WAL position."""
+        now = time.monotonic()
+        with self._lock:
+            # Forget users whose window ended without a later read
+            self._writes = {key: until for key, until in self._writes.items() if until > now}
+        with primary.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_current_wal_lsn()")
+            primary_lsn = cursor.fetchone()[0]
+        for replica in self.replicas:
+            try:
+                with replica.pool.connection(timeout=self.check_interval) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        """
+                        SELECT pg_is_in_recovery(),
+                               pg_wal_lsn_diff(%s::pg_lsn, pg_last_wal_replay_lsn()) <= 0,
+                               EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                        """,
+                        (primary_lsn,)
+                    )
+                    in_recovery, caught_up, since_replay = cursor.fetchone()
+                if not in_recovery:
+                    lag, error = None, "not a standby"
+                else:
+                    lag = 0.0 if caught_up else float(since_replay or 0.0)
+                    error = f"lagging {lag:.1f}s" if lag > self.max_lag else None
+            except Exception as e:
+                lag, error = None, _describe(e)
+            self._record(replica, lag, error)
+
+    def _record(self, replica: Replica, lag: Optional[float], error: Optional[str]):
+        with self._lock:
+            replica.lag = lag
+            replica.checked_at = time.monotonic()
+            if error is None:
+                if not replica.healthy:
+                    logger.info("Read replica %s is in rotation", replica.name)
+                replica.healthy = True
+                replica.error = None
+            else:
+                if replica.healthy:
+                    replica.ejections += 1
+                    logger.warning("Ejected read replica %s: %s", replica.name, error)
+                replica.healthy = False
+                replica.error = error
+
+    # Reporting
+    def stats(self) -> dict:
+        return {
+            "max_lag_seconds": self.max_lag,
+            "read_your_writes_seconds": self.read_your_writes,
+            "healthy": sum(replica.healthy for replica in self.replicas),
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+            "fallbacks": self.fallbacks,
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+    def gauges(self) -> Dict[str, float]:
+        return {
+            "db_replicas_healthy": sum(replica.healthy for replica in self.replicas),
+            "db_replica_reads": sum(replica.reads for replica in self.replicas),
+            "db_replica_primary_reads": self.primary_reads,
+            "db_replica_pinned_reads": self.pinned_reads,
+            "db_replica_fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the json module is the fallback
+    orjson = None
+
+# Per-request compression settings: fast levels, since bodies are compressed
+# while the client waits (static payloads use the slowest, smallest ones)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+
+
+def loads(body: bytes) -> Any:
+    """Parse JSON; raises ValueError on malformed input."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with :func:`dumps`."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against a strong ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Content codings the client accepts (q=0 entries are excluded)."""
+    accepted = set()
+    for item in (accept_encoding or "").split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+class StaticPayload:
+    """A JSON document serialized and compressed once, served many times.
+
+    The identity, gzip and (when the ``brotli`` package is installed) brotli
+    encodings are prepared up front, and the ETag is a hash of the body, so a
+    request costs a header check and a buffer write.
+    """
+
+    def __init__(self, content: Any, max_age: int = 86400):
+        self.body = json.dumps(content, separators=(',', ':')).encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=9)
+        self.brotli_body = brotli.compress(self.body) if brotli is not None else None
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+        self.max_age = max_age
+
+    def response(self, request: Request) -> Response:
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+
+        encodings = accepted_encodings(request.headers.get("accept-encoding"))
+        body = self.body
+        if self.brotli_body is not None and "br" in encodings:
+            body = self.brotli_body
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in encodings or "*" in encodings:
+            body = self.gzip_body
+            headers["Content-Encoding"] = "gzip"
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+def encode_body(body: bytes, accept_encoding: Optional[str], min_size: int) -> Tuple[bytes, Optional[str]]:
+    """Compress a body of at least ``min_size`` bytes with the best coding the client accepts.
+
+    Returns the body to send and its Content-Encoding (None when sent as is).
+    """
+    if len(body) < min_size:
+        return body, None
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in encodings:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in encodings or "*" in encodings:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+
+def decode_body(body: bytes, encoding: Optional[str]) -> bytes:
+    """Undo :func:`encode_body`."""
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+def encoded_response(body: bytes, encoding: Optional[str], headers: Dict[str, str]) -> Response:
+    """A JSON response of a body from :func:`encode_body`."""
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,1170 @@
+"""Embedded SQLite implementation of :class:`storage.Storage`.
+
+Meant for single-node deployments and running without a PostgreSQL server:
+``DATABASE_URL=sqlite:///ib_tracker.db`` (relative) or
+``sqlite:////var/lib/paperpath.db`` (absolute).
+
+The database runs in WAL mode, so readers never block the writer or each
+other. Every write goes through one connection on one thread; reads borrow
+one of a small pool of read-only connections, each holding a snapshot for the
+duration of a call. sqlite3 keeps a per-connection cache of prepared
+statements, so the SQL below is constant strings with ``?`` parameters that
+are compiled once per connection.
+"""
+import asyncio
+import functools
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import bitsets
+from storage import (
+    CompletionImport, FeedbackClaim, RejectedWrite, Storage, UserExists, VersionCheck, check_scores, valid_score,
+)
+
+logger = logging.getLogger(__name__)
+
+# Millisecond timestamps in the same text form as the datetime adapter below,
+# so stored values compare correctly as strings
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Seconds a claimed feedback batch stays hidden from other claimers
+FEEDBACK_LEASE_SECONDS = 300
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: value not in (b"0", b""))
+
+
+def sqlite_path(url: str) -> str:
+    """File path of a ``sqlite:///relative`` or ``sqlite:////absolute`` URL."""
+    if not url.startswith("sqlite:///"):
+        raise ValueError(f"Not a sqlite:/// URL: {url!r}")
+    path = url[len("sqlite:///"):]
+    if not path or path == ":memory:":
+        raise ValueError("SQLite storage needs a database file; in-memory databases are not shared between connections")
+    return path
+
+
+def _timestamp(value) -> Optional[datetime]:
+    # Aggregates such as max(updated_at) lose the column type and come back as text
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class _CountingCursor(sqlite3.Cursor):
+    """Counts fetched rows; SQLite reports no rowcount for SELECT."""
+
+    fetched = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.fetched += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.fetched += len(rows)
+        return rows
+
+
+class SQLiteDatabase:
+    """One writer connection plus a pool of read-only connections over a WAL database.
+
+    ``write(fn, ...)`` runs ``fn(cursor, ...)`` in a ``BEGIN IMMEDIATE``
+    transaction on the writer thread; ``read(fn, ...)`` runs it in a deferred
+    transaction (one consistent snapshot) on a pooled reader. Both commit when
+    ``fn`` returns and roll back if it raises. ``busy_timeout`` bounds how
+    long the writer waits for other processes sharing the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        busy_timeout: float = 5.0,
+        on_query: Optional[Callable[[float, int], None]] = None,
+    ):
+        if readers < 1:
+            raise ValueError(f"Need at least one reader connection, not {readers}")
+        self.path = path
+        self.readers = readers
+        self.busy_timeout = busy_timeout
+        # Called on the event loop after each read/write with (seconds, rows fetched)
+        self.on_query = on_query
+
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="sqlite-reader")
+
+        self._reads = 0
+        self._writes = 0
+        self._writes_waiting = 0
+        self._write_wait_total = 0.0
+        self._write_wait_max = 0.0
+
+    def connect(self, readonly: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,  # transactions are begun explicitly
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints; safe with WAL
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def open(self):
+        if self._writer is not None:
+            return
+        writer = self.connect()
+        mode = writer.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning("SQLite database %s is in %s mode, not WAL", self.path, mode)
+        self._writer = writer
+        for _ in range(self.readers):
+            self._readers.put(self.connect(readonly=True))
+
+    def close(self):
+        self._write_executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextmanager
+    def writing(self):
+        """Hold the writer for a ``with`` block; blocking, for use off the event loop."""
+        started = time.monotonic()
+        with self._stats_lock:
+            self._writes_waiting += 1
+        try:
+            self._write_lock.acquire()
+        finally:
+            with self._stats_lock:
+                self._writes_waiting -= 1
+        try:
+            if self._writer is None:
+                raise RuntimeError("SQLite database is not open")
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self._writes += 1
+                self._write_wait_total += waited
+                self._write_wait_max = max(self._write_wait_max, waited)
+            cursor = self._writer.cursor(_CountingCursor)
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+                cursor.execute("COMMIT")
+            except BaseException:
+                if self._writer.in_transaction:
+                    self._writer.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def reading(self):
+        """Borrow a reader holding one snapshot for a ``with`` block (blocking)."""
+        conn = self._readers.get()
+        try:
+            with self._stats_lock:
+                self._reads += 1
+            cursor = conn.cursor(_CountingCursor)
+            cursor.execute("BEGIN")
+            try:
+                yield cursor
+            finally:
+                cursor.execute("COMMIT")
+                cursor.close()
+        finally:
+            self._readers.put(conn)
+
+    async def write(self, fn: Callable, *args):
+        return await self._run(self._write_executor, self.writing, fn, *args)
+
+    async def read(self, fn: Callable, *args):
+        return await self._run(self._read_executor, self.reading, fn, *args)
+
+    async def call(self, fn: Callable, *args):
+        """Run a blocking call on a reader thread without borrowing a connection."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, functools.partial(fn, *args))
+
+    async def stream(self, query: str, params: Sequence, chunk_size: int):
+        """Yield the rows of ``query`` in chunks from one snapshot on a dedicated connection."""
+        conn = await self.call(self.connect, True)
+        cursor = conn.cursor(_CountingCursor)
+        elapsed = 0.0
+        try:
+            start = time.perf_counter()
+            await self.call(cursor.execute, "BEGIN")
+            await self.call(cursor.execute, query, params)
+            elapsed += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                rows = await self.call(cursor.fetchmany, chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await self.call(conn.close)
+            self.report(elapsed, cursor.fetched)
+
+    def report(self, elapsed: float, rows: int):
+        if self.on_query is not None:
+            self.on_query(elapsed, rows)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "journal_mode": "wal",
+            "readers": self.readers,
+            "readers_idle": self._readers.qsize(),
+            "reads": self._reads,
+            "writes": self._writes,
+            "writes_waiting": self._writes_waiting,
+            "write_wait_avg_ms": round(self._write_wait_total * 1000 / self._writes, 3) if self._writes else 0.0,
+            "write_wait_max_ms": round(self._write_wait_max * 1000, 3),
+        }
+
+    async def _run(self, executor, borrow, fn, *args):
+        loop = asyncio.get_running_loop()
+        result, elapsed, rows = await loop.run_in_executor(
+            executor, functools.partial(self._run_sync, borrow, fn, *args)
+        )
+        self.report(elapsed, rows)
+        return result
+
+    def _run_sync(self, borrow, fn, *args):
+        start = time.perf_counter()
+        with borrow() as cursor:
+            result = fn(cursor, *args)
+            rows = cursor.fetched
+        return result, time.perf_counter() - start, rows
+
+
+class SchemaStep(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+
+
+SCHEMA_STEPS: List[SchemaStep] = []
+
+
+def _schema_step(version: int, description: str):
+    """Register ``fn(cursor, timezone_config)`` as SQLite schema ``version`` (PRAGMA user_version)."""
+    def register(fn):
+        SCHEMA_STEPS.append(SchemaStep(version, description, fn))
+        SCHEMA_STEPS.sort(key=lambda s: s.version)
+        return fn
+    return register
+
+
+class SQLiteStorage(Storage):
+    """Storage in a local SQLite file; see the module docstring.
+
+    With ``maintain_bitsets`` every completion write also updates the packed
+    ``completion_bitsets`` rows.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, readers: int = 4, busy_timeout: float = 5.0,
+                 maintain_bitsets: bool = False, on_query=None):
+        self.db = SQLiteDatabase(path, readers=readers, busy_timeout=busy_timeout, on_query=on_query)
+        self.maintain_bitsets = maintain_bitsets
+
+    # Lifecycle
+    def open(self):
+        self.db.open()
+
+    def close(self):
+        self.db.close()
+
+    def migrate(self, timezone_config: Dict) -> List[int]:
+        applied = []
+        for step in SCHEMA_STEPS:
+            # One transaction per step; re-checked under the write lock so
+            # processes sharing the file never apply a step twice
+            with self.db.writing() as cursor:
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] >= step.version:
+                    continue
+                logger.info("Applying SQLite schema step %s: %s", step.version, step.description)
+                step.apply(cursor, timezone_config)
+                cursor.execute(f"PRAGMA user_version = {int(step.version)}")
+            applied.append(step.version)
+        return applied
+
+    def sync_bitsets(self, maintained: bool) -> bool:
+        with self.db.writing() as cursor:
+            if not maintained:
+                cursor.execute("UPDATE completion_bitsets_sync SET in_sync = 0 WHERE in_sync")
+                return False
+            cursor.execute("SELECT in_sync FROM completion_bitsets_sync")
+            if cursor.fetchone()[0]:
+                return False
+            _rebuild_bitsets(cursor)
+            cursor.execute("UPDATE completion_bitsets_sync SET in_sync = 1")
+            return True
+
+    def stats(self) -> dict:
+        return self.db.stats()
+
+    def gauges(self) -> Dict[str, float]:
+        db_stats = self.db.stats()
+        return {
+            "sqlite_readers": db_stats["readers"],
+            "sqlite_readers_in_use": db_stats["readers"] - db_stats["readers_idle"],
+            "sqlite_writes_waiting": db_stats["writes_waiting"],
+        }
+
+    # Users
+    async def get_user(self, username: str):
+        return await self.db.read(_fetchone, "SELECT id, username, email, password_hash FROM users WHERE username = ?", (username,))
+
+    async def create_user(self, username: str, email: str, password_hash: str) -> int:
+        return await self.db.write(_create_user, username, email, password_hash)
+
+    async def replace_password_hash(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        return await self.db.write(_replace_password_hash, user_id, old_hash, new_hash)
+
+    # Subjects
+    async def save_subjects(self, user_id: int, subjects: List[str]):
+        await self.db.write(_save_subjects, user_id, json.dumps(subjects))
+
+    async def get_subjects(self, user_id: int) -> Optional[List[str]]:
+        row = await self.db.read(_fetchone, "SELECT subjects FROM user_subjects WHERE user_id = ?", (user_id,))
+        return json.loads(row[0]) if row else None
+
+    # Completion
+    async def update_completion(self, user_id, subject_id, year, session, paper, timezone, is_completed, score):
+        return await self.db.write(
+            self._update_completion, user_id, (subject_id, year, session, paper, timezone, is_completed, score)
+        )
+
+    async def bulk_update_completion(self, user_id: int, rows: Sequence[Tuple]):
+        await self.db.write(self._bulk_update_completion, user_id, rows)
+
+    async def write_completion_batch(self, entries: Sequence[Tuple]):
+        try:
+            await self.db.write(self._write_completion_batch, entries)
+        except sqlite3.IntegrityError as e:
+            raise RejectedWrite(str(e)) from e
+
+    async def append_attempts(self, entries: Sequence[Tuple]):
+        check_scores(entries)
+        await self.db.write(_append_attempts, entries)
+
+    async def compact_attempts(self, user_id: Optional[int] = None, limit: int = 1000) -> int:
+        # The single writer serializes compactions, so no claim is needed
+        return await self.db.write(self._compact_attempts, user_id, limit)
+
+    async def fetch_attempts(self, user_id, subject_id, year, session, paper, timezone, before, limit):
+        rows = await self.db.read(_fetch_attempts, user_id, subject_id, year, session, paper, timezone, before, limit)
+        return [(_timestamp(recorded_at), bool(is_completed), score) for recorded_at, is_completed, score in rows]
+
+    async def fetch_completion(self, user_id: int, since: Optional[datetime] = None, is_current: Optional[VersionCheck] = None):
+        return await self.db.read(_fetch_completion, user_id, since, is_current)
+
+    async def fetch_completion_bitsets(self, user_id: int, is_current: Optional[VersionCheck] = None):
+        return await self.db.read(_fetch_completion_bitsets, user_id, is_current)
+
+    async def export_completion(self, user_id: int, chunk_size: int):
+        async for rows in self.db.stream(
+            """
+            SELECT subject_id, year, session, paper, timezone, is_completed, score, updated_at
+            FROM completion_status WHERE user_id = ?
+            ORDER BY subject_id, year, session, paper, timezone_key
+            """,
+            (user_id,),
+            chunk_size
+        ):
+            yield rows
+
+    @asynccontextmanager
+    async def import_completion(self, user_id: int):
+        # Staged in a temporary table on a private connection: temp writes take
+        # no lock on the main database, so the writer is only held for the merge
+        conn = await self.db.call(self.db.connect)
+        try:
+            await self.db.call(_create_import_staging, conn)
+            yield _SQLiteImport(self, conn, user_id)
+        finally:
+            await self.db.call(conn.close)
+
+    async def fetch_progress(self, user_id: int):
+        return await self.db.read(_fetch_progress, user_id)
+
+    # Feedback
+    async def save_feedback(self, message, email, user, timestamp):
+        await self.db.write(_save_feedback, message, email, user, timestamp)
+
+    @contextmanager
+    def claim_feedback(self, batch_size: int, max_attempts: int):
+        # Claimed rows are leased instead of locked, so the writer is free while mail is sent
+        with self.db.writing() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE feedback_outbox
+                SET next_attempt_at = strftime('%Y-%m-%d %H:%M:%f', 'now', '+{FEEDBACK_LEASE_SECONDS} seconds')
+                WHERE id IN (
+                    SELECT id FROM feedback_outbox
+                    WHERE sent_at IS NULL AND next_attempt_at <= {NOW} AND attempts < ?
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id
+                """,
+                (max_attempts, batch_size)
+            )
+            ids = sorted(row[0] for row in cursor.fetchall())
+            cursor.execute(
+                """
+                SELECT o.id, f.message, f.email, f.user_identifier, f.timestamp
+                FROM feedback_outbox o
+                JOIN user_feedback f ON f.id = o.feedback_id
+                WHERE o.id IN (SELECT value FROM json_each(?))
+                ORDER BY o.id
+                """,
+                (json.dumps(ids),)
+            )
+            rows = cursor.fetchall()
+        claim = _SQLiteFeedbackClaim(self.db, rows)
+        try:
+            yield claim
+        finally:
+            if rows and not claim.done:
+                # Give the lease back so the batch is retried on the next round
+                with self.db.writing() as cursor:
+                    cursor.execute(
+                        f"UPDATE feedback_outbox SET next_attempt_at = {NOW} WHERE id IN (SELECT value FROM json_each(?))",
+                        (json.dumps([row[0] for row in rows]),)
+                    )
+
+    # Cursor-level write paths
+    def _update_completion(self, cursor, user_id: int, row: Tuple):
+        subject_id, year, session, paper, timezone, is_completed, score = row
+        cursor.execute(
+            f"""
+            INSERT INTO completion_status
+            (user_id, subject_id, year, session, paper, timezone, is_completed, score, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, {NOW})
+            ON CONFLICT (user_id, subject_id, year, session, paper, timezone_key)
+            DO UPDATE SET is_completed = excluded.is_completed, score = excluded.score,
+                          updated_at = excluded.updated_at
+            RETURNING subject_id, year, session, paper, timezone, is_completed, score, updated_at
+            """,
+            (user_id, subject_id, year, session, paper, timezone or None, is_completed, score)
+        )
+        stored = cursor.fetchone()
+        _log_attempts(cursor, [(user_id, *row)], stored[7])
+        _refresh_progress(cursor, user_id, [(subject_id, year)])
+        if self.maintain_bitsets:
+            slot = bitsets.paper_slot(year, session, paper, timezone)
+            if slot is not None:
+                _set_bitset_slot(cursor, user_id, subject_id, slot, is_completed, score)
+        return (*stored[:5], bool(stored[5]), stored[6], _timestamp(stored[7]))
+
+    def _bulk_update_completion(self, cursor, user_id: int, rows: Sequence[Tuple]):
+        # First, delete any May 2020 entries
+        cursor.execute(
+            "DELETE FROM completion_status WHERE user_id = ? AND year = 2020 AND session = 'May' RETURNING subject_id, year",
+            (user_id,)
+        )
+        touched = set(cursor.fetchall())
+        entries = [(user_id, *row) for row in rows]
+        _log_attempts(cursor, _changed_entries(cursor, user_id, entries))
+        _upsert_completion_rows(cursor, entries)
+        touched.update((row[0], row[1]) for row in rows)
+        self._completion_rows_written(cursor, user_id, touched)
+
+    def _write_completion_batch(self, cursor, entries: Sequence[Tuple], log_attempts: bool = True):
+        touched = {}
+        for user_id, subject_id, year, *_ in entries:
+            touched.setdefault(user_id, set()).add((subject_id, year))
+        _upsert_completion_rows(cursor, entries)
+        if log_attempts:
+            _log_attempts(cursor, entries)
+        for user_id, groups in touched.items():
+            self._completion_rows_written(cursor, user_id, groups)
+
+    def _compact_attempts(self, cursor, user_id: Optional[int], limit: int) -> int:
+        if user_id is not None:
+            cursor.execute(
+                """
+                DELETE FROM completion_attempt_queue WHERE user_id = ?
+                RETURNING id, user_id, subject_id, year, session, paper, timezone, is_completed, score
+                """,
+                (user_id,)
+            )
+        else:
+            cursor.execute(
+                """
+                DELETE FROM completion_attempt_queue WHERE id IN (
+                    SELECT id FROM completion_attempt_queue ORDER BY id LIMIT ?
+                )
+                RETURNING id, user_id, subject_id, year, session, paper, timezone, is_completed, score
+                """,
+                (limit,)
+            )
+        # RETURNING order is unspecified; the last queued attempt per paper wins
+        queued = sorted(cursor.fetchall())
+        latest = {}
+        for row_id, *entry in queued:
+            if not valid_score(entry[7]):
+                # Appended before scores were checked; folding it would fail the whole batch
+                logger.warning("Skipping queued attempt %s with invalid score %r", row_id, entry[7])
+                continue
+            latest[(*entry[:5], entry[5] or '')] = tuple(entry)
+        self._write_completion_batch(cursor, list(latest.values()), log_attempts=False)
+        return len(queued)
+
+    def _completion_rows_written(self, cursor, user_id: int, touched):
+        """Update the derived progress summary and bitsets for the touched (subject_id, year) groups"""
+        _refresh_progress(cursor, user_id, touched)
+        if self.maintain_bitsets and touched:
+            _rebuild_bitsets(cursor, user_id, {subject_id for subject_id, _ in touched})
+
+
+class _SQLiteImport(CompletionImport):
+    def __init__(self, storage: SQLiteStorage, conn: sqlite3.Connection, user_id: int):
+        self.storage = storage
+        self.conn = conn
+        self.user_id = user_id
+
+    async def stage(self, rows):
+        if rows:
+            await self.storage.db.call(
+                self.conn.executemany,
+                """
+                INSERT INTO temp.completion_import (subject_id, year, session, paper, timezone, is_completed, score)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+
+    async def merge(self) -> int:
+        # At most one row per catalog paper survives, so the merge set stays small
+        latest = await self.storage.db.call(_latest_staged, self.conn)
+        await self.storage.db.write(self._merge, latest)
+        return len(latest)
+
+    def _merge(self, cursor, rows):
+        entries = [(self.user_id, *row) for row in rows]
+        _log_attempts(cursor, _changed_entries(cursor, self.user_id, entries))
+        _upsert_completion_rows(cursor, entries)
+        self.storage._completion_rows_written(cursor, self.user_id, {(row[0], row[1]) for row in rows})
+
+
+class _SQLiteFeedbackClaim(FeedbackClaim):
+    def __init__(self, db: SQLiteDatabase, rows):
+        self.db = db
+        self.rows = rows
+        self.done = False
+
+    def sent(self):
+        with self.db.writing() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE feedback_outbox SET sent_at = {NOW}, attempts = attempts + 1
+                WHERE id IN (SELECT value FROM json_each(?))
+                """,
+                (self._ids(),)
+            )
+        self.done = True
+
+    def failed(self, error: str, backoff_base: float, backoff_max: float):
+        with self.db.writing() as cursor:
+            cursor.execute(
+                """
+                UPDATE feedback_outbox
+                SET attempts = attempts + 1, last_error = ?,
+                    next_attempt_at = strftime('%Y-%m-%d %H:%M:%f', 'now',
+                        '+' || min(? * (1 << min(attempts, 30)), ?) || ' seconds')
+                WHERE id IN (SELECT value FROM json_each(?))
+                """,
+                (error[:500], backoff_base, backoff_max, self._ids())
+            )
+        self.done = True
+
+    def _ids(self) -> str:
+        return json.dumps([row[0] for row in self.rows])
+
+
+def _fetchone(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchone()
+
+
+def _create_user(cursor, username: str, email: str, password_hash: str) -> int:
+    cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+    if cursor.fetchone():
+        raise UserExists("username")
+    cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
+    if cursor.fetchone():
+        raise UserExists("email")
+    cursor.execute(
+        "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?) RETURNING id",
+        (username, email, password_hash)
+    )
+    return cursor.fetchone()[0]
+
+
+def _replace_password_hash(cursor, user_id: int, old_hash: str, new_hash: str) -> bool:
+    cursor.execute(
+        "UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+        (new_hash, user_id, old_hash)
+    )
+    return cursor.rowcount > 0
+
+
+def _save_subjects(cursor, user_id: int, subjects: str):
+    cursor.execute("UPDATE user_subjects SET subjects = ? WHERE user_id = ?", (subjects, user_id))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO user_subjects (user_id, subjects) VALUES (?, ?)", (user_id, subjects))
+
+
+def _upsert_completion_rows(cursor, rows):
+    """Upsert (user_id, subject_id, year, session, paper, timezone, is_completed, score) rows"""
+    if not rows:
+        return
+    cursor.executemany(
+        f"""
+        INSERT INTO completion_status
+        (user_id, subject_id, year, session, paper, timezone, is_completed, score, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, {NOW})
+        ON CONFLICT (user_id, subject_id, year, session, paper, timezone_key)
+        DO UPDATE SET is_completed = excluded.is_completed, score = excluded.score,
+                      updated_at = excluded.updated_at
+        """,
+        rows
+    )
+
+
+def _log_attempts(cursor, entries, recorded_at=None):
+    """Append batch entries to completion_attempts, stamped now unless ``recorded_at`` is given"""
+    cursor.executemany(
+        f"""
+        INSERT INTO completion_attempts
+        (user_id, subject_id, year, session, paper, timezone_key, is_completed, score, recorded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(strftime('%Y-%m-%d %H:%M:%f', ?), {NOW}))
+        """,
+        [
+            (user_id, subject_id, year, session, paper, timezone or '', is_completed, score, recorded_at)
+            for user_id, subject_id, year, session, paper, timezone, is_completed, score in entries
+        ]
+    )
+
+
+def _changed_entries(cursor, user_id, entries):
+    """The batch entries of one user that differ from (or are missing in) the stored state.
+
+    Set-based writes (bulk syncs, imports) log only these attempts, so papers a
+    full sync repeats unchanged add no history.
+    """
+    cursor.execute(
+        "SELECT subject_id, year, session, paper, timezone_key, is_completed, score FROM completion_status WHERE user_id = ?",
+        (user_id,)
+    )
+    stored = {tuple(row[:5]): (bool(row[5]), row[6]) for row in cursor.fetchall()}
+    return [
+        entry for entry in entries
+        if stored.get((*entry[1:5], entry[5] or '')) != (bool(entry[6]), entry[7])
+    ]
+
+
+def _append_attempts(cursor, entries):
+    _log_attempts(cursor, entries)
+    cursor.executemany(
+        """
+        INSERT INTO completion_attempt_queue
+        (user_id, subject_id, year, session, paper, timezone, is_completed, score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (user_id, subject_id, year, session, paper, timezone or None, is_completed, score)
+            for user_id, subject_id, year, session, paper, timezone, is_completed, score in entries
+        ]
+    )
+
+
+def _fetch_attempts(cursor, user_id, subject_id, year, session, paper, timezone, before, limit):
+    # The cursor is brought to the stored millisecond form before comparing;
+    # rowid breaks ties between attempts stamped in the same millisecond
+    cursor.execute(
+        """
+        SELECT recorded_at, is_completed, score FROM completion_attempts
+        WHERE user_id = ? AND subject_id = ? AND year = ? AND session = ? AND paper = ?
+        AND timezone_key = ? AND (? IS NULL OR recorded_at < strftime('%Y-%m-%d %H:%M:%f', ?))
+        ORDER BY recorded_at DESC, rowid DESC
+        LIMIT ?
+        """,
+        (user_id, subject_id, year, session, paper, timezone or '', before, before, limit)
+    )
+    return cursor.fetchall()
+
+
+# Recompute the user_progress rows of the given (subject_id, year) groups,
+# passed as a JSON array of [subject_id, year] pairs
+_REFRESH_PROGRESS_SQL = """
+    INSERT INTO user_progress
+    (user_id, subject_id, year, completed, scored, score_sum, best_score, latest_score, latest_at)
+    SELECT :user_id, g.subject_id, g.year,
+           count(*) FILTER (WHERE c.is_completed),
+           count(c.score) FILTER (WHERE c.is_completed),
+           COALESCE(sum(c.score) FILTER (WHERE c.is_completed), 0),
+           max(c.score) FILTER (WHERE c.is_completed),
+           (SELECT l.score FROM completion_status l
+            WHERE l.user_id = :user_id AND l.subject_id = g.subject_id AND l.year = g.year
+            AND l.is_completed AND l.score IS NOT NULL
+            ORDER BY l.updated_at DESC, l.id DESC
+            LIMIT 1),
+           max(c.updated_at) FILTER (WHERE c.is_completed AND c.score IS NOT NULL)
+    FROM (
+        SELECT json_extract(value, '$[0]') AS subject_id, json_extract(value, '$[1]') AS year
+        FROM json_each(:groups)
+    ) AS g
+    LEFT JOIN completion_status c
+        ON c.user_id = :user_id AND c.subject_id = g.subject_id AND c.year = g.year
+    WHERE true
+    GROUP BY g.subject_id, g.year
+    ON CONFLICT (user_id, subject_id, year) DO UPDATE SET
+        completed = excluded.completed, scored = excluded.scored, score_sum = excluded.score_sum,
+        best_score = excluded.best_score, latest_score = excluded.latest_score,
+        latest_at = excluded.latest_at
+"""
+
+
+def _refresh_progress(cursor, user_id: int, groups):
+    groups = sorted(set(groups))
+    if not groups:
+        return
+    cursor.execute(_REFRESH_PROGRESS_SQL, {"user_id": user_id, "groups": json.dumps(groups)})
+
+
+def _completion_version(cursor, user_id: int):
+    cursor.execute("SELECT count(*), max(updated_at) FROM completion_status WHERE user_id = ?", (user_id,))
+    count, last_updated = cursor.fetchone()
+    return count, _timestamp(last_updated)
+
+
+def _fetch_completion(cursor, user_id: int, since: Optional[datetime], is_current: Optional[VersionCheck]):
+    count, last_updated = _completion_version(cursor, user_id)
+    if is_current is not None and is_current(count, last_updated):
+        return count, last_updated, None
+    if since is None:
+        cursor.execute(
+            """
+            SELECT subject_id, year, session, paper, timezone, is_completed, score
+            FROM completion_status WHERE user_id = ?
+            """,
+            (user_id,)
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT subject_id, year, session, paper, timezone, is_completed, score
+            FROM completion_status WHERE user_id = ? AND updated_at > ?
+            """,
+            (user_id, since)
+        )
+    return count, last_updated, cursor.fetchall()
+
+
+def _fetch_completion_bitsets(cursor, user_id: int, is_current: Optional[VersionCheck]):
+    count, last_updated = _completion_version(cursor, user_id)
+    if is_current is not None and is_current(count, last_updated):
+        return count, last_updated, None
+    cursor.execute(
+        "SELECT subject_id, completed, scores FROM completion_bitsets WHERE user_id = ? ORDER BY subject_id",
+        (user_id,)
+    )
+    return count, last_updated, cursor.fetchall()
+
+
+def _set_bitset_slot(cursor, user_id: int, subject_id: str, slot: int, is_completed: bool, score: Optional[int]):
+    # Read-modify-write is safe: every write runs on the single writer
+    cursor.execute(
+        "SELECT completed, scores FROM completion_bitsets WHERE user_id = ? AND subject_id = ?",
+        (user_id, subject_id)
+    )
+    row = cursor.fetchone()
+    completed = bytearray(row[0] if row else bitsets.EMPTY_BITSET)
+    scores = bytearray(row[1] if row else bitsets.EMPTY_SCORES)
+    if is_completed:
+        completed[slot >> 3] |= 1 << (slot & 7)
+    else:
+        completed[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+    scores[slot] = bitsets.UNSCORED if score is None else score
+    cursor.execute(
+        f"""
+        INSERT INTO completion_bitsets (user_id, subject_id, completed, scores, updated_at)
+        VALUES (?, ?, ?, ?, {NOW})
+        ON CONFLICT (user_id, subject_id) DO UPDATE SET
+            completed = excluded.completed, scores = excluded.scores, updated_at = excluded.updated_at
+        """,
+        (user_id, subject_id, bytes(completed), bytes(scores))
+    )
+
+
+def _rebuild_bitsets(cursor, user_id: Optional[int] = None, subjects=None):
+    """SQLite counterpart of :func:`bitsets.rebuild`."""
+    query = """
+        SELECT user_id, subject_id, year, session, paper, timezone, is_completed, score
+        FROM completion_status
+    """
+    params = []
+    if user_id is not None:
+        query += " WHERE user_id = ?"
+        params.append(user_id)
+        if subjects is not None:
+            subjects = list(subjects)
+            query += " AND subject_id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(subjects))
+    cursor.execute(query, params)
+
+    grouped: Dict[Tuple[int, str], List[Tuple]] = {}
+    for row in cursor.fetchall():
+        grouped.setdefault((row[0], row[1]), []).append(row[2:])
+
+    if user_id is None:
+        cursor.execute("DELETE FROM completion_bitsets")
+    elif subjects is None:
+        cursor.execute("DELETE FROM completion_bitsets WHERE user_id = ?", (user_id,))
+    else:
+        cursor.execute(
+            "DELETE FROM completion_bitsets WHERE user_id = ? AND subject_id IN (SELECT value FROM json_each(?))",
+            (user_id, json.dumps(subjects))
+        )
+    cursor.executemany(
+        f"INSERT INTO completion_bitsets (user_id, subject_id, completed, scores, updated_at) VALUES (?, ?, ?, ?, {NOW})",
+        [(uid, sid, *bitsets.encode(rows)) for (uid, sid), rows in grouped.items()]
+    )
+
+
+def _create_import_staging(conn: sqlite3.Connection):
+    # Private to the connection and gone when it closes; seq keeps upload order
+    conn.execute("""
+    CREATE TEMP TABLE completion_import (
+        seq INTEGER PRIMARY KEY,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER
+    )
+    """)
+    conn.execute("BEGIN")
+
+
+def _latest_staged(conn: sqlite3.Connection) -> List[Tuple]:
+    """The last staged row per paper."""
+    return conn.execute("""
+        SELECT subject_id, year, session, paper, timezone, is_completed, score
+        FROM (
+            SELECT *, row_number() OVER (
+                PARTITION BY subject_id, year, session, paper, COALESCE(timezone, '')
+                ORDER BY seq DESC
+            ) AS position
+            FROM temp.completion_import
+        )
+        WHERE position = 1
+    """).fetchall()
+
+
+def _fetch_progress(cursor, user_id: int):
+    cursor.execute("SELECT subjects FROM user_subjects WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    subjects = json.loads(row[0]) if row else []
+    cursor.execute(
+        """
+        SELECT subject_id, year, completed, scored, score_sum, best_score, latest_score, latest_at
+        FROM user_progress WHERE user_id = ?
+        """,
+        (user_id,)
+    )
+    return subjects, [(*row[:7], _timestamp(row[7])) for row in cursor.fetchall()]
+
+
+def _save_feedback(cursor, message, email, user, timestamp):
+    cursor.execute(
+        "INSERT INTO user_feedback (message, email, user_identifier, timestamp) VALUES (?, ?, ?, ?) RETURNING id",
+        (message, email, user, timestamp)
+    )
+    cursor.execute("INSERT INTO feedback_outbox (feedback_id) VALUES (?)", (cursor.fetchone()[0],))
+
+
+# Schema. Mirrors migrations.py step for step, and upgrades the legacy
+# ib_tracker.db layout (no score/timezone columns) in place.
+def _columns(cursor, table: str) -> set:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cursor.fetchall()}
+
+
+@_schema_step(1, "create users, user_subjects and completion_status")
+def _create_base_tables(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_subjects (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        subjects TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS completion_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL DEFAULT 0,
+        score INTEGER CHECK (score >= 0 AND score <= 100),
+        updated_at TIMESTAMP DEFAULT ({NOW}),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+
+
+@_schema_step(2, "add completion_status.score and completion_status.timezone")
+def _add_score_and_timezone(cursor, timezone_config):
+    columns = _columns(cursor, "completion_status")
+    if "score" not in columns:
+        cursor.execute("ALTER TABLE completion_status ADD COLUMN score INTEGER CHECK (score >= 0 AND score <= 100)")
+    if "timezone" not in columns:
+        cursor.execute("ALTER TABLE completion_status ADD COLUMN timezone TEXT")
+
+
+@_schema_step(3, "default papers with timezone variants to TZ1")
+def _backfill_tz1(cursor, timezone_config):
+    if not timezone_config:
+        cursor.execute("SELECT 1 FROM completion_status WHERE timezone IS NULL LIMIT 1")
+        if cursor.fetchone() is not None:
+            # Roll back and retry on the next start rather than record the step as done
+            raise RuntimeError("timezone-config.json is not loaded; cannot default papers to TZ1")
+    variants = [
+        (subject_id, paper_key)
+        for subject_id, papers in timezone_config.items()
+        for paper_key, has_variants in papers.items()
+        if has_variants
+    ]
+    cursor.executemany(
+        f"""
+        UPDATE completion_status AS c
+        SET timezone = 'TZ1', updated_at = {NOW}
+        WHERE c.timezone IS NULL
+        AND c.subject_id = ?
+        AND replace(lower(c.paper), ' ', '') = ?
+        AND NOT EXISTS (
+            SELECT 1 FROM completion_status o
+            WHERE o.user_id = c.user_id AND o.subject_id = c.subject_id
+            AND o.year = c.year AND o.session = c.session AND o.paper = c.paper
+            AND o.timezone = 'TZ1'
+        )
+        """,
+        variants
+    )
+
+
+@_schema_step(4, "unique paper key on a normalized timezone column")
+def _unique_paper_key(cursor, timezone_config):
+    # timezone_key normalizes NULL and '' (no timezone variant) to ''
+    if "timezone_key" not in _columns(cursor, "completion_status"):
+        cursor.execute("""
+        ALTER TABLE completion_status ADD COLUMN timezone_key TEXT
+        GENERATED ALWAYS AS (COALESCE(timezone, '')) VIRTUAL
+        """)
+    # Collapse duplicates to the most recently updated row
+    cursor.execute("""
+    DELETE FROM completion_status WHERE id IN (
+        SELECT a.id FROM completion_status a
+        JOIN completion_status b
+        ON a.user_id = b.user_id AND a.subject_id = b.subject_id
+        AND a.year = b.year AND a.session = b.session AND a.paper = b.paper
+        AND a.timezone_key = b.timezone_key
+        AND (COALESCE(a.updated_at, ''), a.id) < (COALESCE(b.updated_at, ''), b.id)
+    )
+    """)
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS completion_status_user_paper_key ON completion_status
+    (user_id, subject_id, year, session, paper, timezone_key)
+    """)
+
+
+@_schema_step(5, "index completion_status (user_id, updated_at) for delta sync")
+def _index_updated_at(cursor, timezone_config):
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_status_user_updated
+    ON completion_status (user_id, updated_at)
+    """)
+
+
+@_schema_step(6, "feedback table and delivery outbox")
+def _feedback_outbox(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        email TEXT,
+        user_identifier TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS feedback_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        feedback_id INTEGER NOT NULL REFERENCES user_feedback (id),
+        created_at TIMESTAMP DEFAULT ({NOW}),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT ({NOW}),
+        sent_at TIMESTAMP,
+        last_error TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS feedback_outbox_pending
+    ON feedback_outbox (next_attempt_at) WHERE sent_at IS NULL
+    """)
+
+
+@_schema_step(7, "per-user progress summary for /stats")
+def _user_progress(cursor, timezone_config):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_progress (
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        completed INTEGER NOT NULL DEFAULT 0,
+        scored INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        best_score INTEGER,
+        latest_score INTEGER,
+        latest_at TIMESTAMP,
+        PRIMARY KEY (user_id, subject_id, year)
+    )
+    """)
+    cursor.execute("SELECT DISTINCT user_id, subject_id, year FROM completion_status ORDER BY user_id")
+    groups: Dict[int, List[Tuple[str, int]]] = {}
+    for user_id, subject_id, year in cursor.fetchall():
+        groups.setdefault(user_id, []).append((subject_id, year))
+    for user_id, user_groups in groups.items():
+        _refresh_progress(cursor, user_id, user_groups)
+
+
+@_schema_step(8, "packed per-subject completion bitsets")
+def _completion_bitsets(cursor, timezone_config):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS completion_bitsets (
+        user_id INTEGER NOT NULL REFERENCES users (id),
+        subject_id TEXT NOT NULL,
+        completed BLOB NOT NULL,
+        scores BLOB NOT NULL,
+        updated_at TIMESTAMP DEFAULT ({NOW}),
+        PRIMARY KEY (user_id, subject_id)
+    )
+    """)
+    # Single row: 0 until the bitsets are built from completion_status, and
+    # again whenever the app runs without maintaining them
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_bitsets_sync (
+        singleton INTEGER PRIMARY KEY DEFAULT 1 CHECK (singleton = 1),
+        in_sync BOOLEAN NOT NULL
+    )
+    """)
+    cursor.execute("INSERT INTO completion_bitsets_sync (in_sync) VALUES (0) ON CONFLICT DO NOTHING")
+
+
+@_schema_step(9, "append-only completion attempt log and its compaction queue")
+def _completion_attempts(cursor, timezone_config):
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS completion_attempts (
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone_key TEXT NOT NULL DEFAULT '',
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER,
+        recorded_at TIMESTAMP NOT NULL DEFAULT ({NOW})
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_attempts_paper_history ON completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, recorded_at)
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS completion_attempt_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        subject_id TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        session TEXT NOT NULL,
+        paper TEXT NOT NULL,
+        timezone TEXT,
+        is_completed BOOLEAN NOT NULL,
+        score INTEGER
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS completion_attempt_queue_user ON completion_attempt_queue (user_id)
+    """)
+    cursor.execute(f"""
+    INSERT INTO completion_attempts
+    (user_id, subject_id, year, session, paper, timezone_key, is_completed, score, recorded_at)
+    SELECT user_id, subject_id, year, session, paper, timezone_key, is_completed, score,
+           COALESCE(updated_at, {NOW})
+    FROM completion_status
+    """)
+
+
+@_schema_step(10, "rebuild completion bitsets to keep unscored papers")
+def _rebuild_bitsets_unscored(cursor, timezone_config):
+    # Bitsets built before UNSCORED existed drop papers stored as not completed and unscored
+    cursor.execute("UPDATE completion_bitsets_sync SET in_sync = 0")
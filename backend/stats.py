@@ -0,0 +1,94 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+
+class ProgressTotals:
+    """Running completion and score totals for one slice of a user's progress."""
+
+    __slots__ = ("completed", "available", "scored", "score_sum", "best_score", "latest_score", "latest_at")
+
+    def __init__(self):
+        self.completed = 0
+        self.available = 0
+        self.scored = 0
+        self.score_sum = 0
+        self.best_score: Optional[int] = None
+        self.latest_score: Optional[int] = None
+        self.latest_at: Optional[datetime] = None
+
+    def add(self, completed, scored, score_sum, best_score, latest_score, latest_at):
+        self.completed += completed
+        self.scored += scored
+        self.score_sum += score_sum
+        if best_score is not None and (self.best_score is None or best_score > self.best_score):
+            self.best_score = best_score
+        if latest_at is not None and (self.latest_at is None or latest_at > self.latest_at):
+            self.latest_at = latest_at
+            self.latest_score = latest_score
+
+    def as_dict(self) -> dict:
+        return {
+            "completed": self.completed,
+            "available": self.available,
+            # Papers logged outside the catalog (e.g. a user-enabled TZ variant)
+            # can push completed past available, so cap at 100
+            "percentage": round(min(self.completed, self.available) * 100 / self.available) if self.available else 0,
+            "average_score": round(self.score_sum / self.scored, 1) if self.scored else None,
+            "best_score": self.best_score,
+            "latest_score": self.latest_score,
+        }
+
+
+def build_stats(
+    rows: Iterable,
+    subjects: Iterable[str],
+    years: Iterable[int],
+    available: Callable[[str, int], int],
+) -> Dict:
+    """Roll stored per-(subject, year) summary rows up into the /stats response.
+
+    ``rows`` are ``(subject_id, year, completed, scored, score_sum, best_score,
+    latest_score, latest_at)``; ``subjects`` are always reported even without
+    any progress, and ``available(subject_id, year)`` gives the number of
+    papers in the catalog for that slice.
+    """
+    years = list(years)
+    year_set = set(years)
+    overall = ProgressTotals()
+    by_subject: Dict[str, ProgressTotals] = {}
+    by_subject_year: Dict[str, Dict[int, ProgressTotals]] = {}
+    by_year = {year: ProgressTotals() for year in years}
+
+    for subject_id in subjects:
+        by_subject.setdefault(subject_id, ProgressTotals())
+        by_subject_year.setdefault(subject_id, {})
+
+    for subject_id, year, *totals in rows:
+        if year not in year_set:
+            continue
+        by_subject.setdefault(subject_id, ProgressTotals()).add(*totals)
+        by_subject_year.setdefault(subject_id, {}).setdefault(year, ProgressTotals()).add(*totals)
+        by_year[year].add(*totals)
+        overall.add(*totals)
+
+    for subject_id, subject_totals in by_subject.items():
+        subject_years = by_subject_year[subject_id]
+        for year in years:
+            count = available(subject_id, year)
+            subject_totals.available += count
+            by_year[year].available += count
+            overall.available += count
+            if year in subject_years:
+                subject_years[year].available = count
+
+    return {
+        "overall": overall.as_dict(),
+        "subjects": {
+            subject_id: {
+                **totals.as_dict(),
+                "years": {str(year): t.as_dict() for year, t in sorted(by_subject_year[subject_id].items())},
+            }
+            for subject_id, totals in sorted(by_subject.items())
+        },
+        "years": {str(year): by_year[year].as_dict() for year in years},
+    }
@@ -0,0 +1,232 @@
+"""Storage interface shared by the PostgreSQL and SQLite backends.
+
+Routes only talk to a :class:`Storage`; the SQL lives in
+``postgres_storage.py`` and ``sqlite_storage.py``. Completion rows are passed
+around as plain tuples:
+
+* a paper row is ``(subject_id, year, session, paper, timezone, is_completed, score)``,
+  already checked against the catalog by the caller;
+* a batch entry is ``(user_id, subject_id, year, session, paper, timezone, is_completed, score)``;
+* an export row is a paper row followed by ``updated_at``;
+* a bitset row is ``(subject_id, completed, scores)`` as laid out by :mod:`bitsets`;
+* an attempt row is ``(recorded_at, is_completed, score)``, one per single-paper
+  write in the append-only attempt log.
+
+Timestamps are naive ``datetime`` objects and booleans are ``bool`` in both
+backends.
+"""
+from contextlib import AbstractAsyncContextManager, AbstractContextManager
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class StorageError(Exception):
+    """Base class for errors a route turns into a client response."""
+
+
+class RejectedWrite(StorageError):
+    """A write the schema refuses, such as a score outside 0-100; retrying cannot succeed."""
+
+
+class UserExists(StorageError):
+    """Registration with a username or email that is already taken."""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field.capitalize()} already registered")
+        self.field = field
+
+
+def valid_score(score: Optional[int]) -> bool:
+    """Whether ``score`` passes completion_status's CHECK (None or 0-100)."""
+    return score is None or 0 <= score <= 100
+
+
+def check_scores(entries: Sequence[Tuple]):
+    """Raise :class:`RejectedWrite` if a batch entry's score would be refused."""
+    for entry in entries:
+        if not valid_score(entry[7]):
+            raise RejectedWrite(f"Score {entry[7]!r} is outside 0-100")
+
+
+# Called with a user's (row count, newest updated_at); True means the client
+# copy is current and the rows need not be read
+VersionCheck = Callable[[int, Optional[datetime]], bool]
+
+
+class CompletionImport:
+    """Staging area for one streamed import, from :meth:`Storage.import_completion`."""
+
+    async def stage(self, rows: List[Tuple]):
+        """Append paper rows; later rows for the same paper win at merge."""
+        raise NotImplementedError
+
+    async def merge(self) -> int:
+        """Upsert the staged rows into the user's completion; returns rows written.
+
+        Logs an attempt for each paper whose stored state the import changes.
+        """
+        raise NotImplementedError
+
+
+class FeedbackClaim:
+    """Pending feedback claimed for delivery, from :meth:`Storage.claim_feedback`.
+
+    ``rows`` are ``(id, message, email, user_identifier, timestamp)``. Call
+    ``sent()`` or ``failed(...)`` before leaving the block; unacknowledged
+    rows become claimable again.
+    """
+
+    rows: List[Tuple]
+
+    def sent(self):
+        raise NotImplementedError
+
+    def failed(self, error: str, backoff_base: float, backoff_max: float):
+        """Count an attempt and delay the next one by ``base * 2**attempts`` seconds, capped."""
+        raise NotImplementedError
+
+
+class Storage:
+    """Everything the API persists: users, subjects, completion, progress and feedback.
+
+    ``open``, ``migrate``, ``sync_bitsets``, ``close`` and ``claim_feedback``
+    block and are meant for startup, shutdown and background threads; the
+    rest are awaitable and never block the event loop.
+    """
+
+    name = "storage"
+
+    # Lifecycle
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def migrate(self, timezone_config: Dict) -> List[int]:
+        """Bring the schema up to date; returns the versions that were applied."""
+        raise NotImplementedError
+
+    def sync_bitsets(self, maintained: bool) -> bool:
+        """Rebuild stale completion bitsets when ``maintained``, else mark them stale.
+
+        Returns True if a rebuild ran.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Connection statistics for /health."""
+        raise NotImplementedError
+
+    def gauges(self) -> Dict[str, float]:
+        """Connection gauges for /metrics."""
+        raise NotImplementedError
+
+    # Users
+    async def get_user(self, username: str) -> Optional[Tuple[int, str, str, str]]:
+        """Return ``(id, username, email, password_hash)`` or None."""
+        raise NotImplementedError
+
+    async def create_user(self, username: str, email: str, password_hash: str) -> int:
+        """Insert a user and return its id; raises :class:`UserExists`."""
+        raise NotImplementedError
+
+    async def replace_password_hash(self, user_id: int, old_hash: str, new_hash: str) -> bool:
+        """Swap the hash only if it is still ``old_hash``; returns whether it was replaced."""
+        raise NotImplementedError
+
+    # Subjects
+    async def save_subjects(self, user_id: int, subjects: List[str]):
+        raise NotImplementedError
+
+    async def get_subjects(self, user_id: int) -> Optional[List[str]]:
+        raise NotImplementedError
+
+    # Completion
+    async def update_completion(
+        self, user_id: int, subject_id: str, year: int, session: str, paper: str,
+        timezone: Optional[str], is_completed: bool, score: Optional[int]
+    ) -> Tuple:
+        """Upsert one paper and log the attempt; returns the stored paper row followed by ``updated_at``."""
+        raise NotImplementedError
+
+    async def bulk_update_completion(self, user_id: int, rows: Sequence[Tuple]):
+        """Drop the user's cancelled May 2020 rows and upsert one row per paper.
+
+        Logs an attempt for each paper whose stored state the sync changes.
+        """
+        raise NotImplementedError
+
+    async def write_completion_batch(self, entries: Sequence[Tuple]):
+        """Upsert and log batch entries of several users (one per paper) in one transaction.
+
+        Raises :class:`RejectedWrite` if an entry violates a constraint.
+        """
+        raise NotImplementedError
+
+    async def append_attempts(self, entries: Sequence[Tuple]):
+        """Log batch entries and queue them for :meth:`compact_attempts`, leaving the current state as is.
+
+        Raises :class:`RejectedWrite` (appending nothing) if an entry's score is outside 0-100.
+        """
+        raise NotImplementedError
+
+    async def compact_attempts(self, user_id: Optional[int] = None, limit: int = 1000) -> int:
+        """Fold queued attempts into the current state; returns how many were folded.
+
+        With ``user_id`` all of that user's queued attempts are folded, waiting
+        for any compaction already holding them; otherwise up to ``limit`` of
+        the oldest unclaimed ones. The latest attempt per paper wins; queued
+        attempts the state would refuse are logged and skipped rather than
+        failing the batch.
+        """
+        raise NotImplementedError
+
+    async def fetch_attempts(
+        self, user_id: int, subject_id: str, year: int, session: str, paper: str, timezone: Optional[str],
+        before: Optional[datetime], limit: int
+    ) -> List[Tuple]:
+        """Return up to ``limit`` attempt rows of one paper recorded before ``before``, newest first."""
+        raise NotImplementedError
+
+    async def fetch_completion(
+        self, user_id: int, since: Optional[datetime] = None, is_current: Optional[VersionCheck] = None
+    ) -> Tuple[int, Optional[datetime], Optional[List[Tuple]]]:
+        """Return ``(count, last_updated, rows)`` from one consistent snapshot.
+
+        ``rows`` are paper rows changed after ``since`` (all when None), or
+        None when ``is_current`` accepted the version.
+        """
+        raise NotImplementedError
+
+    async def fetch_completion_bitsets(
+        self, user_id: int, is_current: Optional[VersionCheck] = None
+    ) -> Tuple[int, Optional[datetime], Optional[List[Tuple]]]:
+        """Like :meth:`fetch_completion` for a full read, returning bitset rows."""
+        raise NotImplementedError
+
+    def export_completion(self, user_id: int, chunk_size: int) -> AsyncIterator[List[Tuple]]:
+        """Yield the user's export rows in paper order, ``chunk_size`` at a time."""
+        raise NotImplementedError
+
+    def import_completion(self, user_id: int) -> AbstractAsyncContextManager:
+        """Async context yielding a :class:`CompletionImport`.
+
+        Nothing is written unless ``merge`` is called and the block exits
+        normally.
+        """
+        raise NotImplementedError
+
+    async def fetch_progress(self, user_id: int) -> Tuple[List[str], List[Tuple]]:
+        """Return the user's subjects and their ``user_progress`` rows (see :func:`stats.build_stats`)."""
+        raise NotImplementedError
+
+    # Feedback
+    async def save_feedback(self, message: str, email: Optional[str], user: Optional[str], timestamp: datetime):
+        """Store feedback and queue it in the outbox."""
+        raise NotImplementedError
+
+    def claim_feedback(self, batch_size: int, max_attempts: int) -> AbstractContextManager:
+        """Context yielding a :class:`FeedbackClaim` of due outbox rows (blocking)."""
+        raise NotImplementedError
+
@@ -0,0 +1,38 @@
+"""Runs the app on a throwaway SQLite database; set before main is imported."""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="paperpath-tests-"), "test.db")
+os.environ["RATE_LIMITING"] = "false"
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["HASH_WORKERS"] = "1"
+os.environ["WRITE_BEHIND_WINDOW"] = "0"
+os.environ["ATTEMPT_COMPACT_INTERVAL"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+_usernames = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def user(client):
+    """A freshly registered user: ``(id, auth headers)``."""
+    username = f"user{next(_usernames)}"
+    response = client.post("/register", json={"username": username, "email": f"{username}@example.com", "password": "pw"})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return client.get("/users/me", headers=headers).json()["id"], headers
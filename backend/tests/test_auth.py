@@ -0,0 +1,41 @@
+import main
+from admission import RateLimit
+
+
+def test_register_and_login(client):
+    response = client.post("/register", json={"username": "alice", "email": "alice@example.com", "password": "secret"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+
+    response = client.post("/token", data={"username": "alice", "password": "secret"})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    me = client.get("/users/me", headers=headers).json()
+    assert me["username"] == "alice"
+    assert me["email"] == "alice@example.com"
+
+
+def test_register_taken_username(client):
+    response = client.post("/register", json={"username": "bob", "email": "bob@example.com", "password": "pw"})
+    assert response.status_code == 200
+    response = client.post("/register", json={"username": "bob", "email": "other@example.com", "password": "pw"})
+    assert response.status_code == 400
+
+
+def test_login_wrong_password(client):
+    client.post("/register", json={"username": "carol", "email": "carol@example.com", "password": "right"})
+    assert client.post("/token", data={"username": "carol", "password": "wrong"}).status_code == 401
+    assert client.get("/users/me", headers={"Authorization": "Bearer invalid"}).status_code == 401
+
+
+def test_login_limited_per_username(client, monkeypatch):
+    monkeypatch.setitem(main.admission.limits, "login_user", RateLimit(1 / 60, 2))
+    monkeypatch.setitem(main.admission.rate_limited, "login_user", 0)
+    for username in ("dave", "erin"):
+        client.post("/register", json={"username": username, "email": f"{username}@example.com", "password": "right"})
+    for _ in range(2):
+        assert client.post("/token", data={"username": "dave", "password": "wrong"}).status_code == 401
+    response = client.post("/token", data={"username": "dave", "password": "right"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    assert client.post("/token", data={"username": "erin", "password": "right"}).status_code == 200
@@ -0,0 +1,158 @@
+import base64
+
+import pytest
+
+import bitsets
+import main
+import transfer
+
+PAPER_1 = {"subject_id": "math_aa_hl", "year": 2019, "session": "May", "paper": "Paper 1", "timezone": "TZ1"}
+PAPER_3 = {"subject_id": "math_aa_hl", "year": 2019, "session": "May", "paper": "Paper 3"}
+
+
+def test_post_and_get(client, user):
+    _, headers = user
+    response = client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 70}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["completion"]["score"] == 70
+
+    response = client.get("/completion", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70}}
+
+
+def test_rejects_invalid_writes(client, user):
+    _, headers = user
+    for score in (-1, 101):
+        response = client.post("/completion", json={**PAPER_1, "is_completed": True, "score": score}, headers=headers)
+        assert response.status_code == 422
+    response = client.post("/completion", json={**PAPER_1, "paper": "Paper 9", "is_completed": True}, headers=headers)
+    assert response.status_code == 400
+    assert client.get("/completion", headers=headers).json() == {}
+
+
+def test_not_modified(client, user):
+    _, headers = user
+    client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 70}, headers=headers)
+    etag = client.get("/completion", headers=headers).headers["etag"]
+
+    response = client.get("/completion", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 80}, headers=headers)
+    response = client.get("/completion", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["math_aa_hl-2019-May-Paper 1-TZ1"]["score"] == 80
+
+
+def test_since(client, user):
+    _, headers = user
+    client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 70}, headers=headers)
+    cursor = client.get("/completion", headers=headers).headers["x-completion-cursor"]
+
+    client.post("/completion", json={**PAPER_3, "is_completed": True, "score": 40}, headers=headers)
+    response = client.get("/completion", params={"since": cursor}, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["changes"]["math_aa_hl-2019-May-Paper 3"] == {"is_completed": True, "score": 40}
+    assert body["cursor"] >= cursor
+
+    assert client.get("/completion", params={"since": "garbage"}, headers=headers).status_code == 400
+
+
+def test_bulk(client, user):
+    _, headers = user
+    completion_data = {
+        "math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70},
+        "math_aa_hl-2019-May-Paper 3": {"is_completed": False},
+        "math_aa_hl-2019-May-Paper 2-TZ2": {"is_completed": True, "score": 150},
+        "math_aa_hl-2019-May-Paper 2-TZ1": {"is_completed": "yes"},
+        "math_aa_hl-2019-May-Paper 9": {"is_completed": True},
+        "not a key": {"is_completed": True},
+    }
+    response = client.post("/completion/bulk", json={"completion_data": completion_data}, headers=headers)
+    assert response.status_code == 200
+    assert client.get("/completion", headers=headers).json() == {
+        "math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70},
+        "math_aa_hl-2019-May-Paper 3": {"is_completed": False, "score": None},
+    }
+
+    response = client.post("/completion/bulk", json={"completion_data": {"math_aa_hl-2019-May-Paper 3": 1}}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_storage_error_is_a_500(client, user, monkeypatch):
+    _, headers = user
+
+    async def broken(*args):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(main.storage, "update_completion", broken)
+    response = client.post("/completion", json={**PAPER_1, "is_completed": True}, headers=headers)
+    assert response.status_code == 500
+    assert response.json() == {"detail": "Error updating completion status"}
+
+
+def history(client, headers, key):
+    response = client.get("/completion/history", params={"key": key}, headers=headers)
+    assert response.status_code == 200
+    return [(attempt["is_completed"], attempt["score"]) for attempt in response.json()["attempts"]]
+
+
+def test_bulk_and_import_log_changed_papers(client, user):
+    _, headers = user
+    key = "math_aa_hl-2019-May-Paper 1-TZ1"
+    for score in (70, 70, 85):
+        response = client.post("/completion/bulk", json={"completion_data": {key: {"is_completed": True, "score": score}}}, headers=headers)
+        assert response.status_code == 200
+    assert history(client, headers, key) == [(True, 85), (True, 70)]
+
+    for score in (85, 90):
+        response = client.post(
+            "/completion/import", params={"format": "csv"}, headers=headers,
+            content=f"subject_id,year,session,paper,timezone,is_completed,score\nmath_aa_hl,2019,May,Paper 1,TZ1,true,{score}\n",
+        )
+        assert response.status_code == 200
+    assert history(client, headers, key) == [(True, 90), (True, 85), (True, 70)]
+
+
+def test_compact_format_matches_rows(client, user):
+    _, headers = user
+    completion_data = {
+        "math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70},
+        "math_aa_hl-2019-May-Paper 2-TZ1": {"is_completed": True, "score": None},
+        "math_aa_hl-2019-May-Paper 3": {"is_completed": False, "score": None},
+        "math_aa_hl-2019-May-Paper 2-TZ2": {"is_completed": False, "score": 0},
+    }
+    client.post("/completion/bulk", json={"completion_data": completion_data}, headers=headers)
+    assert client.get("/completion", headers=headers).json() == completion_data
+
+    compact = client.get("/completion", params={"format": "compact"}, headers=headers).json()
+    decoded = {}
+    for subject_id, packed in compact["subjects"].items():
+        bitsets.decode(subject_id, base64.b64decode(packed["completed"]), base64.b64decode(packed["scores"]), into=decoded)
+    assert decoded == completion_data
+
+
+def test_csv_import_keeps_quoted_newlines():
+    upload = (
+        '\ufeffsubject_id,year,session,paper,timezone,is_completed,score\r\n'
+        'math_aa_hl,2019,"May\r\nJune","Paper 1, ""long""",TZ1,true,70\r\n'
+        '\r\n'
+        'math_aa_hl,2019,May,Paper 3,,false,'
+    ).encode()
+    parser = transfer.RecordParser("csv")
+    records = []
+    for i in range(len(upload)):
+        records += parser.feed(upload[i:i + 1])
+    records += parser.close()
+    assert records == [
+        ("math_aa_hl", 2019, "May\r\nJune", 'Paper 1, "long"', "TZ1", True, 70),
+        ("math_aa_hl", 2019, "May", "Paper 3", None, False, None),
+    ]
+
+    parser = transfer.RecordParser("csv")
+    parser.feed(upload[:upload.index(b"June")])
+    with pytest.raises(transfer.RecordError) as error:
+        parser.close()
+    assert error.value.line == 2
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import main
+import sqlite_storage
+from compactor import AttemptCompactor
+from storage import RejectedWrite
+from writebehind import WriteBehindBuffer
+
+PAPER_1 = {"subject_id": "math_aa_hl", "year": 2019, "session": "May", "paper": "Paper 1", "timezone": "TZ1"}
+PAPER_2_KEY = ("math_aa_hl", 2019, "May", "Paper 2", "TZ2")
+PAPER_3_KEY = ("math_aa_hl", 2019, "May", "Paper 3", "")
+
+
+@pytest.fixture
+def completion_buffer(monkeypatch):
+    buffer = WriteBehindBuffer(main._flush_completion_batch, window=60, rejects=(RejectedWrite,))
+    monkeypatch.setattr(main, "completion_buffer", buffer)
+    return buffer
+
+
+@pytest.fixture
+def attempt_compactor(monkeypatch):
+    compactor = AttemptCompactor(main.storage.compact_attempts, interval=60)
+    monkeypatch.setattr(main, "attempt_compactor", compactor)
+    return compactor
+
+
+def test_write_behind_flushes_before_read(client, user, completion_buffer):
+    _, headers = user
+    response = client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 70}, headers=headers)
+    assert response.status_code == 200
+    assert completion_buffer.pending() == 1
+
+    assert client.get("/completion", headers=headers).json() == {
+        "math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70},
+    }
+    assert completion_buffer.pending() == 0
+    assert completion_buffer.stats()["flushed"] == 1
+
+
+def test_write_behind_drops_rejected_entry(client, user, completion_buffer):
+    user_id, headers = user
+    assert client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 150}, headers=headers).status_code == 422
+
+    # Bypasses request validation, as an entry queued by an older release would
+    completion_buffer.put(user_id, PAPER_2_KEY, ("TZ2", True, 150))
+    completion_buffer.put(user_id, PAPER_3_KEY, (None, True, 40))
+    client.portal.call(completion_buffer.flush_all)
+
+    stats = completion_buffer.stats()
+    assert (stats["pending"], stats["flushed"], stats["rejected"]) == (0, 1, 1)
+    assert client.get("/completion", headers=headers).json() == {
+        "math_aa_hl-2019-May-Paper 3": {"is_completed": True, "score": 40},
+    }
+
+
+def test_write_behind_requeues_cancelled_flush():
+    async def run():
+        started = asyncio.Event()
+
+        async def flush(entries):
+            started.set()
+            await asyncio.Event().wait()
+
+        buffer = WriteBehindBuffer(flush, window=60)
+        buffer.put(1, "key", "value")
+        task = asyncio.create_task(buffer.flush_all())
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return buffer.pending()
+
+    assert asyncio.run(run()) == 1
+
+
+def test_compactor_folds_before_read(client, user, attempt_compactor):
+    _, headers = user
+    response = client.post("/completion", json={**PAPER_1, "is_completed": True, "score": 70}, headers=headers)
+    assert response.status_code == 200
+    assert attempt_compactor.stats()["pending_users"] == 1
+
+    assert client.get("/completion", headers=headers).json() == {
+        "math_aa_hl-2019-May-Paper 1-TZ1": {"is_completed": True, "score": 70},
+    }
+    assert attempt_compactor.stats()["folded"] == 1
+
+    history = client.get("/completion/history", params={"key": "math_aa_hl-2019-May-Paper 1-TZ1"}, headers=headers).json()
+    assert [attempt["score"] for attempt in history["attempts"]] == [70]
+
+
+def test_compactor_skips_rejected_attempt(client, user, attempt_compactor):
+    user_id, headers = user
+    bad = (user_id, *PAPER_2_KEY[:4], "TZ2", True, 150)
+    good = (user_id, *PAPER_3_KEY[:4], None, True, 40)
+    with pytest.raises(RejectedWrite):
+        client.portal.call(main.storage.append_attempts, [bad])
+
+    # Queued without the check, as by an older release
+    client.portal.call(main.storage.db.write, sqlite_storage._append_attempts, [bad, good])
+    client.portal.call(attempt_compactor.drain)
+
+    assert attempt_compactor.stats()["failures"] == 0
+    assert client.get("/completion", headers=headers).json() == {
+        "math_aa_hl-2019-May-Paper 3": {"is_completed": True, "score": 40},
+    }
@@ -0,0 +1,195 @@
+"""Line formats for completion export and import (NDJSON and CSV).
+
+Both directions work on chunks so a whole history never has to be held in
+memory: :func:`format_rows` renders one chunk of database rows, and
+:class:`RecordParser` turns arbitrary slices of an upload into records.
+"""
+import codecs
+import collections
+import csv
+import io
+import json
+from typing import Deque, Iterable, List, Optional, Tuple
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+EXPORT_COLUMNS = ("subject_id", "year", "session", "paper", "timezone", "is_completed", "score", "updated_at")
+IMPORT_COLUMNS = EXPORT_COLUMNS[:-1]
+
+_TRUE = {"true", "t", "1", "yes", "y"}
+_FALSE = {"false", "f", "0", "no", "n", ""}
+
+
+class RecordError(ValueError):
+    """An upload line that cannot be parsed."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def csv_header() -> str:
+    return ",".join(EXPORT_COLUMNS) + "\r\n"
+
+
+def format_rows(rows: Iterable[Tuple], fmt: str) -> str:
+    """Render ``EXPORT_COLUMNS`` rows as NDJSON lines or CSV records."""
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({
+                "subject_id": subject_id,
+                "year": year,
+                "session": session,
+                "paper": paper,
+                "timezone": timezone,
+                "is_completed": bool(is_completed),
+                "score": score,
+                "updated_at": updated_at.isoformat() if updated_at else None,
+            }, separators=(",", ":")) + "\n"
+            for subject_id, year, session, paper, timezone, is_completed, score, updated_at in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for subject_id, year, session, paper, timezone, is_completed, score, updated_at in rows:
+        writer.writerow((
+            subject_id, year, session, paper, timezone or "", "true" if is_completed else "false",
+            "" if score is None else score, updated_at.isoformat() if updated_at else "",
+        ))
+    return buffer.getvalue()
+
+
+class RecordParser:
+    """Incremental parser for uploaded completion records.
+
+    ``feed`` takes byte chunks split anywhere and returns the complete
+    records seen so far as ``(subject_id, year, session, paper, timezone,
+    is_completed, score)``; ``close`` returns the final unterminated record.
+    CSV uploads must start with a header naming at least ``IMPORT_COLUMNS``
+    (extra columns such as ``updated_at`` are ignored). Quoted CSV fields may
+    span lines: one ``csv.reader`` reads the whole upload, and is only asked
+    for a record once all of its lines have arrived.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.line = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._remainder = ""
+        self._columns: Optional[List[str]] = None
+        self._lines: Deque[str] = collections.deque()
+        self._reader = csv.reader(self._queued_lines())
+        self._record_start = 1
+        self._quoted = False
+
+    def feed(self, chunk: bytes) -> List[Tuple]:
+        lines = (self._remainder + self._decode(chunk, final=False)).split("\n")
+        self._remainder = lines.pop()
+        return self._parse(lines)
+
+    def close(self) -> List[Tuple]:
+        text = self._remainder + self._decode(b"", final=True)
+        self._remainder = ""
+        records = self._parse([text] if text.strip() or self._quoted else [])
+        if self._quoted:
+            raise RecordError(self._record_start, "unterminated quoted CSV field")
+        return records
+
+    def _decode(self, data: bytes, final: bool) -> str:
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            raise RecordError(self.line + 1, str(e))
+
+    def _queued_lines(self):
+        while True:
+            yield self._lines.popleft()
+
+    def _parse(self, lines: List[str]) -> List[Tuple]:
+        records = []
+        for text in lines:
+            self.line += 1
+            if self.fmt == "ndjson":
+                if text.strip():
+                    record = self._guard(self.line, self._parse_ndjson, text)
+                    records.append(record)
+                continue
+            if not self._quoted:
+                self._record_start = self.line
+            self._lines.append(text + "\n")
+            self._quoted = _ends_quoted(text, self._quoted)
+            if self._quoted:
+                continue
+            record = self._guard(self._record_start, self._parse_csv, next(self._reader))
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _guard(self, line: int, parse, value):
+        try:
+            return parse(value)
+        except RecordError:
+            raise
+        except KeyError as e:
+            raise RecordError(line, f"missing field {e}")
+        except (ValueError, TypeError, csv.Error) as e:
+            raise RecordError(line, str(e) or type(e).__name__)
+
+    def _parse_ndjson(self, text: str) -> Tuple:
+        item = json.loads(text)
+        if not isinstance(item, dict):
+            raise ValueError("expected a JSON object")
+        return _record(
+            item["subject_id"], item["year"], item["session"], item["paper"],
+            item.get("timezone"), item.get("is_completed", False), item.get("score"),
+        )
+
+    def _parse_csv(self, values: List[str]) -> Optional[Tuple]:
+        if not any(v.strip() for v in values):
+            return None
+        if self._columns is None:
+            self._columns = [v.strip().lower() for v in values]
+            missing = [c for c in IMPORT_COLUMNS if c not in self._columns]
+            if missing:
+                raise RecordError(self._record_start, f"CSV header is missing {', '.join(missing)}")
+            return None
+        row = dict(zip(self._columns, values))
+        completed = row["is_completed"].strip().lower()
+        if completed not in _TRUE and completed not in _FALSE:
+            raise ValueError(f"invalid is_completed {row['is_completed']!r}")
+        return _record(
+            row["subject_id"], row["year"], row["session"], row["paper"],
+            row["timezone"], completed in _TRUE, row["score"],
+        )
+
+
+def _ends_quoted(line: str, quoted: bool) -> bool:
+    """Whether ``line`` ends inside a quoted CSV field, as ``csv.reader`` reads it.
+
+    A quote opens a field only at its start; inside one, a quote closes it
+    unless the next character is another quote.
+    """
+    state = "quoted" if quoted else "start"
+    for char in line:
+        if state == "quoted":
+            if char == '"':
+                state = "closed"
+        elif char == ",":
+            state = "start"
+        elif char == '"' and state in ("start", "closed"):
+            state = "quoted"
+        else:
+            state = "unquoted"
+    return state == "quoted"
+
+
+def _record(subject_id, year, session, paper, timezone, is_completed, score) -> Tuple:
+    if not isinstance(is_completed, bool):
+        raise ValueError("is_completed must be a boolean")
+    score = None if score in (None, "") else int(score)
+    if score is not None and not 0 <= score <= 100:
+        raise ValueError("score must be between 0 and 100")
+    return (str(subject_id), int(year), str(session), str(paper), timezone or None, is_completed, score)
+
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Coalesces rapid writes to the same key and flushes them in batches.
+
+    ``put(user_id, key, value)`` only records the latest value for
+    ``(user_id, key)``; a later put to the same key replaces the pending one
+    (counted as *absorbed*). Every ``window`` seconds the pending values are
+    handed to ``flush(entries)`` as one batch of ``(user_id, key, value)``.
+
+    ``flush_user(user_id)`` writes out one user's pending values and waits for
+    any batch in flight, so reads that follow it see the user's own writes.
+    Entries of a failed batch are put back unless a newer value arrived, as
+    are entries taken for a flush that is cancelled (e.g. by ``stop``). When
+    ``flush`` raises one of ``rejects`` (errors retrying cannot fix, like a
+    constraint violation), the batch is retried entry by entry and the
+    entries it still rejects are logged and dropped (counted as *rejected*).
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Tuple[int, Hashable, Any]]], Awaitable[None]],
+        window: float = 0.5,
+        rejects: Tuple[Type[BaseException], ...] = (),
+    ):
+        self.window = window
+        self.rejects = rejects
+        self._flush = flush
+        self._pending: Dict[Tuple[int, Hashable], Any] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.received = 0
+        self.absorbed = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the timer and write out everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+    def put(self, user_id: int, key: Hashable, value: Any):
+        self.received += 1
+        if (user_id, key) in self._pending:
+            self.absorbed += 1
+        self._pending[(user_id, key)] = value
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush_all(self):
+        async with self._lock:
+            entries, self._pending = self._pending, {}
+            await self._write(entries)
+
+    async def flush_user(self, user_id: int):
+        async with self._lock:
+            keys = [k for k in self._pending if k[0] == user_id]
+            if not keys:
+                return
+            entries = {k: self._pending.pop(k) for k in keys}
+            await self._write(entries)
+
+    def stats(self) -> dict:
+        return {
+            "window_seconds": self.window,
+            "pending": len(self._pending),
+            "received": self.received,
+            "absorbed": self.absorbed,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            if self._pending:
+                try:
+                    await self.flush_all()
+                except Exception:
+                    pass  # logged and requeued by _write; retried next window
+
+    async def _write(self, entries: Dict[Tuple[int, Hashable], Any]):
+        if not entries:
+            return
+        try:
+            await self._flush([(user_id, key, value) for (user_id, key), value in entries.items()])
+        except self.rejects:
+            self.failures += 1
+            logger.warning("Write-behind flush of %d entries was rejected; retrying entry by entry", len(entries))
+            await self._write_each(entries)
+            return
+        except Exception:
+            self.failures += 1
+            logger.exception("Write-behind flush of %d entries failed; requeueing", len(entries))
+            self._requeue(entries)
+            raise
+        except BaseException:
+            self._requeue(entries)
+            raise
+        self.flushed += len(entries)
+        self.batches += 1
+
+    async def _write_each(self, entries: Dict[Tuple[int, Hashable], Any]):
+        remaining = dict(entries)
+        try:
+            for (user_id, key), value in entries.items():
+                try:
+                    await self._flush([(user_id, key, value)])
+                except self.rejects as e:
+                    self.rejected += 1
+                    logger.error("Dropping write-behind entry %r for user %s: %s", key, user_id, e)
+                else:
+                    self.flushed += 1
+                    self.batches += 1
+                del remaining[(user_id, key)]
+        except Exception:
+            self.failures += 1
+            logger.exception("Write-behind flush failed; requeueing %d entries", len(remaining))
+            self._requeue(remaining)
+            raise
+        except BaseException:
+            self._requeue(remaining)
+            raise
+
+    def _requeue(self, entries: Dict[Tuple[int, Hashable], Any]):
+        for k, value in entries.items():
+            self._pending.setdefault(k, value)